@@ -1,25 +1,31 @@
+from __future__ import annotations
+
 import copy
 import logging
-from typing import List
+from typing import List, TYPE_CHECKING
 
 import numpy as np
 import torch
 import torch.nn as nn
-from rlbench.backend.observation import Observation
-from rlbench.demo import Demo
 from yarr.replay_buffer.prioritized_replay_buffer import \
-    PrioritizedReplayBuffer, ObservationElement
+    ObservationElement
 from yarr.replay_buffer.replay_buffer import ReplayElement, ReplayBuffer
 from yarr.replay_buffer.uniform_replay_buffer import UniformReplayBuffer
 
 from arm import demo_loading_utils, utils
-from arm.custom_rlbench_env import CustomRLBenchEnv
+from arm.prioritized_replay_buffer import PrioritizedReplayBuffer
 from arm.network_utils import SiameseNet, DenseBlock, Conv2DBlock, \
     Conv2DUpsampleBlock
 from arm.preprocess_agent import PreprocessAgent
 from arm.arm.next_best_pose_agent import NextBestPoseAgent
 from arm.arm.qattention_agent import QAttentionAgent
 
+if TYPE_CHECKING:
+    # Type hints only; RLBench and PyRep need CoppeliaSim to import.
+    from rlbench.backend.observation import Observation
+    from rlbench.demo import Demo
+    from arm.custom_rlbench_env import CustomRLBenchEnv
+
 REWARD_SCALE = 100.0
 
 
@@ -189,12 +195,8 @@ class ActorNet(nn.Module):
         self._maxp = nn.AdaptiveMaxPool2d(1)
 
     def forward(self, observation_feats, low_dim_ins):
-        low_dim_feats = low_dim_ins
-        _, _, h, w = observation_feats.shape
-        low_dim_feats = low_dim_feats.unsqueeze(
-            -1).unsqueeze(-1).repeat(1, 1, h, w)
-        x = torch.cat([observation_feats, low_dim_feats], dim=1)
-        x = self._convs(x)
+        x = self._convs[0](observation_feats, low_dim_ins)
+        x = self._convs[1:](x)
         x = self._maxp(x).squeeze(-1).squeeze(-1)
         x = self._fcs(x)
         return x
@@ -230,12 +232,8 @@ class CriticNet(nn.Module):
             )
 
     def forward(self, observation_feats, low_dim_ins):
-        low_dim_feats = low_dim_ins
-        _, _, h, w = observation_feats.shape
-        low_dim_feats = low_dim_feats.unsqueeze(
-            -1).unsqueeze(-1).repeat(1, 1, h, w)
-        x = torch.cat([observation_feats, low_dim_feats], dim=1)
-        x = self._convs(x)
+        x = self._convs[0](observation_feats, low_dim_ins)
+        x = self._convs[1:](x)
         if self._q_conf:
             x = self._final_conv(x)
             x[:, 1] = torch.sigmoid(x[:, 1])
@@ -268,6 +266,9 @@ class Qattention2DNet(nn.Module):
         self._output_channels = output_channels
         self._skip_connections = skip_connections
         self._build_calls = 0
+        # Whether forward records (detached, spatially averaged) feature maps.
+        self.capture_latents = True
+        self.downs, self.ups, self.latent = [], [], None
 
     def build(self):
 
@@ -305,26 +306,24 @@ class Qattention2DNet(nn.Module):
 
     def forward(self, observations, low_dim_ins):
         x = self._siamese_net(observations)
-        _, _, h, w = x.shape
-        if low_dim_ins is not None:
-            low_dim_latents = low_dim_ins.unsqueeze(
-                -1).unsqueeze(-1).repeat(1, 1, h, w)
-            x = torch.cat([x, low_dim_latents], dim=1)
+        capture = lambda z: z.detach().flatten(2).mean(-1)
         self.ups = []
         self.downs = []
         layers_for_skip = []
-        for l in self._down:
-            x = l(x)
+        for i, l in enumerate(self._down):
+            x = l(x, low_dim_ins) if i == 0 else l(x)
             layers_for_skip.append(x)
-            self.downs.append(x)
-        self.latent = x
+            if self.capture_latents:
+                self.downs.append(capture(x))
+        self.latent = capture(x) if self.capture_latents else None
         layers_for_skip.reverse()
         for i, l in enumerate(self._up):
             if i > 0 and self._skip_connections:
                 # Skip connections. Skip the first up layer.
                 x = torch.cat([layers_for_skip[i], x], 1)
             x = l(x)
-            self.ups.append(x)
+            if self.capture_latents:
+                self.ups.append(capture(x))
         x = self._final_conv(x)
         return x
 
@@ -11,6 +11,8 @@ from yarr.agents.agent import Agent, Summary, ActResult, \
     ScalarSummary, ImageSummary, HistogramSummary
 
 from arm import utils
+from arm.crop_utils import CropEngine
+from arm.network_utils import EnsembleForward
 from arm.utils import stack_on_channel
 from arm.arm.qattention_agent import QAttentionAgent
 
@@ -23,7 +25,8 @@ REPLAY_BETA = 0.5
 
 class QFunction(nn.Module):
 
-    def __init__(self, critic: nn.Module, shared: nn.Module, q_conf: bool):
+    def __init__(self, critic: nn.Module, shared: nn.Module, q_conf: bool,
+                 fuse_critics: bool = True):
         super(QFunction, self).__init__()
         self._q_conf = q_conf
         self._q1 = copy.deepcopy(critic)
@@ -32,12 +35,18 @@ class QFunction(nn.Module):
         self._q1.build()
         self._q2.build()
         self.shared.build()
+        self._critics = EnsembleForward([self._q1, self._q2]) if (
+            fuse_critics) else None
 
-    def forward(self, observations, robot_state, action):
-        obs_feats = self.shared(observations)
+    def forward(self, observations, robot_state, action, obs_feats=None):
+        if obs_feats is None:
+            obs_feats = self.shared(observations)
         combined = torch.cat([robot_state, action.float()], dim=1)
-        q1 = self._q1(obs_feats, combined)
-        q2 = self._q2(obs_feats, combined)
+        if self._critics is not None:
+            q1, q2 = self._critics(obs_feats, combined)
+        else:
+            q1 = self._q1(obs_feats, combined)
+            q2 = self._q2(obs_feats, combined)
         if self._q_conf:
             b = q1.shape[0]
             q1 = q1.view(b, 2, -1)
@@ -151,11 +160,7 @@ class NextBestPoseAgent(Agent):
 
         self._action_min_max_t = torch.tensor(self._action_min_max).to(device)
 
-        grid_for_crop = torch.arange(
-            0, self._crop_shape[0], device=device).unsqueeze(0).repeat(
-            self._crop_shape[0], 1).unsqueeze(-1)
-        self._grid_for_crop = torch.cat([grid_for_crop.transpose(1, 0),
-                                         grid_for_crop], dim=2).unsqueeze(0)
+        self._crop_engine = CropEngine(*self._crop_shape)
         self._q = QFunction(self._critic_network, self._shared_network, self._q_conf).to(
             device).train(training)
         if training:
@@ -175,13 +180,13 @@ class NextBestPoseAgent(Agent):
                     (np.log(self._alpha)), dtype=torch.float,
                     requires_grad=True, device=device)
                 if training:
-                    self._alpha_optimizer = torch.optim.Adam(
+                    self._alpha_optimizer = utils.create_adam(
                         [self._log_alpha], lr=self._alpha_lr)
 
-            self._critic_optimizer = torch.optim.Adam(
+            self._critic_optimizer = utils.create_adam(
                 self._q.parameters(), lr=self._critic_lr,
                 weight_decay=self._critic_weight_decay)
-            self._actor_optimizer = torch.optim.Adam(
+            self._actor_optimizer = utils.create_adam(
                 self._actor.parameters(), lr=self._actor_lr,
                 weight_decay=self._actor_weight_decay)
 
@@ -199,39 +204,40 @@ class NextBestPoseAgent(Agent):
     def alpha(self):
         return self._log_alpha.exp() if self._alpha_auto_tune else self._alpha
 
-    def _extract_crop(self, pixel_action, observation):
-        # Pixel action will now be (B, 2)
-        observation = stack_on_channel(observation)
-        h = observation.shape[-1]
-        top_left_corner = torch.clamp(
-            pixel_action - self._crop_shape[0] // 2, 0, h - self._crop_shape[1])
-        grid = self._grid_for_crop + top_left_corner.unsqueeze(1).unsqueeze(1)
-        grid = ((grid / float(h)) * 2.0) - 1.0
-        grid = torch.cat((grid[:, :, :, 1:2], grid[:, :, :, 0:1]), dim=-1)
-        crop = F.grid_sample(observation, grid, mode='nearest',
-                             align_corners=True)
-        return crop
+    def _crop_update_inputs(self, replay_sample):
+        # Taken once per update and shared by the critic, actor and summaries.
+        # Get last of time stack and first of plan stack
+        pixel_action = replay_sample[
+                           '%s_pixel_coord' % self._camera_name][:, -1]
+        pixel_action_tp1 = replay_sample[
+                               '%s_pixel_coord_tp1' % self._camera_name][:, -1]
+
+        if self._crop_augmentation:
+            shifted = ((torch.rand_like(pixel_action.float())
+                        * self._crop_shape_t).int() - self._crop_shape_t // 2
+                       ) * replay_sample['demo'].int().unsqueeze(1)
+            # Not in place, the coords are views into the replay sample.
+            pixel_action = pixel_action + shifted
+            pixel_action_tp1 = pixel_action_tp1 + shifted
+
+        return self._preprocess_inputs(
+            replay_sample, pixel_action, pixel_action_tp1)
 
     def _preprocess_inputs(self, replay_sample, pixel_action, pixel_action_tp1):
-        observations = [
-            self._extract_crop(pixel_action,
-                               replay_sample['%s_rgb' % self._camera_name]),
-            self._extract_crop(pixel_action, replay_sample[
-                '%s_point_cloud' % self._camera_name]),
-        ]
-        tp1_observations = [
-            self._extract_crop(pixel_action_tp1,
-                               replay_sample['%s_rgb_tp1' % self._camera_name]),
-            self._extract_crop(pixel_action_tp1, replay_sample[
-                '%s_point_cloud_tp1' % self._camera_name]),
-        ]
+        n = self._camera_name
+        observations, tp1_observations = self._crop_engine.crop(
+            [pixel_action, pixel_action_tp1],
+            [[replay_sample['%s_rgb' % n], replay_sample['%s_point_cloud' % n]],
+             [replay_sample['%s_rgb_tp1' % n],
+              replay_sample['%s_point_cloud_tp1' % n]]])
         return observations, tp1_observations
 
     def _clip_action(self, a):
         return torch.min(torch.max(a, self._action_min_max_t[0:1]),
                          self._action_min_max_t[1:2])
 
-    def _update_critic(self, replay_sample: dict) -> None:
+    def _update_critic(self, replay_sample: dict, observations: list,
+                       tp1_observations: list) -> None:
         action = replay_sample['action']
         reward = replay_sample['reward']
 
@@ -239,25 +245,9 @@ class NextBestPoseAgent(Agent):
         robot_state_tp1 = stack_on_channel(
             replay_sample['low_dim_state_tp1'][:, -1:])
 
-        # Get last of time stack and first of plan stack
-        pixel_action = replay_sample[
-                           '%s_pixel_coord' % self._camera_name][:, -1]
-        pixel_action_tp1 = replay_sample[
-                               '%s_pixel_coord_tp1' % self._camera_name][:, -1]
-
-        if self._crop_augmentation:
-            shifted = ((torch.rand_like(pixel_action.float())
-                        * self._crop_shape_t).int() - self._crop_shape_t // 2
-                       ) * replay_sample['demo'].int().unsqueeze(1)
-            pixel_action += shifted
-            pixel_action_tp1 += shifted
-
         # Don't want timeouts to be classed as terminals
         terminal = replay_sample['terminal'].float() - replay_sample['timeout'].float()
 
-        observations, tp1_observations = self._preprocess_inputs(
-            replay_sample, pixel_action, pixel_action_tp1)
-
         q1, q2, _, _ = self._q(observations, robot_state, action)
 
         with torch.no_grad():
@@ -310,24 +300,9 @@ class NextBestPoseAgent(Agent):
         self._grad_step(critic_loss, self._critic_optimizer,
                         self._q.parameters(), self._critic_grad_clip)
 
-    def _update_actor(self, replay_sample: dict) -> None:
+    def _update_actor(self, replay_sample: dict, observations: list) -> None:
 
         robot_state = stack_on_channel(replay_sample['low_dim_state'][:, -1:])
-        pixel_action = replay_sample['%s_pixel_coord' % self._camera_name][:, -1]
-
-        if self._crop_augmentation:
-            shifted = ((torch.rand_like(pixel_action.float())
-                        * self._crop_shape_t).int() - self._crop_shape_t // 2
-                       ) * replay_sample['demo'].int().unsqueeze(1)
-            pixel_action += shifted
-
-        # Crop the observations
-        observations = [
-            self._extract_crop(pixel_action,
-                               replay_sample['%s_rgb' % self._camera_name]),
-            self._extract_crop(pixel_action, replay_sample[
-                '%s_point_cloud' % self._camera_name]),
-        ]
 
         with torch.no_grad():
             obs_feats = self._q.shared(observations)
@@ -335,7 +310,9 @@ class NextBestPoseAgent(Agent):
         mu, pi, self._logp_pi, log_scale_diag = self._actor(
             obs_feats, robot_state)
 
-        _, _, q1_pi, q2_pi = self._q(observations, robot_state, pi)
+        # The critic is frozen here, so its shared features are the actor's.
+        _, _, q1_pi, q2_pi = self._q(observations, robot_state, pi,
+                                     obs_feats=obs_feats)
 
         min_q_pi = torch.min(q1_pi, q2_pi)[:, 0]
         pi_loss = (self.alpha * self._logp_pi - min_q_pi)
@@ -370,14 +347,16 @@ class NextBestPoseAgent(Agent):
     def update(self, step: int, replay_sample: dict) -> dict:
         info = self._qattention_agent.update(step, replay_sample)
 
-        self._update_critic(replay_sample)
+        observations, tp1_observations = self._crop_update_inputs(
+            replay_sample)
+        self._update_critic(replay_sample, observations, tp1_observations)
 
         # Freeze critic so you don't waste computational effort
         # computing gradients for them during the policy learning step.
         for p in self._q.parameters():
             p.requires_grad = False
 
-        self._update_actor(replay_sample)
+        self._update_actor(replay_sample, observations)
         if self._alpha_auto_tune:
             self._update_alpha()
 
@@ -396,14 +375,10 @@ class NextBestPoseAgent(Agent):
             deterministic=False) -> ActResult:
         with torch.no_grad():
             act_res = self._qattention_agent.act(step, observation, deterministic)
-            observations = [
-                self._extract_crop(
-                    act_res.action.unsqueeze(0),
-                    observation['%s_rgb' % self._camera_name]),
-                self._extract_crop(
-                    act_res.action.unsqueeze(0),
-                    observation['%s_point_cloud' % self._camera_name]),
-            ]
+            observations = self._crop_engine.crop(
+                [act_res.action.unsqueeze(0)], [[
+                    observation['%s_rgb' % self._camera_name],
+                    observation['%s_point_cloud' % self._camera_name]]])[0]
             self._act_crop_summaries = observations
             robot_state = stack_on_channel(observation['low_dim_state'][:, -1:])
             obs_feats = self._q.shared(observations)
@@ -414,6 +389,18 @@ class NextBestPoseAgent(Agent):
             })
             return act_res
 
+    def update_keys(self) -> List[str]:
+        keys = ['%s_%s' % (self._camera_name, k) for k in [
+            'rgb', 'rgb_tp1', 'point_cloud', 'point_cloud_tp1', 'pixel_coord',
+            'pixel_coord_tp1']]
+        keys += ['action', 'reward', 'terminal', 'timeout', 'demo',
+                 'low_dim_state', 'low_dim_state_tp1', 'sampling_probabilities']
+        return keys + [k for k in self._qattention_agent.update_keys()
+                       if k not in keys]
+
+    def summary_keys(self) -> List[str]:
+        return self._qattention_agent.summary_keys()
+
     def update_summaries(self) -> List[Summary]:
 
         summaries = [
@@ -13,6 +13,7 @@ from yarr.agents.agent import Agent, ActResult, ScalarSummary, \
     HistogramSummary, ImageSummary, Summary
 
 from arm import utils
+from arm.network_utils import EnsembleForward
 from arm.utils import stack_on_channel
 
 NAME = 'QAttentionAgent'
@@ -22,12 +23,17 @@ REPLAY_BETA = 1.0
 class QFunction(nn.Module):
 
     def __init__(self,
-                 unet: nn.Module):
+                 unet: nn.Module,
+                 fuse_critics: bool = True):
         super(QFunction, self).__init__()
         self._qnet = copy.deepcopy(unet)
         self._qnet2 = copy.deepcopy(unet)
         self._qnet.build()
         self._qnet2.build()
+        # Runs both nets in one batched pass; not a submodule, so the
+        # state_dict keeps its _qnet / _qnet2 keys.
+        self._critics = EnsembleForward([self._qnet, self._qnet2]) if (
+            fuse_critics) else None
 
     def _argmax_2d(self, tensor):
         t_shape = tensor.shape
@@ -36,8 +42,11 @@ class QFunction(nn.Module):
         return indices
 
     def forward(self, x, robot_state):
-        q = self._qnet(x, robot_state)[:, 0]
-        q2 = self._qnet2(x, robot_state)[:, 0]
+        if self._critics is not None:
+            q, q2 = [o[:, 0] for o in self._critics(x, robot_state)]
+        else:
+            q = self._qnet(x, robot_state)[:, 0]
+            q2 = self._qnet2(x, robot_state)[:, 0]
         coords = self._argmax_2d(torch.min(q, q2))
         return q, q2, coords
 
@@ -76,7 +85,7 @@ class QAttentionAgent(Agent):
             for p in self._q_target.parameters():
                 p.requires_grad = False
             utils.soft_updates(self._q, self._q_target, 1.0)
-            self._optimizer = torch.optim.Adam(
+            self._optimizer = utils.create_adam(
                 self._q.parameters(), lr=self._lr,
                 weight_decay=self._weight_decay)
             logging.info('# Q-attention Params: %d' % sum(
@@ -192,6 +201,18 @@ class QAttentionAgent(Agent):
         ret = PIL.Image.blend(img, h_img, 0.75)
         return transforms.ToTensor()(ret).unsqueeze_(0)
 
+    def update_keys(self) -> List[str]:
+        keys = ['%s_%s' % (self._camera_name, k) for k in [
+            'rgb', 'rgb_tp1', 'point_cloud', 'point_cloud_tp1', 'pixel_coord']]
+        keys += ['front_rgb', 'reward', 'terminal', 'timeout',
+                 'sampling_probabilities']
+        if self._include_low_dim_state:
+            keys += ['low_dim_state', 'low_dim_state_tp1']
+        return keys
+
+    def summary_keys(self) -> List[str]:
+        return []
+
     def update_summaries(self) -> List[Summary]:
         summaries = [
             ImageSummary('%s/Q' % NAME, QAttentionAgent.generate_heatmap(
@@ -48,7 +48,7 @@ class BCAgent(Agent):
             device = torch.device('cpu')
         self._actor = Actor(self._actor_network).to(device).train(training)
         if training:
-            self._actor_optimizer = torch.optim.Adam(
+            self._actor_optimizer = utils.create_adam(
                 self._actor.parameters(), lr=self._lr,
                 weight_decay=self._weight_decay)
             logging.info('# Actor Params: %d' % sum(
@@ -100,6 +100,14 @@ class BCAgent(Agent):
                 [mu[:, :3], self._normalize_quat(mu[:, 3:7]), mu[:, 7:]], dim=-1)
             return ActResult(mu[0])
 
+    def update_keys(self) -> List[str]:
+        keys = ['%s_%s' % (self._camera_name, k) for k in [
+            'rgb', 'point_cloud']]
+        return keys + ['action', 'low_dim_state', 'sampling_probabilities']
+
+    def summary_keys(self) -> List[str]:
+        return []
+
     def update_summaries(self) -> List[Summary]:
         summaries = []
         for n, v in self._summaries.items():
@@ -55,7 +55,7 @@ class DACAgent(SACAgent):
         if training:
             self._discrim = Discriminator(self._discriminator_network).to(
                 device).train(training)
-            self._discrim_optimizer = torch.optim.Adam(
+            self._discrim_optimizer = utils.create_adam(
                 self._discrim.parameters(), lr=self._discriminator_lr,
                 weight_decay=self._discriminator_weight_decay)
             logging.info('# Discriminator Params: %d' % sum(
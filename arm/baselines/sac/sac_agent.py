@@ -11,6 +11,7 @@ from yarr.agents.agent import Agent, Summary, ActResult, \
     ScalarSummary, HistogramSummary, ImageSummary
 
 from arm import utils
+from arm.network_utils import EnsembleForward
 from arm.utils import stack_on_channel
 
 NAME = 'SACAgent'
@@ -22,7 +23,8 @@ REPLAY_BETA = 0.5
 
 class QFunction(nn.Module):
 
-    def __init__(self, critic: nn.Module, encoder: nn.Module):
+    def __init__(self, critic: nn.Module, encoder: nn.Module,
+                 fuse_critics: bool = True):
         super(QFunction, self).__init__()
         self._q1 = copy.deepcopy(critic)
         self._q2 = copy.deepcopy(critic)
@@ -30,12 +32,17 @@ class QFunction(nn.Module):
         self._q1.build()
         self._q2.build()
         self.encoder.build()
+        self._critics = EnsembleForward([self._q1, self._q2]) if (
+            fuse_critics) else None
 
     def forward(self, observations, robot_state, action):
         combined = torch.cat([robot_state, action.float()], dim=1)
         latents = self.encoder(observations)
-        q1 = self._q1(latents, combined)
-        q2 = self._q2(latents, combined)
+        if self._critics is not None:
+            q1, q2 = self._critics(latents, combined)
+        else:
+            q1 = self._q1(latents, combined)
+            q2 = self._q2(latents, combined)
         return q1, q2
 
 
@@ -165,18 +172,18 @@ class SACAgent(Agent):
             for p in self._q_target.parameters():
                 p.requires_grad = False
 
-            self._critic_optimizer = torch.optim.Adam(
+            self._critic_optimizer = utils.create_adam(
                 list(self._q.parameters()), lr=self._critic_lr,
                 weight_decay=self._critic_weight_decay)
 
-            self._encoder_optimizer = torch.optim.Adam(
+            self._encoder_optimizer = utils.create_adam(
                 self._q.encoder.parameters(), lr=self._decoder_lr)
 
-            self._decoder_optimizer = torch.optim.Adam(
+            self._decoder_optimizer = utils.create_adam(
                 self._decoder.parameters(), lr=self._decoder_lr,
                 weight_decay=self._decoder_weight_decay)
 
-            self._actor_optimizer = torch.optim.Adam(
+            self._actor_optimizer = utils.create_adam(
                 self._actor.get_params(), lr=self._actor_lr,
                 weight_decay=self._actor_weight_decay)
 
@@ -186,7 +193,7 @@ class SACAgent(Agent):
                     (np.log(self._alpha)), dtype=torch.float,
                     requires_grad=True, device=device)
                 if training:
-                    self._alpha_optimizer = torch.optim.Adam(
+                    self._alpha_optimizer = utils.create_adam(
                         [self._log_alpha], lr=self._alpha_lr)
             else:
                 self._alpha = torch.tensor(
@@ -393,6 +400,15 @@ class SACAgent(Agent):
             mu, pi, _, _ = self._actor(observations, robot_state)
             return ActResult((mu if deterministic else pi)[0])
 
+    def update_keys(self) -> List[str]:
+        keys = ['%s_%s' % (self._camera_name, k) for k in [
+            'rgb', 'rgb_tp1', 'point_cloud', 'point_cloud_tp1']]
+        return keys + ['action', 'reward', 'terminal', 'low_dim_state',
+                       'low_dim_state_tp1', 'sampling_probabilities']
+
+    def summary_keys(self) -> List[str]:
+        return []
+
     def update_summaries(self) -> List[Summary]:
 
         summaries = []
@@ -1,20 +1,24 @@
+from __future__ import annotations
+
 import logging
-from typing import List
+from typing import List, TYPE_CHECKING
 
 import numpy as np
-from rlbench.backend.observation import Observation
-from rlbench.demo import Demo
-from yarr.replay_buffer.prioritized_replay_buffer import \
-    PrioritizedReplayBuffer
 from yarr.replay_buffer.replay_buffer import ReplayElement, ReplayBuffer
 from yarr.replay_buffer.uniform_replay_buffer import UniformReplayBuffer
 
 from arm import demo_loading_utils, utils
+from arm.prioritized_replay_buffer import PrioritizedReplayBuffer
 from arm.baselines.td3.td3_agent import TD3Agent
-from arm.custom_rlbench_env import CustomRLBenchEnv
 from arm.network_utils import SiameseNet, CNNAndFcsNet
 from arm.preprocess_agent import PreprocessAgent
 
+if TYPE_CHECKING:
+    # Type hints only; RLBench and PyRep need CoppeliaSim to import.
+    from rlbench.backend.observation import Observation
+    from rlbench.demo import Demo
+    from arm.custom_rlbench_env import CustomRLBenchEnv
+
 REWARD_SCALE = 100.0
 
 
@@ -11,6 +11,7 @@ from yarr.agents.agent import Agent, Summary, ActResult, \
     ScalarSummary, HistogramSummary
 
 from arm import utils
+from arm.network_utils import EnsembleForward
 from arm.utils import stack_on_channel
 
 NAME = 'TD3Agent'
@@ -20,17 +21,24 @@ REPLAY_BETA = 0.4
 
 class QFunction(nn.Module):
 
-    def __init__(self, critic: nn.Module):
+    def __init__(self, critic: nn.Module, fuse_critics: bool = True):
         super(QFunction, self).__init__()
         self._q1 = copy.deepcopy(critic)
         self._q2 = copy.deepcopy(critic)
         self._q1.build()
         self._q2.build()
+        self._critics = EnsembleForward([self._q1, self._q2]) if (
+            fuse_critics) else None
 
     def forward(self, observations, robot_state, action, q1_only=False):
         combined = torch.cat([robot_state, action.float()], dim=1)
-        q1 = self._q1(observations, combined)
-        q2 = None if q1_only else self._q2(observations, combined)
+        if q1_only:
+            return self._q1(observations, combined), None
+        if self._critics is not None:
+            q1, q2 = self._critics(observations, combined)
+        else:
+            q1 = self._q1(observations, combined)
+            q2 = self._q2(observations, combined)
         return q1, q2
 
 
@@ -114,10 +122,10 @@ class TD3Agent(Agent):
             for p in self._q_target.parameters():
                 p.requires_grad = False
 
-            self._critic_optimizer = torch.optim.Adam(
+            self._critic_optimizer = utils.create_adam(
                 self._q.parameters(), lr=self._critic_lr,
                 weight_decay=self._critic_weight_decay)
-            self._actor_optimizer = torch.optim.Adam(
+            self._actor_optimizer = utils.create_adam(
                 self._actor.parameters(), lr=self._actor_lr,
                 weight_decay=self._actor_weight_decay)
 
@@ -271,6 +279,15 @@ class TD3Agent(Agent):
                     [pi[:, :3], self._actor._normalize(pi[:, 3:7]), pi[:, 7:]], dim=-1)
             return ActResult(pi[0])
 
+    def update_keys(self) -> List[str]:
+        keys = ['%s_%s' % (self._camera_name, k) for k in [
+            'rgb', 'rgb_tp1', 'point_cloud', 'point_cloud_tp1']]
+        return keys + ['action', 'reward', 'terminal', 'low_dim_state',
+                       'low_dim_state_tp1', 'sampling_probabilities']
+
+    def summary_keys(self) -> List[str]:
+        return []
+
     def update_summaries(self) -> List[Summary]:
 
         summaries = []
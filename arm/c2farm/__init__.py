@@ -1 +1,12 @@
-import arm.c2farm.launch_utils
+import importlib
+
+
+def __getattr__(name):
+    # Submodules are imported on first use, so that the networks, voxel grid
+    # and predictor can be used without the training dependencies that
+    # launch_utils pulls in (RLBench, YARR, hydra).
+    if name in ['cost_model', 'distillation', 'launch_utils', 'networks',
+                'predictor', 'qattention_agent', 'qattention_stack_agent',
+                'qfunction', 'sparse_conv', 'voxel_grid']:
+        return importlib.import_module('arm.c2farm.%s' % name)
+    raise AttributeError("module 'arm.c2farm' has no attribute '%s'" % name)
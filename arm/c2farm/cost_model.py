@@ -0,0 +1,271 @@
+"""Costs of a C2F-ARM configuration, worked out without an environment.
+
+The networks of every depth are instantiated from the config as create_agent
+makes them. Each gets its parameter count, forward FLOPs and activation
+memory per sample, and forward, backward and voxelisation latency on the
+local device. The replay element sizes give the replay bytes per
+transition. learner_memory and max_batch_size combine these into a learner
+memory estimate and the largest batch that fits a memory budget.
+
+FLOPs count the convs and linear layers (a multiply-add is two). Activation
+memory is what autograd saves for backward in a training forward pass,
+counted with saved tensor hooks where PyTorch has them (1.10 on). Older
+versions sum the outputs of the leaf modules instead, which misses the
+functional ops and comes out about half as large. On CUDA the measured peak
+memory is reported as well.
+"""
+import time
+from typing import Dict, List
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from arm.c2farm.networks import create_qattention_networks
+from arm.c2farm.voxel_grid import VoxelGrid
+
+VOXEL_FEATURE_SIZE = 3
+# Float32 copies of every parameter the learner keeps: the weights, their
+# gradients, Adam's two moments and the target network's weights.
+PARAMETER_COPIES = 5
+
+
+def _flops(module, inputs, output) -> int:
+    x = inputs[0]
+    if isinstance(module, (nn.Conv2d, nn.Conv3d)):
+        per_output = module.in_channels // module.groups * int(
+            np.prod(module.kernel_size))
+        return 2 * output.numel() * per_output
+    if isinstance(module, (nn.ConvTranspose2d, nn.ConvTranspose3d)):
+        per_input = module.out_channels // module.groups * int(
+            np.prod(module.kernel_size))
+        return 2 * x.numel() * per_input
+    if isinstance(module, nn.Linear):
+        return 2 * x.numel() * module.out_features
+    return 0
+
+
+def _tensor_bytes(output) -> int:
+    if isinstance(output, torch.Tensor):
+        return output.numel() * output.element_size()
+    if isinstance(output, (list, tuple)):
+        return sum(_tensor_bytes(o) for o in output)
+    return 0
+
+
+def _saved_bytes(net, x, proprio) -> int:
+    # Bytes of the distinct non parameter tensors autograd saves.
+    params = {p.data_ptr() for p in net.parameters()}
+    saved = {}
+
+    def pack(t):
+        if t.data_ptr() not in params:
+            saved[t.data_ptr()] = max(saved.get(t.data_ptr(), 0),
+                                      t.numel() * t.element_size())
+        return t
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        net(x, proprio, None)
+    return sum(saved.values())
+
+
+def network_inputs(net: nn.Module, batch_size: int,
+                   device: torch.device) -> tuple:
+    """Occupied, table-top like voxel grids and proprioception for net."""
+    v = net._voxel_size
+    x = torch.zeros(batch_size, net._in_channels, v, v, v, device=device)
+    x[:, 3:6] = torch.rand(batch_size, 3, v, v, v, device=device) * 2 - 1
+    x[:, -1, :v // 4 + 1] = 1.
+    x[:, -1, v // 2:v // 2 + v // 4, v // 4:v // 2, v // 4:v // 2] = 1.
+    proprio = torch.randn(batch_size, net._low_dim_size, device=device)
+    return x, proprio
+
+
+def _time(fn, iterations: int, device: torch.device) -> float:
+    fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    return (time.perf_counter() - start) / iterations * 1e3
+
+
+def profile_network(net: nn.Module, batch_size: int,
+                    device: torch.device, iterations: int = 5) -> dict:
+    """Parameters, per sample forward FLOPs and activation bytes, and the
+    forward and backward milliseconds of a batch, for an unbuilt
+    create_qattention_networks network. net is built in place."""
+    net._dev = device
+    net.build()
+    net.to(device).train()
+    net.capture_latents = False
+    stats = {'flops': 0, 'activation_bytes': 0}
+
+    def hook(module, inputs, output):
+        stats['flops'] += _flops(module, inputs, output)
+        stats['activation_bytes'] += _tensor_bytes(output)
+
+    handles = [m.register_forward_hook(hook) for m in net.modules()
+               if len(list(m.children())) == 0]
+    x, proprio = network_inputs(net, 1, device)
+    net(x, proprio, None)
+    for h in handles:
+        h.remove()
+    if hasattr(getattr(torch.autograd, 'graph', None),
+               'saved_tensors_hooks'):
+        stats['activation_bytes'] = _saved_bytes(net, x, proprio)
+
+    x, proprio = network_inputs(net, batch_size, device)
+
+    def forward():
+        with torch.no_grad():
+            net(x, proprio, None)
+
+    def forward_backward():
+        net.zero_grad()
+        trans, rot_grip = net(x, proprio, None)
+        loss = trans.mean()
+        if rot_grip is not None:
+            loss = loss + rot_grip.mean()
+        loss.backward()
+
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+    forward_ms = _time(forward, iterations, device)
+    forward_backward_ms = _time(forward_backward, iterations, device)
+    profile = {
+        'params': sum(p.numel() for p in net.parameters()),
+        'flops': stats['flops'],
+        'activation_bytes': stats['activation_bytes'],
+        'batch_size': batch_size,
+        'forward_ms': forward_ms,
+        'backward_ms': max(0., forward_backward_ms - forward_ms),
+    }
+    if device.type == 'cuda':
+        profile['peak_cuda_bytes'] = torch.cuda.max_memory_allocated(device)
+    return profile
+
+
+def voxelisation_ms(voxel_size: int, num_points: int, batch_size: int,
+                    device: torch.device, iterations: int = 5) -> float:
+    """Milliseconds VoxelGrid takes to voxelise batch_size point clouds of
+    num_points coloured points."""
+    bounds = [-0.3, -0.5, 0.6, 0.7, 0.5, 1.6]
+    grid = VoxelGrid(coord_bounds=bounds, voxel_size=voxel_size,
+                     device=device, batch_size=batch_size,
+                     feature_size=VOXEL_FEATURE_SIZE,
+                     max_num_coords=num_points)
+    lo = torch.tensor(bounds[:3], device=device)
+    hi = torch.tensor(bounds[3:], device=device)
+    points = lo + torch.rand(batch_size, num_points, 3, device=device) * (
+        hi - lo)
+    features = torch.rand(batch_size, num_points, VOXEL_FEATURE_SIZE,
+                          device=device)
+    coord_bounds = torch.tensor(bounds, device=device).unsqueeze(0).repeat(
+        batch_size, 1)
+    return _time(lambda: grid.coords_to_bounding_voxel_grid(
+        points, coord_features=features, coord_bounds=coord_bounds),
+        iterations, device)
+
+
+def replay_bytes_per_transition(cfg, low_dim_size: int) -> Dict[str, int]:
+    """Bytes of every element create_replay and the environment store per
+    transition, by element. The next observation is the next transition's,
+    so it is not counted twice."""
+    h, w = cfg.rlbench.camera_resolution
+    depths = len(cfg.method.voxel_sizes)
+    compact_depth = cfg.rlbench.get('compact_depth', False)
+    elements = {'low_dim_state': low_dim_size * 4}
+    for n in cfg.rlbench.cameras:
+        elements['%s_rgb' % n] = 3 * h * w
+        if compact_depth:
+            elements['%s_depth' % n] = h * w * 2
+            elements['%s_camera_extrinsics' % n] = 16 * 4
+            elements['%s_camera_intrinsics' % n] = 9 * 4
+        else:
+            elements['%s_point_cloud' % n] = 3 * h * w * 4
+        elements['%s_pixel_coord' % n] = 2 * 4
+    elements.update({
+        'trans_action_indicies': 3 * depths * 4,
+        'rot_grip_action_indicies': 4 * 4,
+        'action': 8 * 4,
+        'reward': 4,
+        # terminal, timeout and demo flags.
+        'flags': 3,
+    })
+    for depth in range(depths):
+        elements['attention_coordinate_layer_%d' % depth] = 3 * 4
+    return elements
+
+
+def _device_bytes_per_sample(cfg, low_dim_size: int) -> int:
+    # The float32 images, point clouds (rebuilt from depth with
+    # compact_depth) and proprioception of a sample at t and t + 1, as
+    # PreprocessAgent hands them to the depths.
+    h, w = cfg.rlbench.camera_resolution
+    per_camera = (3 + 3) * h * w * 4
+    return 2 * (len(cfg.rlbench.cameras) * per_camera + low_dim_size * 4)
+
+
+def _cameras_at_depth(cfg, depth: int) -> List[int]:
+    # The image sizes each depth voxelises; depths after the first see
+    # crops of the non wrist cameras.
+    h, w = cfg.rlbench.camera_resolution
+    crop = cfg.method.image_crop_size
+    return [crop * crop if depth > 0 and 'wrist' not in n else h * w
+            for n in cfg.rlbench.cameras]
+
+
+def profile_config(cfg, low_dim_size: int, device: torch.device,
+                   batch_size: int = None, iterations: int = 5) -> dict:
+    """profile_network and voxelisation_ms for every depth of the config
+    (batch_size defaults to replay.batch_size), with the replay bytes per
+    transition."""
+    batch_size = batch_size or cfg.replay.batch_size
+    depths = []
+    for depth, net in enumerate(create_qattention_networks(
+            cfg.method, low_dim_size)):
+        profile = profile_network(net, batch_size, device, iterations)
+        # Every update voxelises the observations at t and t + 1.
+        profile['voxelise_ms'] = 2 * voxelisation_ms(
+            net._voxel_size, sum(_cameras_at_depth(cfg, depth)), batch_size,
+            device, iterations)
+        depths.append(profile)
+    replay = replay_bytes_per_transition(cfg, low_dim_size)
+    return {
+        'depths': depths,
+        'replay_bytes': replay,
+        'replay_bytes_per_transition': sum(replay.values()),
+        'device_bytes_per_sample': _device_bytes_per_sample(
+            cfg, low_dim_size),
+        'concurrent_updates': cfg.method.get(
+            'concurrent_depth_updates', False),
+    }
+
+
+def learner_memory(profile: dict, batch_size: int) -> Dict[str, int]:
+    """Estimated learner bytes for a profile_config at batch_size: fixed
+    (weights, gradients, optimiser and target copies), the replay batch on
+    the device and the activations. Depths update one after another, so
+    only the largest depth's activations count, unless they update
+    concurrently."""
+    fixed = sum(d['params'] * 4 * PARAMETER_COPIES
+                for d in profile['depths'])
+    batch = profile['device_bytes_per_sample'] * batch_size
+    activations = [d['activation_bytes'] * batch_size
+                   for d in profile['depths']]
+    activation = sum(activations) if profile['concurrent_updates'] else max(
+        activations)
+    return {'fixed': fixed, 'batch': batch, 'activations': activation,
+            'total': fixed + batch + activation}
+
+
+def max_batch_size(profile: dict, budget_bytes: int) -> int:
+    """The largest batch size whose learner_memory fits budget_bytes, or 0
+    when not even one sample does."""
+    fixed = learner_memory(profile, 0)['total']
+    per_sample = learner_memory(profile, 1)['total'] - fixed
+    return max(0, int((budget_bytes - fixed) // per_sample))
@@ -0,0 +1,113 @@
+"""Distillation of a depth's Q-attention network into a narrower student
+for acting.
+
+Acting workers only need the greedy action, so a student with fewer kernels
+and dense features is trained, on the voxel grids of the learner's replay
+samples, to pick the teacher's translation argmax and to match the teacher's
+rotation logits and gripper values (the per channel maxima of the translation
+Q-values). The student's agreement with the teacher is measured on every
+batch before the student trains on it; QAttentionAgent acts with the student
+only while that agreement stays above a threshold.
+"""
+from collections import deque
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from arm import utils
+from arm.c2farm.qfunction import QFunction
+
+
+def student_network(teacher: nn.Module, kernels: int,
+                    dense_feats: int) -> nn.Module:
+    """An unbuilt copy of the teacher's architecture, narrower."""
+    hparams = teacher.hparams()
+    hparams.update(kernels=kernels, dense_feats=dense_feats)
+    return type(teacher)(**hparams)
+
+
+def greedy_actions(q: QFunction, q_trans, q_rot_grip) -> torch.Tensor:
+    """The (B, 3) voxel indices, then rotation and gripper indices if any,
+    that q would act with."""
+    return torch.cat([a for a in q.choose_highest_action(q_trans, q_rot_grip)
+                      if a is not None], 1)
+
+
+class Distiller(object):
+
+    def __init__(self,
+                 teacher: nn.Module,
+                 rotation_resolution: float,
+                 device: torch.device,
+                 kernels: int = 16,
+                 dense_feats: int = 32,
+                 lr: float = 0.001,
+                 temperature: float = 1.0,
+                 agreement_window: int = 100):
+        self.network = student_network(teacher, kernels, dense_feats)
+        self.q = QFunction(self.network, None, None, rotation_resolution,
+                           device).to(device).train(True)
+        self.q._qnet.capture_latents = False
+        self._num_rotation_classes = int(360 // rotation_resolution)
+        self._temperature = temperature
+        self._agreements = deque(maxlen=agreement_window)
+        self._optimizer = utils.create_adam(self.q.parameters(), lr=lr)
+
+    @property
+    def agreement(self) -> float:
+        """Fraction of the last agreement_window batches' samples on which
+        the student picked the teacher's action; 0 until the window is
+        full."""
+        if len(self._agreements) < self._agreements.maxlen:
+            return 0.
+        return torch.stack(list(self._agreements)).mean().item()
+
+    def update(self, voxel_grid, proprio, q_trans, q_rot_grip) -> dict:
+        """One step on a batch of voxel grids and the teacher's outputs for
+        them. Returns the summaries of the step."""
+        voxel_grid, q_trans = voxel_grid.detach(), q_trans.detach()
+        student_trans, student_rot_grip = self.q._qnet(
+            voxel_grid, proprio, None)
+
+        with torch.no_grad():
+            teacher_actions = greedy_actions(self.q, q_trans, q_rot_grip)
+            agreement = (greedy_actions(
+                self.q, student_trans, student_rot_grip) ==
+                teacher_actions).all(1).float().mean()
+        # Kept on the device; only read when agreement is asked for.
+        self._agreements.append(agreement)
+
+        # Per channel argmax voxel, as choose_highest_action picks it.
+        b, c = q_trans.shape[:2]
+        student_flat = student_trans.reshape(b, c, -1)
+        teacher_flat = q_trans.reshape(b, c, -1)
+        trans_loss = F.cross_entropy(
+            student_flat.reshape(b * c, -1),
+            teacher_flat.argmax(-1).reshape(b * c))
+        grip_loss = F.mse_loss(student_flat.max(-1)[0],
+                               teacher_flat.max(-1)[0])
+        loss = trans_loss + grip_loss
+        rot_loss = None
+        if q_rot_grip is not None:
+            t = self._temperature
+            n = self._num_rotation_classes
+            rot_loss = F.kl_div(
+                F.log_softmax(student_rot_grip.reshape(-1, n) / t, -1),
+                F.softmax(q_rot_grip.detach().reshape(-1, n) / t, -1),
+                reduction='batchmean') * t * t
+            loss = loss + rot_loss
+
+        self._optimizer.zero_grad()
+        loss.backward()
+        self._optimizer.step()
+
+        summaries = {
+            'distillation/loss': loss.detach(),
+            'distillation/translation_loss': trans_loss.detach(),
+            'distillation/gripper_loss': grip_loss.detach(),
+            'distillation/agreement': agreement,
+        }
+        if rot_loss is not None:
+            summaries['distillation/rotation_loss'] = rot_loss.detach()
+        return summaries
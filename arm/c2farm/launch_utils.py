@@ -1,26 +1,32 @@
+from __future__ import annotations
+
 import logging
-from typing import List
+from typing import List, TYPE_CHECKING
 import copy 
 from copy import deepcopy
 import numpy as np
 from omegaconf import DictConfig
-from rlbench.backend.observation import Observation
-from rlbench.backend.utils import task_file_to_task_class
-from rlbench.demo import Demo
 from yarr.envs.env import Env
 from yarr.replay_buffer.prioritized_replay_buffer import \
-    PrioritizedReplayBuffer, ObservationElement
+    ObservationElement
 from yarr.replay_buffer.replay_buffer import ReplayElement, ReplayBuffer
 from yarr.replay_buffer.uniform_replay_buffer import UniformReplayBuffer
 
 from arm import demo_loading_utils, utils
-from arm.custom_rlbench_env import CustomRLBenchEnv, MultiTaskRLBenchEnv
+from arm.prioritized_replay_buffer import PrioritizedReplayBuffer
 from arm.preprocess_agent import PreprocessAgent
-from arm.c2farm.networks import Qattention3DNet
+from arm.c2farm.networks import create_qattention_networks
 from arm.c2farm.qattention_agent import QAttentionAgent
 from arm.c2farm.qattention_stack_agent import QAttentionStackAgent
 
 from collections import OrderedDict
+
+if TYPE_CHECKING:
+    # Type hints only; RLBench and PyRep need CoppeliaSim to import.
+    from rlbench.backend.observation import Observation
+    from rlbench.demo import Demo
+    from arm.custom_rlbench_env import CustomRLBenchEnv, MultiTaskRLBenchEnv
+
 REWARD_SCALE = 100.0
 
 
@@ -252,41 +258,14 @@ def create_and_fill_replays(
     return replays
 
 def create_agent(cfg: DictConfig, env, depth_0bounds=None, cam_resolution=None):
-    VOXEL_FEATS = 3
-    LATENT_SIZE = 64
     depth_0bounds = depth_0bounds or [-0.3, -0.5, 0.6, 0.7, 0.5, 1.6]
     cam_resolution = cam_resolution or [128, 128]
 
-    include_prev_layer = False
-
     num_rotation_classes = int(360. // cfg.method.rotation_resolution)
     qattention_agents = []
-    for depth, vox_size in enumerate(cfg.method.voxel_sizes):
-        if depth == 0:
-            unet3d = Qattention3DNet(
-                in_channels=VOXEL_FEATS + 3 + 1 + 3,
-                out_channels=1,
-                voxel_size=vox_size,
-                out_dense=0,
-                kernels=LATENT_SIZE,
-                norm=None if 'None' in cfg.method.norm else cfg.method.norm,
-                dense_feats=128,
-                activation=cfg.method.activation,
-                low_dim_size=env.low_dim_state_len)
-        else:
-            last = depth == len(cfg.method.voxel_sizes) - 1
-            unet3d = Qattention3DNet(
-                in_channels=VOXEL_FEATS + 3 + 1 + 3,
-                out_channels=2,
-                voxel_size=vox_size,
-                out_dense=(num_rotation_classes * 3) if last else 0,
-                kernels=LATENT_SIZE,
-                dense_feats=128,
-                norm=None if 'None' in cfg.method.norm else cfg.method.norm,
-                activation=cfg.method.activation,
-                low_dim_size=env.low_dim_state_len,
-                include_prev_layer=include_prev_layer)
-
+    unet3ds = create_qattention_networks(cfg.method, env.low_dim_state_len)
+    for depth, (vox_size, unet3d) in enumerate(
+            zip(cfg.method.voxel_sizes, unet3ds)):
         qattention_agent = QAttentionAgent(
             layer=depth,
             coordinate_bounds=depth_0bounds,
@@ -308,7 +287,16 @@ def create_agent(cfg: DictConfig, env, depth_0bounds=None, cam_resolution=None):
             num_rotation_classes=num_rotation_classes,
             rotation_resolution=cfg.method.rotation_resolution,
             grad_clip=0.01,
-            gamma=0.99
+            gamma=0.99,
+            channels_last_3d=cfg.method.get('channels_last_3d', False),
+            target_update_every=cfg.method.get('target_update_every', 1),
+            traced_acting=cfg.method.get('traced_acting', False),
+            int8_acting=cfg.method.get('int8_acting', False),
+            int8_min_agreement=cfg.method.get('int8_min_agreement', 0.9),
+            distill_acting=cfg.method.get('distill_acting', False),
+            student_kernels=cfg.method.get('student_kernels', 16),
+            student_dense_feats=cfg.method.get('student_dense_feats', 32),
+            distill_min_agreement=cfg.method.get('distill_min_agreement', 0.9)
         )
         qattention_agents.append(qattention_agent)
 
@@ -316,6 +304,9 @@ def create_agent(cfg: DictConfig, env, depth_0bounds=None, cam_resolution=None):
         qattention_agents=qattention_agents,
         rotation_resolution=cfg.method.rotation_resolution,
         camera_names=cfg.rlbench.cameras,
+        concurrent_updates=cfg.method.get('concurrent_depth_updates', False),
     )
-    preprocess_agent = PreprocessAgent(pose_agent=rotation_agent)
+    preprocess_agent = PreprocessAgent(
+        pose_agent=rotation_agent,
+        compact_depth=cfg.rlbench.get('compact_depth', False))
     return preprocess_agent
@@ -1,12 +1,28 @@
+import inspect
+from typing import List
+
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
 
 from arm.network_utils import Conv3DInceptionBlock, DenseBlock, SpatialSoftmax3D, \
     Conv3DInceptionBlockUpsampleBlock, Conv3DBlock
+from arm.c2farm.sparse_conv import SparseVoxels, SubMConv3d, \
+    SparseDownsample3d
+
+# use_reentrant came with PyTorch 1.11, which warns when it is left out.
+_CHECKPOINT_KWARGS = {'use_reentrant': False} if 'use_reentrant' in \
+    inspect.signature(checkpoint).parameters else {}
 
 
 class Qattention3DNet(nn.Module):
 
+    # Stages that can be recomputed in the backward pass instead of keeping
+    # their activations (see checkpoint_stages).
+    CHECKPOINT_STAGES = ['down0', 'down1', 'down2', 'down3',
+                         'up1', 'up2', 'up3', 'final']
+
     def __init__(self,
                  in_channels: int,
                  out_channels: int,
@@ -17,7 +33,10 @@ class Qattention3DNet(nn.Module):
                  norm: str = None,
                  activation: str = 'relu',
                  dense_feats: int = 32,
-                 include_prev_layer = False,):
+                 include_prev_layer = False,
+                 ss_log_sum_exp: bool = False,
+                 padding_mode: str = 'replicate',
+                 checkpoint_stages: List[str] = None):
         super(Qattention3DNet, self).__init__()
         self._in_channels = in_channels
         self._out_channels = out_channels
@@ -30,6 +49,29 @@ class Qattention3DNet(nn.Module):
         self._dense_feats = dense_feats
         self._out_dense = out_dense
         self._include_prev_layer = include_prev_layer
+        self._ss_log_sum_exp = ss_log_sum_exp
+        self._padding_mode = padding_mode
+        self._checkpoint_stages = list(checkpoint_stages or [])
+        unknown = set(self._checkpoint_stages) - set(self.CHECKPOINT_STAGES)
+        if len(unknown) > 0:
+            raise ValueError('Unknown checkpoint stages %s. Choose from %s.' % (
+                sorted(unknown), self.CHECKPOINT_STAGES))
+        # Whether forward records latent_dict for summaries.
+        self.capture_latents = True
+        self.latent_dict = {}
+
+    def hparams(self) -> dict:
+        """Constructor arguments that rebuild this architecture (training
+        only options such as checkpoint_stages are left out)."""
+        return dict(
+            in_channels=self._in_channels, out_channels=self._out_channels,
+            out_dense=self._out_dense, voxel_size=self._voxel_size,
+            low_dim_size=self._low_dim_size, kernels=self._kernels,
+            norm=self._norm, activation=self._activation,
+            dense_feats=self._dense_feats,
+            include_prev_layer=self._include_prev_layer,
+            ss_log_sum_exp=self._ss_log_sum_exp,
+            padding_mode=self._padding_mode)
 
     def build(self):
         use_residual = False
@@ -40,14 +82,16 @@ class Qattention3DNet(nn.Module):
         spatial_size = self._voxel_size
         self._input_preprocess = Conv3DInceptionBlock(
             self._in_channels, self._kernels, norm=self._norm,
-            activation=self._activation)
+            activation=self._activation,
+            padding_mode=self._padding_mode)
 
         d0_ins = self._input_preprocess.out_channels
         if self._include_prev_layer:
             PREV_VOXEL_CHANNELS = 0
             self._input_preprocess_prev_layer = Conv3DInceptionBlock(
                 self._in_channels + PREV_VOXEL_CHANNELS, self._kernels, norm=self._norm,
-                activation=self._activation)
+                activation=self._activation,
+                padding_mode=self._padding_mode)
             d0_ins += self._input_preprocess_prev_layer.out_channels
 
         if self._low_dim_size > 0:
@@ -57,17 +101,19 @@ class Qattention3DNet(nn.Module):
 
         self._down0 = Conv3DInceptionBlock(
             d0_ins, self._kernels, norm=self._norm,
-            activation=self._activation, residual=use_residual)
+            activation=self._activation, residual=use_residual,
+            padding_mode=self._padding_mode)
         self._ss0 = SpatialSoftmax3D(
             spatial_size, spatial_size, spatial_size,
-            self._down0.out_channels)
+            self._down0.out_channels, log_sum_exp=self._ss_log_sum_exp)
         spatial_size //= 2
         self._down1 = Conv3DInceptionBlock(
             self._down0.out_channels, self._kernels * 2, norm=self._norm,
-            activation=self._activation, residual=use_residual)
+            activation=self._activation, residual=use_residual,
+            padding_mode=self._padding_mode)
         self._ss1 = SpatialSoftmax3D(
             spatial_size, spatial_size, spatial_size,
-            self._down1.out_channels)
+            self._down1.out_channels, log_sum_exp=self._ss_log_sum_exp)
         spatial_size //= 2
 
         flat_size = self._down0.out_channels * 4 + self._down1.out_channels * 4
@@ -77,45 +123,53 @@ class Qattention3DNet(nn.Module):
             k1 += self._kernels
             self._down2 = Conv3DInceptionBlock(
                 self._down1.out_channels, self._kernels * 4, norm=self._norm,
-                activation=self._activation,  residual=use_residual)
+                activation=self._activation,  residual=use_residual,
+                padding_mode=self._padding_mode)
             flat_size += self._down2.out_channels * 4
             self._ss2 = SpatialSoftmax3D(
                 spatial_size, spatial_size, spatial_size,
-                self._down2.out_channels)
+                self._down2.out_channels, log_sum_exp=self._ss_log_sum_exp)
             spatial_size //= 2
             k2 = self._down2.out_channels
             if self._voxel_size > 16:
-                k2 *= 2
+                # _up2 takes _down2's output concatenated with _up3's.
+                k2 += self._kernels
                 self._down3 = Conv3DInceptionBlock(
                     self._down2.out_channels, self._kernels, norm=self._norm,
-                    activation=self._activation, residual=use_residual)
+                    activation=self._activation, residual=use_residual,
+                    padding_mode=self._padding_mode)
                 flat_size += self._down3.out_channels * 4
                 self._ss3 = SpatialSoftmax3D(
                     spatial_size, spatial_size, spatial_size,
-                    self._down3.out_channels)
+                    self._down3.out_channels, log_sum_exp=self._ss_log_sum_exp)
                 self._up3 = Conv3DInceptionBlockUpsampleBlock(
                     self._kernels, self._kernels, 2, norm=self._norm,
-                    activation=self._activation, residual=use_residual)
+                    activation=self._activation, residual=use_residual,
+                    padding_mode=self._padding_mode)
             self._up2 = Conv3DInceptionBlockUpsampleBlock(
                 k2, self._kernels, 2, norm=self._norm,
-                activation=self._activation, residual=use_residual)
+                activation=self._activation, residual=use_residual,
+                padding_mode=self._padding_mode)
 
         self._up1 = Conv3DInceptionBlockUpsampleBlock(
             k1, self._kernels, 2, norm=self._norm,
-            activation=self._activation, residual=use_residual)
+            activation=self._activation, residual=use_residual,
+            padding_mode=self._padding_mode)
 
         self._global_maxp = nn.AdaptiveMaxPool3d(1)
         self._local_maxp = nn.MaxPool3d(3, 2, padding=1)
         self._final = Conv3DBlock(
             self._kernels * 2, self._kernels, kernel_sizes=3,
-            strides=1, norm=self._norm, activation=self._activation)
+            strides=1, norm=self._norm, activation=self._activation,
+            padding_mode=self._padding_mode)
         self._final2 = Conv3DBlock(
             self._kernels, self._out_channels, kernel_sizes=3,
-            strides=1, norm=None, activation=None)
+            strides=1, norm=None, activation=None,
+            padding_mode=self._padding_mode)
 
         self._ss_final = SpatialSoftmax3D(
             self._voxel_size, self._voxel_size, self._voxel_size,
-            self._kernels)
+            self._kernels, log_sum_exp=self._ss_log_sum_exp)
         flat_size += self._kernels * 4
 
         if self._out_dense > 0:
@@ -126,6 +180,12 @@ class Qattention3DNet(nn.Module):
             self._dense2 = DenseBlock(
                 self._dense_feats, self._out_dense, None, None)
 
+    def _stage(self, name, fn, *args):
+        if (name in self._checkpoint_stages and self.training and
+                torch.is_grad_enabled()):
+            return checkpoint(fn, *args, **_CHECKPOINT_KWARGS)
+        return fn(*args)
+
     def forward(self, ins, proprio, prev_layer_voxel_grid):
         b, _, d, h, w = ins.shape
         x = self._input_preprocess(ins)
@@ -134,65 +194,288 @@ class Qattention3DNet(nn.Module):
             y = self._input_preprocess_prev_layer(prev_layer_voxel_grid)
             x = torch.cat([x, y], dim=1)
 
+        p = None
         if self._low_dim_size > 0:
+            # Enters _down0 as a bias rather than a tiled B x K x V^3 input.
             p = self._proprio_preprocess(proprio)
-            p = p.unsqueeze(-1).unsqueeze(-1).unsqueeze(-1).repeat(
-                1, 1, d, h, w)
-            x = torch.cat([x, p], dim=1)
 
-        d0 = self._down0(x)
+        if p is None:
+            d0 = self._stage('down0', self._down0, x)
+        else:
+            d0 = self._stage('down0', self._down0, x, p)
         ss0 = self._ss0(d0)
         maxp0 = self._global_maxp(d0).view(b, -1)
-        d1 = u = self._down1(self._local_maxp(d0))
+        d1 = u = self._stage(
+            'down1', lambda z: self._down1(self._local_maxp(z)), d0)
         ss1 = self._ss1(d1)
         maxp1 = self._global_maxp(d1).view(b, -1)
 
         feats = [ss0, maxp0, ss1, maxp1]
 
         if self._voxel_size > 8:
-            d2 = u = self._down2(self._local_maxp(d1))
+            d2 = u = self._stage(
+                'down2', lambda z: self._down2(self._local_maxp(z)), d1)
             feats.extend([self._ss2(d2), self._global_maxp(d2).view(b, -1)])
             if self._voxel_size > 16:
-                d3 = self._down3(self._local_maxp(d2))
+                d3 = self._stage(
+                    'down3', lambda z: self._down3(self._local_maxp(z)), d2)
                 feats.extend([self._ss3(d3), self._global_maxp(d3).view(b, -1)])
-                u3 = self._up3(d3)
+                u3 = self._stage('up3', self._up3, d3)
                 u = torch.cat([d2, u3], dim=1)
-            u2 = self._up2(u)
+            u2 = self._stage('up2', self._up2, u)
             u = torch.cat([d1, u2], dim=1)
 
-        u1 = self._up1(u)
-        f1 = self._final(torch.cat([d0, u1], dim=1))
-        trans = self._final2(f1)
+        u1 = self._stage('up1', self._up1, u)
+        f1 = self._stage(
+            'final', lambda z0, z1: self._final(torch.cat([z0, z1], dim=1)),
+            d0, u1)
+        # Callers view trans as (b, c, d * h * w), even in channels_last_3d.
+        trans = self._final2(f1).contiguous()
 
         feats.extend([self._ss_final(f1), self._global_maxp(f1).view(b, -1)])
 
-        self.latent_dict = {
-            'd0': d0.mean(-1).mean(-1).mean(-1),
-            'd1': d1.mean(-1).mean(-1).mean(-1),
-            'u1': u1.mean(-1).mean(-1).mean(-1),
-            'trans_out': trans,
-        }
+        rot_and_grip_out = dense0 = dense1 = None
+        if self._out_dense > 0:
+            dense0 = self._dense0(torch.cat(feats, 1))
+            dense1 = self._dense1(dense0)
+            rot_and_grip_out = self._dense2(dense1)
+
+        self.latent_dict = {}
+        if self.capture_latents:
+            # Detached, spatially reduced copies so that nothing here keeps
+            # activations (or their graph) alive after the update.
+            spatial_mean = lambda x: x.detach().flatten(2).mean(-1)
+            self.latent_dict = {
+                'd0': spatial_mean(d0),
+                'd1': spatial_mean(d1),
+                'u1': spatial_mean(u1),
+                'trans_out': spatial_mean(trans),
+                'trans_out_max': trans.detach().flatten(2).max(-1)[0],
+            }
+            if self._out_dense > 0:
+                self.latent_dict.update({
+                    'dense0': dense0.detach(),
+                    'dense1': dense1.detach(),
+                    'dense2': rot_and_grip_out.detach(),
+                })
+            if self._voxel_size > 8:
+                self.latent_dict.update({
+                    'd2': spatial_mean(d2),
+                    'u2': spatial_mean(u2),
+                })
+            if self._voxel_size > 16:
+                self.latent_dict.update({
+                    'd3': spatial_mean(d3),
+                    'u3': spatial_mean(u3),
+                })
+
+        return trans, rot_and_grip_out
+
+class SparseQattention3DNet(nn.Module):
+    """Qattention3DNet's drop-in for large voxel grids. The encoder runs
+    submanifold convs over the occupied voxels only (occupancy is the last
+    input channel), downsampling twice. The coarsest level is densified for
+    an inception trunk and the rotation/gripper features, and a dense decoder
+    upsamples it back to the full grid, adding the densified encoder levels
+    as skips, to give Q-values for every voxel. The decoder layers are 1x1x1
+    (spatial context comes from the trunk and the sparse encoder) and the
+    rotation/gripper head reads the half resolution features, so nothing
+    dense scales worse than linearly in V^3.
+
+    norm only applies to the dense layers.
+    """
+
+    def __init__(self,
+                 in_channels: int,
+                 out_channels: int,
+                 out_dense: int,
+                 voxel_size: int,
+                 low_dim_size: int,
+                 kernels: int,
+                 norm: str = None,
+                 activation: str = 'relu',
+                 dense_feats: int = 32,
+                 include_prev_layer = False,
+                 padding_mode: str = 'replicate'):
+        super(SparseQattention3DNet, self).__init__()
+        if include_prev_layer:
+            raise ValueError(
+                'include_prev_layer is not supported by the sparse encoder.')
+        if voxel_size % 4 != 0:
+            raise ValueError(
+                'voxel_size must be divisible by 4, got %d.' % voxel_size)
+        self._in_channels = in_channels
+        self._out_channels = out_channels
+        self._norm = norm
+        self._activation = activation
+        self._kernels = kernels
+        self._low_dim_size = low_dim_size
+        self._build_calls = 0
+        self._voxel_size = voxel_size
+        self._dense_feats = dense_feats
+        self._out_dense = out_dense
+        self._padding_mode = padding_mode
+        # Whether forward records latent_dict for summaries.
+        self.capture_latents = True
+        self.latent_dict = {}
+
+    def hparams(self) -> dict:
+        """Constructor arguments that rebuild this architecture."""
+        return dict(
+            in_channels=self._in_channels, out_channels=self._out_channels,
+            out_dense=self._out_dense, voxel_size=self._voxel_size,
+            low_dim_size=self._low_dim_size, kernels=self._kernels,
+            norm=self._norm, activation=self._activation,
+            dense_feats=self._dense_feats, padding_mode=self._padding_mode)
+
+    def build(self):
+        self._build_calls += 1
+        if self._build_calls != 1:
+            raise RuntimeError('Build needs to be called once.')
+
+        k = self._kernels
+        self._enc0 = nn.ModuleList([
+            SubMConv3d(self._in_channels, k, activation=self._activation),
+            SubMConv3d(k, k, activation=self._activation)])
+        self._enc1 = nn.ModuleList([
+            SparseDownsample3d(k, k * 2, activation=self._activation),
+            SubMConv3d(k * 2, k * 2, activation=self._activation)])
+        self._enc2 = nn.ModuleList([
+            SparseDownsample3d(k * 2, k * 2, activation=self._activation),
+            SubMConv3d(k * 2, k * 2, activation=self._activation)])
+
+        trunk_ins = k * 2
+        if self._low_dim_size > 0:
+            self._proprio_preprocess = DenseBlock(
+                self._low_dim_size, k, None, self._activation)
+            trunk_ins += k
+        coarse_size = self._voxel_size // 4
+        self._trunk = Conv3DInceptionBlock(
+            trunk_ins, k * 2, norm=self._norm, activation=self._activation,
+            padding_mode=self._padding_mode)
+        self._ss_trunk = SpatialSoftmax3D(
+            coarse_size, coarse_size, coarse_size, self._trunk.out_channels)
+
+        self._upsample = nn.Upsample(
+            scale_factor=2, mode='trilinear', align_corners=False)
+        self._up2 = Conv3DBlock(
+            self._trunk.out_channels + k * 2, k, kernel_sizes=1, strides=1,
+            norm=self._norm, activation=self._activation)
+        self._up1 = Conv3DBlock(
+            k * 2, k, kernel_sizes=1, strides=1, norm=self._norm,
+            activation=self._activation)
+        self._final = Conv3DBlock(
+            k, self._out_channels, kernel_sizes=1, strides=1, norm=None,
+            activation=None)
+
+        self._global_maxp = nn.AdaptiveMaxPool3d(1)
+        self._ss_up2 = SpatialSoftmax3D(
+            coarse_size * 2, coarse_size * 2, coarse_size * 2, k)
+        flat_size = self._trunk.out_channels * 4 + k * 4
 
-        rot_and_grip_out = None
         if self._out_dense > 0:
+            self._dense0 = DenseBlock(
+                flat_size, self._dense_feats, None, self._activation)
+            self._dense1 = DenseBlock(
+                self._dense_feats, self._dense_feats, None, self._activation)
+            self._dense2 = DenseBlock(
+                self._dense_feats, self._out_dense, None, None)
+
+    def _skip_up1(self, u2, e0):
+        # _up1 applied to cat([upsample(u2), e0]). A 1x1x1 conv commutes with
+        # trilinear upsampling, so the u2 half runs at half resolution and
+        # the e0 half only at the active sites.
+        conv = self._up1.conv3d
+        k = u2.shape[1]
+        x = self._upsample(F.conv3d(u2, conv.weight[:, :k], conv.bias))
+        skip = e0.feats.matmul(conv.weight[:, k:].flatten(1).t())
+        c = e0.coords
+        x.permute(0, 2, 3, 4, 1).index_put_(
+            (c[:, 0], c[:, 1], c[:, 2], c[:, 3]), skip, accumulate=True)
+        x = self._up1.norm(x) if self._up1.norm is not None else x
+        return self._up1.activation(x)
+
+    def forward(self, ins, proprio, prev_layer_voxel_grid):
+        b = ins.shape[0]
+        x = SparseVoxels.from_dense(ins, ins[:, -1] > 0)
+        for conv in self._enc0:
+            x = conv(x)
+        e0 = x
+        for conv in self._enc1:
+            x = conv(x)
+        e1 = x
+        for conv in self._enc2:
+            x = conv(x)
+
+        p = None
+        if self._low_dim_size > 0:
+            p = self._proprio_preprocess(proprio)
+        t = self._trunk(x.to_dense(), p)
+
+        u2 = self._up2(torch.cat([self._upsample(t), e1.to_dense()], dim=1))
+        u1 = self._skip_up1(u2, e0)
+        trans = self._final(u1).contiguous()
+
+        rot_and_grip_out = dense0 = dense1 = None
+        if self._out_dense > 0:
+            feats = [self._ss_trunk(t), self._global_maxp(t).view(b, -1),
+                     self._ss_up2(u2), self._global_maxp(u2).view(b, -1)]
             dense0 = self._dense0(torch.cat(feats, 1))
             dense1 = self._dense1(dense0)
             rot_and_grip_out = self._dense2(dense1)
-            self.latent_dict.update({
-                'dense0': dense0,
-                'dense1': dense1,
-                'dense2': rot_and_grip_out,
-            })
 
-        if self._voxel_size > 8:
-            self.latent_dict.update({
-                'd2': d2.mean(-1).mean(-1).mean(-1),
-                'u2': u2.mean(-1).mean(-1).mean(-1),
-            })
-        if self._voxel_size > 16:
-            self.latent_dict.update({
-                'd3': d3.mean(-1).mean(-1).mean(-1),
-                'u3': u3.mean(-1).mean(-1).mean(-1),
-            })
-
-        return trans, rot_and_grip_out
\ No newline at end of file
+        self.latent_dict = {}
+        if self.capture_latents:
+            spatial_mean = lambda x: x.detach().flatten(2).mean(-1)
+            self.latent_dict = {
+                'active_voxels': torch.bincount(
+                    e0.coords[:, 0], minlength=b).float(),
+                'trunk': spatial_mean(t),
+                'u2': spatial_mean(u2),
+                'u1': spatial_mean(u1),
+                'trans_out': spatial_mean(trans),
+                'trans_out_max': trans.detach().flatten(2).max(-1)[0],
+            }
+            if self._out_dense > 0:
+                self.latent_dict.update({
+                    'dense0': dense0.detach(),
+                    'dense1': dense1.detach(),
+                    'dense2': rot_and_grip_out.detach(),
+                })
+
+        return trans, rot_and_grip_out
+
+
+def create_qattention_networks(method, low_dim_size: int) -> List[nn.Module]:
+    """The unbuilt network of every depth, as create_agent makes them, from
+    the method config (cfg.method)."""
+    voxel_feats = 3
+    num_rotation_classes = int(360. // method.rotation_resolution)
+    net_class = Qattention3DNet
+    net_kwargs = dict(
+        padding_mode=method.get('padding_mode', 'replicate'),
+        checkpoint_stages=method.get('checkpoint_stages', None))
+    if method.get('sparse_encoder', False):
+        if net_kwargs['checkpoint_stages']:
+            raise ValueError(
+                'checkpoint_stages is not supported with sparse_encoder.')
+        net_class = SparseQattention3DNet
+        net_kwargs = dict(
+            padding_mode=method.get('padding_mode', 'replicate'))
+    nets = []
+    for depth, vox_size in enumerate(method.voxel_sizes):
+        last = depth == len(method.voxel_sizes) - 1
+        if depth > 0:
+            net_kwargs['include_prev_layer'] = False
+        nets.append(net_class(
+            in_channels=voxel_feats + 3 + 1 + 3,
+            out_channels=1 if depth == 0 else 2,
+            voxel_size=vox_size,
+            out_dense=(num_rotation_classes * 3) if last and depth > 0 else 0,
+            kernels=method.get('kernels', 64),
+            norm=None if 'None' in method.norm else method.norm,
+            dense_feats=128,
+            activation=method.activation,
+            low_dim_size=low_dim_size,
+            **net_kwargs))
+    return nets
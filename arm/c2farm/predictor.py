@@ -0,0 +1,222 @@
+"""Stand-alone C2F-ARM policy for inference hosts.
+
+export_policy writes a trained agent's per depth weights, architectures and
+the settings acting needs (scene bounds, voxel sizes, bounds offsets, crop
+size, cameras, rotation resolution) to a single file. Predictor rebuilds the
+policy from that file with nothing but torch and NumPy, so neither hydra,
+YARR, RLBench nor a live environment is needed to act.
+"""
+from typing import List
+
+import numpy as np
+import torch
+
+from arm.c2farm.networks import Qattention3DNet, SparseQattention3DNet
+from arm.c2farm.qfunction import QFunction
+from arm.c2farm.voxel_grid import VoxelGrid
+from arm.crop_utils import CropEngine
+
+ARTIFACT_VERSION = 1
+NETWORKS = {
+    'Qattention3DNet': Qattention3DNet,
+    'SparseQattention3DNet': SparseQattention3DNet,
+}
+
+
+def export_policy(agent, path: str):
+    """Saves a built C2F-ARM agent, the PreprocessAgent that create_agent
+    returns or its QAttentionStackAgent, for Predictor."""
+    stack = getattr(agent, '_pose_agent', agent)
+    layers = []
+    for qa in stack._qattention_agents:
+        # The distilled student when the agent would act with it.
+        net, qnet = qa._act_network()
+        if type(net).__name__ not in NETWORKS:
+            raise ValueError('Cannot export %s.' % type(net).__name__)
+        if getattr(net, '_include_prev_layer', False):
+            raise ValueError(
+                'Policies that take the previous layer\'s voxel grid cannot '
+                'be exported.')
+        bounds = qa._coordinate_bounds
+        if isinstance(bounds, torch.Tensor):
+            bounds = bounds.cpu().view(-1).tolist()
+        layers.append({
+            'network': type(net).__name__,
+            'hparams': net.hparams(),
+            'state_dict': {k: v.detach().cpu() for k, v in
+                           qnet.state_dict().items()},
+            'coordinate_bounds': list(bounds),
+            'voxel_size': qa._voxel_size,
+            'bounds_offset': qa._bounds_offset,
+            'voxel_feature_size': qa._voxel_feature_size,
+            'image_crop_size': qa._image_crop_size,
+            'include_low_dim_state': qa._include_low_dim_state,
+        })
+    torch.save({
+        'version': ARTIFACT_VERSION,
+        'camera_names': list(stack._camera_names),
+        'rotation_resolution': stack._rotation_resolution,
+        'image_resolution': list(
+            stack._qattention_agents[0]._image_resolution),
+        'layers': layers,
+    }, path)
+
+
+def _point_to_pixel_index(points, extrinsics, intrinsics):
+    # utils.point_to_pixel_index over a batch; (B, 3), (B, 4, 4), (B, 3, 3).
+    points = np.concatenate([points, np.ones((len(points), 1))], -1)
+    in_cam = np.einsum('bij,bj->bi', np.linalg.inv(extrinsics), points)
+    px = 2 * intrinsics[:, 0, 2] - np.trunc(
+        -intrinsics[:, 0, 0] * (in_cam[:, 0] / in_cam[:, 2]) +
+        intrinsics[:, 0, 2])
+    py = 2 * intrinsics[:, 1, 2] - np.trunc(
+        -intrinsics[:, 1, 1] * (in_cam[:, 1] / in_cam[:, 2]) +
+        intrinsics[:, 1, 2])
+    return px, py
+
+
+def _discrete_euler_to_quaternion(discrete_euler, resolution):
+    """utils.discrete_euler_to_quaternion over a batch of (B, 3) indices,
+    without scipy: extrinsic xyz euler angles to (x, y, z, w)."""
+    half = np.radians(discrete_euler * resolution - 180) / 2.0
+    cx, cy, cz = np.cos(half).T
+    sx, sy, sz = np.sin(half).T
+    return np.stack([
+        sx * cy * cz - cx * sy * sz,
+        cx * sy * cz + sx * cy * sz,
+        cx * cy * sz - sx * sy * cz,
+        cx * cy * cz + sx * sy * sz], -1)
+
+
+class Predictor(object):
+    """Acts with an exported C2F-ARM policy on batches of observations.
+
+    obs_batch maps, for every camera, '<camera>_rgb' (B, 3, H, W) uint8 and
+    '<camera>_point_cloud' (B, 3, H, W) to arrays, plus 'low_dim_state'
+    (B, L) when the policy uses it. With more than one depth, the
+    '<camera>_camera_extrinsics' (B, 4, 4) and '<camera>_camera_intrinsics'
+    (B, 3, 3) of the cropped (non wrist) cameras are needed as well. These
+    are the observations PreprocessAgent.act gets, without the time axis.
+    """
+
+    def __init__(self, path: str, device: str = 'cpu',
+                 num_threads: int = None):
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+        self._device = torch.device(device)
+        artifact = torch.load(path, map_location='cpu')
+        if artifact.get('version') != ARTIFACT_VERSION:
+            raise ValueError('Unsupported policy artifact version %s.' %
+                             artifact.get('version'))
+        self._camera_names = artifact['camera_names']
+        self._rotation_resolution = artifact['rotation_resolution']
+        self._max_num_coords = int(np.prod(artifact['image_resolution'])) * (
+            len(self._camera_names))
+        self._layers = artifact['layers']
+        if all(layer['hparams']['out_dense'] == 0 for layer in self._layers):
+            raise ValueError('The policy has no rotation and gripper output.')
+        self._qs, self._crop_engines = [], []
+        for layer in self._layers:
+            q = QFunction(NETWORKS[layer['network']](**layer['hparams']),
+                          None, layer['bounds_offset'],
+                          self._rotation_resolution, self._device)
+            q._qnet.load_state_dict(layer.pop('state_dict'))
+            q._qnet.capture_latents = False
+            for p in q.parameters():
+                p.requires_grad = False
+            self._qs.append(q.to(self._device).eval())
+            self._crop_engines.append(CropEngine(layer['image_crop_size']))
+        self._voxel_grids = {}
+
+    def _voxel_grid(self, depth: int, batch_size: int) -> VoxelGrid:
+        # VoxelGrid is built for one batch size.
+        key = (depth, batch_size)
+        if key not in self._voxel_grids:
+            layer = self._layers[depth]
+            self._voxel_grids[key] = VoxelGrid(
+                coord_bounds=layer['coordinate_bounds'],
+                voxel_size=layer['voxel_size'], device=self._device,
+                batch_size=batch_size,
+                feature_size=layer['voxel_feature_size'],
+                max_num_coords=self._max_num_coords)
+        return self._voxel_grids[key]
+
+    def _pixel_coords(self, attention_coordinate, obs_batch, cameras):
+        points = attention_coordinate.cpu().numpy().astype(np.float64)
+        pixel_coords = []
+        for n in cameras:
+            px, py = _point_to_pixel_index(
+                points, np.asarray(obs_batch['%s_camera_extrinsics' % n]),
+                np.asarray(obs_batch['%s_camera_intrinsics' % n]))
+            # Integer, as the replay stores them, for the crop gathers.
+            pixel_coords.append(torch.from_numpy(
+                np.stack([py, px], -1).astype(np.int64)).unsqueeze(1))
+        return pixel_coords
+
+    def predict(self, obs_batch: dict) -> dict:
+        """Returns the (B, 8) continuous 'action' (attention coordinate,
+        quaternion, gripper) and the discrete 'trans_action_indicies' and
+        'rot_grip_action_indicies' the agent would pick deterministically."""
+        with torch.no_grad():
+            rgbs, pcds = [], []
+            for n in self._camera_names:
+                rgb = torch.as_tensor(np.asarray(obs_batch['%s_rgb' % n]))
+                rgbs.append((rgb.to(self._device).float() / 255.0) * 2.0 - 1.0)
+                pcds.append(torch.as_tensor(np.asarray(
+                    obs_batch['%s_point_cloud' % n])).to(self._device).float())
+            b = rgbs[0].shape[0]
+            proprio = None
+            if 'low_dim_state' in obs_batch:
+                proprio = torch.as_tensor(np.asarray(
+                    obs_batch['low_dim_state'])).to(self._device).float()
+
+            bounds = torch.tensor(
+                self._layers[0]['coordinate_bounds'],
+                device=self._device).unsqueeze(0).repeat(b, 1)
+            attention_coordinate = rot_and_grip_indicies = None
+            translation_indicies = []
+            for depth, (layer, q) in enumerate(zip(self._layers, self._qs)):
+                x = [[rgb, pcd] for rgb, pcd in zip(rgbs, pcds)]
+                if depth > 0:
+                    offset = layer['bounds_offset']
+                    bounds = torch.cat([attention_coordinate - offset,
+                                        attention_coordinate + offset], dim=1)
+                    cropped = [i for i, n in enumerate(self._camera_names)
+                               if 'wrist' not in n]
+                    if len(cropped) > 0:
+                        crops = self._crop_engines[depth].crop(
+                            self._pixel_coords(
+                                attention_coordinate, obs_batch,
+                                [self._camera_names[i] for i in cropped]),
+                            [x[i] for i in cropped])
+                        for i, crop in zip(cropped, crops):
+                            x[i] = crop
+                q._voxel_grid = self._voxel_grid(depth, b)
+                q_trans, q_rot_grip, _ = q(
+                    x, proprio if layer['include_low_dim_state'] else None,
+                    [xx[1] for xx in x], bounds)
+                coords, rot_grip = q.choose_highest_action(
+                    q_trans, q_rot_grip)
+                if rot_grip is not None:
+                    rot_and_grip_indicies = rot_grip
+                coords = coords.int()
+                translation_indicies.append(coords)
+                res = (bounds[:, 3:] - bounds[:, :3]) / layer['voxel_size']
+                attention_coordinate = bounds[:, :3] + res * coords + res / 2
+
+            rgai = rot_and_grip_indicies.cpu().numpy()
+            action = np.concatenate([
+                attention_coordinate.cpu().numpy(),
+                _discrete_euler_to_quaternion(
+                    rgai[:, -4:-1], self._rotation_resolution),
+                rgai[:, -1:]], -1)
+            return {
+                'action': action,
+                'trans_action_indicies': torch.cat(
+                    translation_indicies, 1).cpu().numpy(),
+                'rot_grip_action_indicies': rgai,
+            }
+
+    @property
+    def camera_names(self) -> List[str]:
+        return list(self._camera_names)
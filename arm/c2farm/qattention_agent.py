@@ -11,82 +11,25 @@ from torchvision import transforms
 from yarr.agents.agent import Agent, ActResult, ScalarSummary, \
     HistogramSummary, ImageSummary, Summary
 
-from arm import utils
+from arm import quantization, utils
 from arm.utils import visualise_voxel, stack_on_channel
+from arm.c2farm.distillation import Distiller
+from arm.c2farm.qfunction import QFunction, QAttentionActModule
 from arm.c2farm.voxel_grid import VoxelGrid
+from arm.crop_utils import CropEngine
 
 NAME = 'QAttentionAgent'
 REPLAY_BETA = 1.0
 
 
-class QFunction(nn.Module):
-
-    def __init__(self,
-                 unet_3d: nn.Module,
-                 voxel_grid: VoxelGrid,
-                 bounds_offset: float,
-                 rotation_resolution: float,
-                 device):
-        super(QFunction, self).__init__()
-        self._rotation_resolution = rotation_resolution
-        self._voxel_grid = voxel_grid
-        self._bounds_offset = bounds_offset
-        self._qnet = copy.deepcopy(unet_3d)
-        self._qnet._dev = device
-        self._qnet.build()
-
-    def _argmax_3d(self, tensor_orig):
-        b, c, d, h, w = tensor_orig.shape  # c will be one
-        tensor = tensor_orig.max(1, keepdim=True)[0]
-        max_val_hw, argmax_hw = tensor.view(b, d, -1).max(2)
-        d_ = max_val_hw.argmax(1)
-        m = argmax_hw.gather(1, d_.unsqueeze(-1).repeat(1, d))[:, 0].unsqueeze(
-            -1)
-        indices = torch.cat((d_.unsqueeze(-1), (m // h) % w, m % w), dim=1)
-        return indices
-
-    def choose_highest_action(self, q_trans, q_rot_grip):
-        coords = self._argmax_3d(q_trans)
-        rot_and_grip_indicies = None
-        if q_rot_grip is not None:
-            q_rot = torch.stack(torch.split(
-                # q_rot_grip[:, :-2],
-                q_rot_grip[:, :],
-                int(360 // self._rotation_resolution),
-                dim=1), dim=1)
-            b, c, d, h, w = q_trans.shape  # c will be one
-            grasp_indicies = q_trans.view(b, c, -1).max(-1)[0].argmax(1, keepdim=True)
-            rot_and_grip_indicies = torch.cat(
-                [q_rot[:, 0:1].argmax(-1),
-                 q_rot[:, 1:2].argmax(-1),
-                 q_rot[:, 2:3].argmax(-1),
-                 grasp_indicies], -1)
-        return coords, rot_and_grip_indicies
-
-    def forward(self, x, proprio, pcd,
-                bounds=None, latent=None):
-        # x will be list of list (list of [rgb, pcd])
-        b = x[0][0].shape[0]
-        pcd_flat = torch.cat(
-            [p.permute(0, 2, 3, 1).reshape(b, -1, 3) for p in pcd], 1)
-
-        image_features = [xx[0] for xx in x]
-        feat_size = image_features[0].shape[1]
-        flat_imag_features = torch.cat(
-            [p.permute(0, 2, 3, 1).reshape(b, -1, feat_size) for p in
-             image_features], 1)
-
-        voxel_grid = self._voxel_grid.coords_to_bounding_voxel_grid(
-            pcd_flat, coord_features=flat_imag_features, coord_bounds=bounds)
-
-        # Swap to channels fist
-        voxel_grid = voxel_grid.permute(0, 4, 1, 2, 3).detach()
-
-        q_trans, rot_and_grip_q = self._qnet(voxel_grid, proprio, latent)
-        return q_trans, rot_and_grip_q, voxel_grid
-
-    def latents(self):
-        return self._qnet.latent_dict
+def _host_copy(x: torch.Tensor):
+    # Into pinned memory and non-blocking from CUDA; the caller records an
+    # event to synchronise on before reading it.
+    if x is None or not x.is_cuda:
+        return None if x is None else x.detach()
+    host = torch.empty(x.shape, dtype=x.dtype, pin_memory=True)
+    host.copy_(x.detach(), non_blocking=True)
+    return host
 
 
 class QAttentionAgent(Agent):
@@ -113,7 +56,16 @@ class QAttentionAgent(Agent):
                  grad_clip: float = 20.,
                  include_low_dim_state: bool = False,
                  image_resolution: list = None,
-                 lambda_weight_l2: float = 0.0
+                 lambda_weight_l2: float = 0.0,
+                 channels_last_3d: bool = False,
+                 target_update_every: int = 1,
+                 traced_acting: bool = False,
+                 int8_acting: bool = False,
+                 int8_min_agreement: float = 0.9,
+                 distill_acting: bool = False,
+                 student_kernels: int = 16,
+                 student_dense_feats: int = 32,
+                 distill_min_agreement: float = 0.9
                  ):
         self._layer = layer
         self._lambda_trans_qreg = lambda_trans_qreg
@@ -136,6 +88,19 @@ class QAttentionAgent(Agent):
         self._batch_size = batch_size
         self._exploration_strategy = exploration_strategy
         self._lambda_weight_l2 = lambda_weight_l2
+        self._channels_last_3d = channels_last_3d
+        self._target_update_every = target_update_every
+        self._traced_acting = traced_acting
+        self._int8_acting = int8_acting
+        self._int8_min_agreement = int8_min_agreement
+        self._calibration_batches = None
+        self._distill_acting = distill_acting
+        self._student_kernels = student_kernels
+        self._student_dense_feats = student_dense_feats
+        self._distill_min_agreement = distill_min_agreement
+        self._distiller = None
+        self._act_module = None
+        self._summary_capture = True
 
         self._num_rotation_classes = num_rotation_classes
         self._rotation_resolution = rotation_resolution
@@ -157,68 +122,69 @@ class QAttentionAgent(Agent):
         self._vox_grid = vox_grid
 
         self._q = QFunction(self._unet3d, vox_grid, self._bounds_offset,
-                            self._rotation_resolution,
-                            device).to(device).train(training)
+                            self._rotation_resolution, device,
+                            self._channels_last_3d).to(device).train(training)
         self._q_target = None
         if training:
             self._q_target = QFunction(self._unet3d, vox_grid,
                                        self._bounds_offset,
-                                       self._rotation_resolution,
-                                       device).to(
+                                       self._rotation_resolution, device,
+                                       self._channels_last_3d).to(
                 device).train(False)
             for param in self._q_target.parameters():
                 param.requires_grad = False
+            self._q_target._qnet.capture_latents = False
             utils.soft_updates(self._q, self._q_target, 1.0)
-            self._optimizer = torch.optim.Adam(
+            self._optimizer = utils.create_adam(
                 self._q.parameters(), lr=self._lr,
                 weight_decay=self._lambda_weight_l2)
 
             logging.info('# Q Params: %d' % sum(
                 p.numel() for p in self._q.parameters() if p.requires_grad))
+            if self._distill_acting:
+                self._distiller = Distiller(
+                    self._unet3d, self._rotation_resolution, device,
+                    self._student_kernels, self._student_dense_feats,
+                    lr=self._lr)
+                logging.info('# Student Params: %d' % sum(
+                    p.numel() for p in self._distiller.q.parameters()))
         else:
             for param in self._q.parameters():
                 param.requires_grad = False
 
-        grid_for_crop = torch.arange(
-            0, self._image_crop_size, device=device).unsqueeze(0).repeat(
-            self._image_crop_size, 1).unsqueeze(-1)
-        self._grid_for_crop = torch.cat([grid_for_crop.transpose(1, 0), grid_for_crop], dim=2).unsqueeze(0)
+        self._crop_engine = CropEngine(self._image_crop_size)
 
         self._coordinate_bounds = torch.tensor(self._coordinate_bounds, device=device).unsqueeze(0)
 
         self._device = device
 
-    def _extract_crop(self, pixel_action, observation):
-        # Pixel action will now be (B, 2)
-        observation = stack_on_channel(observation)
-        h = observation.shape[-1]
-        top_left_corner = torch.clamp(
-            pixel_action - self._image_crop_size // 2, 0,
-            h - self._image_crop_size)
-        grid = self._grid_for_crop + top_left_corner.unsqueeze(1).to(self._device)
-        grid = ((grid / float(h)) * 2.0) - 1.0  # between -1 and 1
-        # Used for cropping the images across a batch
-        # swap fro y x, to x, y
-        grid = torch.cat((grid[:, :, :, 1:2], grid[:, :, :, 0:1]), dim=-1)
-        crop = F.grid_sample(observation, grid, mode='nearest',
-                             align_corners=True)
-        return crop
+    def _cropped_cameras(self):
+        return [n for n in self._camera_names
+                if self._layer > 0 and 'wrist' not in n]
 
     def _preprocess_inputs(self, replay_sample):
         obs, obs_tp1 = [], []
         pcds, pcds_tp1 = [], []
         self._crop_summary, self._crop_summary_tp1 = [], []
+        cropped = self._cropped_cameras()
+        crops = {}
+        if len(cropped) > 0:
+            # All cameras at t and t + 1 in one call.
+            coords, images = [], []
+            for n in cropped:
+                coords.extend([replay_sample['%s_pixel_coord' % n],
+                               replay_sample['%s_pixel_coord_tp1' % n]])
+                images.extend([
+                    [replay_sample['%s_rgb' % n],
+                     replay_sample['%s_point_cloud' % n]],
+                    [replay_sample['%s_rgb_tp1' % n],
+                     replay_sample['%s_point_cloud_tp1' % n]]])
+            out = self._crop_engine.crop(coords, images)
+            crops = {n: (out[2 * i], out[2 * i + 1])
+                     for i, n in enumerate(cropped)}
         for n in self._camera_names:
-            if self._layer > 0 and 'wrist' not in n:
-                pc_t = replay_sample['%s_pixel_coord' % n]
-                pc_tp1 = replay_sample['%s_pixel_coord_tp1' % n]
-                rgb = self._extract_crop(pc_t, replay_sample['%s_rgb' % n])
-                rgb_tp1 = self._extract_crop(pc_tp1,
-                                             replay_sample['%s_rgb_tp1' % n])
-                pcd = self._extract_crop(pc_t,
-                                         replay_sample['%s_point_cloud' % n])
-                pcd_tp1 = self._extract_crop(pc_tp1, replay_sample[
-                    '%s_point_cloud_tp1' % n])
+            if n in crops:
+                (rgb, pcd), (rgb_tp1, pcd_tp1) = crops[n]
                 self._crop_summary.append((n, rgb))
                 self._crop_summary_tp1.append(('%s_tp1' % n, rgb_tp1))
             else:
@@ -235,11 +201,17 @@ class QAttentionAgent(Agent):
 
     def _act_preprocess_inputs(self, observation):
         obs, pcds = [], []
+        cropped = self._cropped_cameras()
+        crops = {}
+        if len(cropped) > 0:
+            out = self._crop_engine.crop(
+                [observation['%s_pixel_coord' % n] for n in cropped],
+                [[observation['%s_rgb' % n],
+                  observation['%s_point_cloud' % n]] for n in cropped])
+            crops = dict(zip(cropped, out))
         for n in self._camera_names:
-            if self._layer > 0 and 'wrist' not in n:
-                pc_t = observation['%s_pixel_coord' % n]
-                rgb = self._extract_crop(pc_t, observation['%s_rgb' % n])
-                pcd = self._extract_crop(pc_t, observation['%s_point_cloud' % n])
+            if n in crops:
+                rgb, pcd = crops[n]
             else:
                 rgb = stack_on_channel(observation['%s_rgb' % n])
                 pcd = stack_on_channel(observation['%s_point_cloud' % n])
@@ -298,9 +270,13 @@ class QAttentionAgent(Agent):
 
         obs, obs_tp1, pcd, pcd_tp1 = self._preprocess_inputs(replay_sample)
 
+        # Latents are only recorded from the online forward pass, and only
+        # when summaries will be written for this update.
+        self._q._qnet.capture_latents = self._summary_capture
         q, q_rot_grip, voxel_grid = self._q(
             obs, proprio, pcd, bounds,
             replay_sample.get('prev_layer_voxel_grid', None))
+        self._q._qnet.capture_latents = False
         coords, rot_and_grip_indicies = self._q.choose_highest_action(q, q_rot_grip)
 
         with_rot_and_grip = rot_and_grip_indicies is not None
@@ -361,11 +337,35 @@ class QAttentionAgent(Agent):
                 'losses/bellman_qattention': q_delta.mean(),
             })
 
-        self._vis_voxel_grid = voxel_grid[0]
-        self._vis_translation_qvalue = q[0]
-        self._vis_max_coordinate = coords[0]
+        if self._summary_capture:
+            self._vis_voxel_grid = voxel_grid[0].clone()
+            self._vis_translation_qvalue = q[0].detach().clone()
+            self._vis_max_coordinate = coords[0].clone()
+
+        utils.soft_updates(self._q, self._q_target, self._tau,
+                           every=self._target_update_every, step=step)
+        if self._distiller is not None:
+            # The student learns from the teacher's outputs at t and t + 1.
+            self._summaries.update(self._distiller.update(
+                torch.cat([voxel_grid, voxel_grid_tp1]),
+                None if proprio is None else torch.cat([proprio, proprio_tp1]),
+                torch.cat([q, q_tp1]),
+                None if q_rot_grip is None else torch.cat(
+                    [q_rot_grip, q_rot_grip_tp1])))
+        if self._int8_acting:
+            # Data for the int8 act module export_act_module saves with the
+            # next weights: the previous update's voxel grids to calibrate
+            # on and this update's, held out, to check agreement on. They
+            # are kept on the host, copied without waiting on the device.
+            batches = [(_host_copy(voxel_grid), _host_copy(proprio)),
+                       (_host_copy(voxel_grid_tp1), _host_copy(proprio_tp1))]
+            event = None
+            if voxel_grid.is_cuda:
+                event = torch.cuda.Event()
+                event.record()
+            self._calibration_batches = (
+                self._calibration_batches or [])[-1:] + [(batches, event)]
 
-        utils.soft_updates(self._q, self._q_target, self._tau)
         priority = (combined_delta + 1e-10).sqrt()
         priority /= priority.max()
         prev_priority = replay_sample.get('priority', 0)
@@ -394,9 +394,17 @@ class QAttentionAgent(Agent):
         obs, pcd = self._act_preprocess_inputs(observation)
 
         # coords: (1, 3)
-        q, q_rot_grip, vox_grid = self._q(obs, proprio, pcd, bounds,
-                              observation.get('prev_layer_voxel_grid', None))
-        coords, rot_and_grip_indicies = self._q.choose_highest_action(q, q_rot_grip)
+        if self._act_module is not None:
+            out = self._act_module(
+                bounds, [o[0] for o in obs], pcd,
+                *([] if proprio is None else [proprio]))
+            q, vox_grid, coords = out[:3]
+            rot_and_grip_indicies = out[3] if len(out) > 3 else None
+        else:
+            self._q._qnet.capture_latents = False
+            q, q_rot_grip, vox_grid = self._q(obs, proprio, pcd, bounds,
+                                  observation.get('prev_layer_voxel_grid', None))
+            coords, rot_and_grip_indicies = self._q.choose_highest_action(q, q_rot_grip)
 
 
         rot_grip_action = rot_and_grip_indicies
@@ -436,6 +444,30 @@ class QAttentionAgent(Agent):
                          observation_elements=observation_elements,
                          info=info)
 
+    def update_keys(self) -> List[str]:
+        keys = ['trans_action_indicies', 'rot_grip_action_indicies', 'reward',
+                'terminal', 'timeout', 'sampling_probabilities']
+        if self._layer > 0:
+            keys += ['attention_coordinate_layer_%d' % (self._layer - 1),
+                     'attention_coordinate_layer_%d_tp1' % (self._layer - 1)]
+        if self._include_low_dim_state:
+            keys += ['low_dim_state', 'low_dim_state_tp1']
+        for n in self._camera_names:
+            keys += ['%s_rgb' % n, '%s_rgb_tp1' % n,
+                     '%s_point_cloud' % n, '%s_point_cloud_tp1' % n]
+            if self._layer > 0 and 'wrist' not in n:
+                keys += ['%s_pixel_coord' % n, '%s_pixel_coord_tp1' % n]
+        return keys
+
+    def summary_keys(self) -> List[str]:
+        return []
+
+    def set_summary_capture(self, capture: bool):
+        """Whether the following updates keep what update_summaries reads.
+        Defaults to True so that runners which never call this still get
+        summaries."""
+        self._summary_capture = capture
+
     def update_summaries(self) -> List[Summary]:
         summaries = [
             ImageSummary('%s/update_qattention' % self._name,
@@ -476,11 +508,144 @@ class QAttentionAgent(Agent):
                              self._act_qvalues.cpu().numpy(),
                              self._act_max_coordinate.cpu().numpy())))]
 
+    def _int8_act_q(self, q: QFunction) -> QFunction:
+        # Calibrates on the previous update's voxel grids and keeps the int8
+        # network only if it picks the same voxels, rotations and gripper
+        # actions as fp32 often enough on the last update's.
+        for _, event in self._calibration_batches:
+            if event is not None:
+                event.synchronize()
+        calibration, held_out = [
+            [(v.contiguous(), p) for v, p in batches]
+            for batches, _ in self._calibration_batches]
+        observed = quantization.prepare_int8(q._qnet)
+        with torch.no_grad():
+            for v, p in calibration:
+                observed(v, p, None)
+        q_int8 = copy.deepcopy(q)
+        q_int8._qnet = quantization.convert_int8(observed)
+        agreement = []
+        with torch.no_grad():
+            for v, p in held_out:
+                actions = [torch.cat([a for a in qf.choose_highest_action(
+                    *qf._qnet(v, p, None)) if a is not None], 1)
+                    for qf in [q, q_int8]]
+                agreement.append((actions[0] == actions[1]).all(1).float())
+        agreement = torch.cat(agreement).mean().item()
+        if agreement < self._int8_min_agreement:
+            logging.warning(
+                '%s: int8 acting agrees with fp32 on %.1f%% of the '
+                'held-out samples, keeping fp32.' % (
+                    self._name, 100 * agreement))
+            return q
+        logging.info('%s: int8 acting agrees with fp32 on %.1f%% of the '
+                     'held-out samples.' % (self._name, 100 * agreement))
+        return q_int8
+
+    def _act_network(self):
+        # The (unbuilt, built) network to act with: the distilled student
+        # while it agrees with the Q-attention network often enough, the
+        # Q-attention network otherwise.
+        teacher = self._unet3d, self._q._qnet
+        if self._distiller is None:
+            return teacher
+        agreement = self._distiller.agreement
+        if agreement < self._distill_min_agreement:
+            logging.warning(
+                '%s: the student agrees with the teacher on %.1f%% of the '
+                'recent replay samples, acting with the teacher.' % (
+                    self._name, 100 * agreement))
+            return teacher
+        logging.info('%s: acting with the student, which agrees with the '
+                     'teacher on %.1f%% of the recent replay samples.' % (
+                         self._name, 100 * agreement))
+        return self._distiller.network, self._distiller.q._qnet
+
+    def export_act_module(self, savedir: str,
+                          device: torch.device = None) -> str:
+        """Traces and freezes QAttentionActModule for batch 1 acting on
+        device (CPU by default, the only device load_act_module loads on),
+        with the current weights, and saves it next to them. With
+        distill_acting, the distilled student is used when it agrees with
+        the network often enough. With int8_acting, the network is then quantized with the
+        previous update's voxel grids and checked on the last update's."""
+        if getattr(self._unet3d, '_include_prev_layer', False):
+            raise ValueError(
+                'Acting with the previous layer\'s voxel grid cannot be '
+                'exported.')
+        device = device or torch.device('cpu')
+        # Needs two updates, one to calibrate on and one held out.
+        int8 = self._int8_acting and len(self._calibration_batches or []) == 2
+        if int8 and device.type != 'cpu':
+            raise ValueError('int8 acting is only supported on CPU.')
+        vox_grid = VoxelGrid(
+            coord_bounds=self._coordinate_bounds.cpu()[0].tolist(),
+            voxel_size=self._voxel_size, device=device, batch_size=1,
+            feature_size=self._voxel_feature_size,
+            max_num_coords=np.prod(self._image_resolution) * self._num_cameras)
+        network, qnet = self._act_network()
+        q = QFunction(network, vox_grid, self._bounds_offset,
+                      self._rotation_resolution, device,
+                      self._channels_last_3d).to(device).eval()
+        q._qnet.load_state_dict(qnet.state_dict())
+        q._qnet.capture_latents = False
+        if int8:
+            q = self._int8_act_q(q)
+
+        # Crops only change the image size, not what is traced.
+        h, w = self._image_resolution
+        crop = self._image_crop_size if self._layer > 0 else None
+        rgbs, pcds = [], []
+        for n in self._camera_names:
+            size = (crop, crop) if crop and 'wrist' not in n else (h, w)
+            rgbs.append(torch.zeros(1, 3, *size, device=device))
+            pcds.append(torch.zeros(1, 3, *size, device=device))
+        inputs = [self._coordinate_bounds.to(device), rgbs, pcds]
+        if self._include_low_dim_state:
+            inputs.append(torch.zeros(
+                1, self._unet3d._low_dim_size, device=device))
+        with torch.no_grad():
+            traced = torch.jit.trace(
+                QAttentionActModule(q).eval(), tuple(inputs),
+                check_trace=False)
+        traced = torch.jit.freeze(traced)
+        path = os.path.join(savedir, '%s_act.pt' % self._name)
+        torch.jit.save(traced, path)
+        return path
+
+    def load_act_module(self, savedir: str):
+        # Tracing on CPU freezes CPU device constants (the voxel grid's
+        # buffers among them) into the graph.
+        if self._device.type != 'cpu':
+            raise ValueError('Act modules can only be loaded on CPU, not %s.'
+                             % self._device)
+        self._act_module = torch.jit.load(
+            os.path.join(savedir, '%s_act.pt' % self._name),
+            map_location=self._device)
+
     def load_weights(self, savedir: str):
         self._q.load_state_dict(
             torch.load(os.path.join(savedir, '%s.pt' % self._name),
                        map_location=torch.device('cpu')))
+        student = os.path.join(savedir, '%s_student.pt' % self._name)
+        if self._distiller is not None and os.path.exists(student):
+            self._distiller.q.load_state_dict(
+                torch.load(student, map_location=torch.device('cpu')))
+        # Agents on other devices act with the eager network.
+        if (self._exports_act_module() and self._device.type == 'cpu' and
+                os.path.exists(
+                    os.path.join(savedir, '%s_act.pt' % self._name))):
+            self.load_act_module(savedir)
 
     def save_weights(self, savedir: str):
         torch.save(
             self._q.state_dict(), os.path.join(savedir, '%s.pt' % self._name))
+        if self._distiller is not None:
+            torch.save(self._distiller.q.state_dict(),
+                       os.path.join(savedir, '%s_student.pt' % self._name))
+        if self._exports_act_module():
+            self.export_act_module(savedir)
+
+    def _exports_act_module(self) -> bool:
+        return (self._traced_acting or self._int8_acting or
+                self._distill_acting)
@@ -1,4 +1,6 @@
 
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
 import torch
@@ -16,29 +18,98 @@ REPLAY_ALPHA = 0.7
 REPLAY_BETA = 0.5
 
 
+def _set_num_threads(num_threads: int):
+    torch.set_num_threads(num_threads)
+    # A thread's first get_num_threads initialises its count from the
+    # process-wide one, which the caller restores after this runs.
+    torch.get_num_threads()
+
+
 class QAttentionStackAgent(Agent):
 
     def __init__(self,
                  qattention_agents: List[QAttentionAgent],
                  rotation_resolution: float,
                  camera_names: List[str],
-                 rotation_prediction_depth: int = 0):
+                 rotation_prediction_depth: int = 0,
+                 concurrent_updates: bool = False):
         super(QAttentionStackAgent, self).__init__()
         self._qattention_agents = qattention_agents
         self._rotation_resolution = rotation_resolution
         self._camera_names = camera_names
         self._rotation_prediction_depth = rotation_prediction_depth
+        self._concurrent_updates = concurrent_updates
+        self._executor = None
 
     def build(self, training: bool, device=None) -> None:
         for qa in self._qattention_agents:
             qa.build(training, device)
+        if training and self._concurrent_updates and len(
+                self._qattention_agents) > 1:
+            if any(getattr(qa._unet3d, '_include_prev_layer', False)
+                   for qa in self._qattention_agents):
+                raise ValueError(
+                    'Depths can only be updated concurrently when they do '
+                    'not take the previous layer\'s voxel grid.')
+            self._device = device or torch.device('cpu')
+            n = len(self._qattention_agents)
+            self._streams = [None] * n
+            if self._device.type == 'cuda':
+                self._streams = [torch.cuda.Stream(self._device)
+                                 for _ in range(n)]
+            # Split the intra-op threads between the depths on CPU. Each
+            # worker sets its share once as it starts; set_num_threads also
+            # resizes the process' intra-op pool, so the caller's count is
+            # restored once the barrier has started every worker.
+            threads = torch.get_num_threads()
+            self._executor = ThreadPoolExecutor(
+                max_workers=n, initializer=_set_num_threads,
+                initargs=(max(1, threads // n),))
+            barrier = threading.Barrier(n)
+            list(self._executor.map(lambda _: barrier.wait(), range(n)))
+            torch.set_num_threads(threads)
+
+    def _update_depth(self, qa, step, replay_sample, stream):
+        if stream is None:
+            return qa.update(step, replay_sample)
+        with torch.cuda.stream(stream):
+            return qa.update(step, replay_sample)
+
+    def _concurrent_update(self, step: int, replay_sample: dict) -> list:
+        # Each depth sees the sample as the first depth would: without an
+        # earlier depth's priority or voxel grids.
+        sample = {k: v for k, v in replay_sample.items() if k not in [
+            'priority', 'prev_layer_voxel_grid', 'prev_layer_voxel_grid_tp1']}
+        if self._streams[0] is not None:
+            current = torch.cuda.current_stream(self._device)
+            for stream in self._streams:
+                stream.wait_stream(current)
+        futures = [self._executor.submit(
+            self._update_depth, qa, step, sample, stream)
+            for qa, stream in zip(self._qattention_agents, self._streams)]
+        update_dicts = [f.result() for f in futures]
+        if self._streams[0] is not None:
+            for stream in self._streams:
+                current.wait_stream(stream)
+        # Chain the priorities as the sequential updates do, where each
+        # depth adds its own priority to that of the depth before.
+        prev_priority = replay_sample.get('priority', 0)
+        for update_dict in update_dicts:
+            update_dict['priority'] = update_dict['priority'] + prev_priority
+            prev_priority = update_dict['priority']
+        return update_dicts
 
     def update(self, step: int, replay_sample: dict) -> dict:
         priorities = 0
-        for qa in self._qattention_agents:
-            update_dict = qa.update(step, replay_sample)
-            priorities += update_dict['priority']
-            replay_sample.update(update_dict)
+        if self._executor is not None:
+            for update_dict in self._concurrent_update(step, replay_sample):
+                priorities += update_dict['priority']
+                replay_sample.update(update_dict)
+        else:
+            for qa in self._qattention_agents:
+                update_dict = qa.update(step, replay_sample)
+                priorities += update_dict['priority']
+                replay_sample.update(update_dict)
         return {
             'priority': (priorities) ** REPLAY_ALPHA,
         }
@@ -72,7 +143,9 @@ class QAttentionStackAgent(Agent):
                     attention_coordinate[0].numpy(),
                     observation['%s_camera_extrinsics' % n][0, 0].cpu().numpy(),
                     observation['%s_camera_intrinsics' % n][0, 0].cpu().numpy())
-                pc_t = torch.tensor([[[py, px]]], dtype=torch.float32)
+                # Whole pixel indices, as the replay stores them, so the
+                # crop engine gathers rather than grid samples.
+                pc_t = torch.tensor([[[py, px]]]).long()
                 observation['%s_pixel_coord' % n] = pc_t
                 observation_elements['%s_pixel_coord' % n] = [py, px]
 
@@ -92,6 +165,22 @@ class QAttentionStackAgent(Agent):
             info=infos
         )
 
+    def update_keys(self) -> List[str]:
+        keys = []
+        for qa in self._qattention_agents:
+            keys.extend([k for k in qa.update_keys() if k not in keys])
+        return keys
+
+    def summary_keys(self) -> List[str]:
+        keys = []
+        for qa in self._qattention_agents:
+            keys.extend([k for k in qa.summary_keys() if k not in keys])
+        return keys
+
+    def set_summary_capture(self, capture: bool):
+        for qa in self._qattention_agents:
+            qa.set_summary_capture(capture)
+
     def update_summaries(self) -> List[Summary]:
         summaries = []
         for qa in self._qattention_agents:
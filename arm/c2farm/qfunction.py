@@ -0,0 +1,101 @@
+import copy
+from typing import List
+
+import torch
+import torch.nn as nn
+
+from arm.c2farm.voxel_grid import VoxelGrid
+
+
+class QFunction(nn.Module):
+
+    def __init__(self,
+                 unet_3d: nn.Module,
+                 voxel_grid: VoxelGrid,
+                 bounds_offset: float,
+                 rotation_resolution: float,
+                 device,
+                 channels_last_3d: bool = False):
+        super(QFunction, self).__init__()
+        self._rotation_resolution = rotation_resolution
+        self._voxel_grid = voxel_grid
+        self._bounds_offset = bounds_offset
+        self._qnet = copy.deepcopy(unet_3d)
+        self._qnet._dev = device
+        self._qnet.build()
+        if channels_last_3d:
+            self._qnet.to(memory_format=torch.channels_last_3d)
+
+    def _argmax_3d(self, tensor_orig):
+        b, c, d, h, w = tensor_orig.shape  # c will be one
+        tensor = tensor_orig.max(1, keepdim=True)[0]
+        max_val_hw, argmax_hw = tensor.view(b, d, -1).max(2)
+        d_ = max_val_hw.argmax(1)
+        m = argmax_hw.gather(1, d_.unsqueeze(-1).repeat(1, d))[:, 0].unsqueeze(
+            -1)
+        indices = torch.cat((d_.unsqueeze(-1), (m // h) % w, m % w), dim=1)
+        return indices
+
+    def choose_highest_action(self, q_trans, q_rot_grip):
+        coords = self._argmax_3d(q_trans)
+        rot_and_grip_indicies = None
+        if q_rot_grip is not None:
+            q_rot = torch.stack(torch.split(
+                # q_rot_grip[:, :-2],
+                q_rot_grip[:, :],
+                int(360 // self._rotation_resolution),
+                dim=1), dim=1)
+            b, c, d, h, w = q_trans.shape  # c will be one
+            grasp_indicies = q_trans.view(b, c, -1).max(-1)[0].argmax(1, keepdim=True)
+            rot_and_grip_indicies = torch.cat(
+                [q_rot[:, 0:1].argmax(-1),
+                 q_rot[:, 1:2].argmax(-1),
+                 q_rot[:, 2:3].argmax(-1),
+                 grasp_indicies], -1)
+        return coords, rot_and_grip_indicies
+
+    def forward(self, x, proprio, pcd,
+                bounds=None, latent=None):
+        # x will be list of list (list of [rgb, pcd])
+        b = x[0][0].shape[0]
+        pcd_flat = torch.cat(
+            [p.permute(0, 2, 3, 1).reshape(b, -1, 3) for p in pcd], 1)
+
+        image_features = [xx[0] for xx in x]
+        feat_size = image_features[0].shape[1]
+        flat_imag_features = torch.cat(
+            [p.permute(0, 2, 3, 1).reshape(b, -1, feat_size) for p in
+             image_features], 1)
+
+        voxel_grid = self._voxel_grid.coords_to_bounding_voxel_grid(
+            pcd_flat, coord_features=flat_imag_features, coord_bounds=bounds)
+
+        # Swap to channels fist. This is only a view; in channels_last_3d
+        # mode its strides already match the network's memory format.
+        voxel_grid = voxel_grid.permute(0, 4, 1, 2, 3).detach()
+
+        q_trans, rot_and_grip_q = self._qnet(voxel_grid, proprio, latent)
+        return q_trans, rot_and_grip_q, voxel_grid
+
+    def latents(self):
+        return self._qnet.latent_dict
+
+
+class QAttentionActModule(nn.Module):
+    """The voxelisation, network and argmax of QAttentionAgent.act, on
+    already cropped batch 1 inputs, in a form torch.jit.trace can export."""
+
+    def __init__(self, q: QFunction):
+        super(QAttentionActModule, self).__init__()
+        self._q = q
+
+    def forward(self, bounds, rgbs: List[torch.Tensor],
+                pcds: List[torch.Tensor], proprio=None):
+        q_trans, q_rot_grip, voxel_grid = self._q(
+            [[rgb, pcd] for rgb, pcd in zip(rgbs, pcds)], proprio, pcds,
+            bounds)
+        coords, rot_and_grip_indicies = self._q.choose_highest_action(
+            q_trans, q_rot_grip)
+        if rot_and_grip_indicies is None:
+            return q_trans, voxel_grid, coords
+        return q_trans, voxel_grid, coords, rot_and_grip_indicies
@@ -0,0 +1,163 @@
+"""Pure PyTorch sparse 3D convolutions over the occupied voxels of a grid.
+
+Features are only stored for active sites. A convolution gathers the
+features of each output site's active neighbours, multiplies them with the
+kernel in one GEMM and scatters the result back to the output sites. Missing
+neighbours read as zeros, so every op here equals its dense nn.Conv3d
+counterpart (zero padding) run on a grid whose inactive voxels are zero,
+evaluated at the active output sites only.
+"""
+import itertools
+
+import torch
+import torch.nn as nn
+
+from arm.network_utils import LRELU_SLOPE, act_layer
+
+
+class SparseVoxels(object):
+    """Active sites of a batch of cubic voxel grids.
+
+    coords is (N, 4) holding (batch, z, y, x) and feats is (N, C). Sites are
+    kept sorted by their linear index, which is what nonzero() and unique()
+    produce, so neighbour lookups are a searchsorted away.
+    """
+
+    def __init__(self, coords, feats, batch_size, spatial_size,
+                 _cache=None):
+        self.coords = coords
+        self.feats = feats
+        self.batch_size = batch_size
+        self.spatial_size = spatial_size
+        # Neighbour maps only depend on coords, so they are shared by every
+        # submanifold conv at this resolution.
+        self._cache = {} if _cache is None else _cache
+
+    @staticmethod
+    def from_dense(x, mask):
+        """x is (B, C, S, S, S) and mask is a (B, S, S, S) bool tensor."""
+        coords = mask.nonzero()
+        feats = x.permute(0, 2, 3, 4, 1)[mask]
+        return SparseVoxels(coords, feats, x.shape[0], x.shape[-1])
+
+    def replace(self, feats):
+        return SparseVoxels(self.coords, feats, self.batch_size,
+                            self.spatial_size, self._cache)
+
+    def keys(self, coords=None):
+        coords = self.coords if coords is None else coords
+        s = self.spatial_size
+        return ((coords[:, 0] * s + coords[:, 1]) * s +
+                coords[:, 2]) * s + coords[:, 3]
+
+    def neighbours(self, offsets):
+        """(N, K) index into feats of each site's neighbour at each offset,
+        or N where that neighbour is not active."""
+        name = tuple(map(tuple, offsets.tolist()))
+        if name not in self._cache:
+            n = self.coords.shape[0]
+            keys = self.keys()
+            query = self.coords.unsqueeze(1).repeat(1, offsets.shape[0], 1)
+            query[..., 1:] += offsets.to(self.coords.device)
+            query = query.view(-1, 4)
+            inside = ((query[:, 1:] >= 0) &
+                      (query[:, 1:] < self.spatial_size)).all(-1)
+            query_keys = self.keys(query)
+            idx = torch.searchsorted(keys, query_keys).clamp(max=max(n - 1, 0))
+            found = inside & (keys[idx] == query_keys)
+            self._cache[name] = torch.where(
+                found, idx, torch.full_like(idx, n)).view(n, -1)
+        return self._cache[name]
+
+    def to_dense(self):
+        c = self.feats.shape[-1]
+        s = self.spatial_size
+        dense = self.feats.new_zeros(self.batch_size, s, s, s, c)
+        dense[self.coords[:, 0], self.coords[:, 1], self.coords[:, 2],
+              self.coords[:, 3]] = self.feats
+        return dense.permute(0, 4, 1, 2, 3)
+
+
+def _kernel_offsets(kernel_size):
+    r = range(-(kernel_size // 2), kernel_size // 2 + 1)
+    return torch.tensor(list(itertools.product(r, r, r)), dtype=torch.long)
+
+
+def _init_conv_weight(weight, bias, activation):
+    # Same as Conv3DBlock, on a weight laid out like nn.Conv3d's.
+    if activation is None:
+        nn.init.xavier_uniform_(weight, gain=nn.init.calculate_gain('linear'))
+    elif activation == 'tanh':
+        nn.init.xavier_uniform_(weight, gain=nn.init.calculate_gain('tanh'))
+    elif activation == 'lrelu':
+        nn.init.kaiming_uniform_(weight, a=LRELU_SLOPE,
+                                 nonlinearity='leaky_relu')
+    elif activation == 'relu':
+        nn.init.kaiming_uniform_(weight, nonlinearity='relu')
+    else:
+        raise ValueError()
+    nn.init.zeros_(bias)
+    return None if activation is None else act_layer(activation)
+
+
+class SubMConv3d(nn.Module):
+    """Submanifold conv: output sites are the input sites, so the active set
+    does not dilate from layer to layer. The weight has nn.Conv3d's layout
+    and can be loaded into or from one."""
+
+    def __init__(self, in_channels, out_channels, kernel_size=3,
+                 activation=None):
+        super(SubMConv3d, self).__init__()
+        self.weight = nn.Parameter(torch.empty(
+            out_channels, in_channels, kernel_size, kernel_size, kernel_size))
+        self.bias = nn.Parameter(torch.empty(out_channels))
+        self.activation = _init_conv_weight(self.weight, self.bias, activation)
+        self.register_buffer(
+            'offsets', _kernel_offsets(kernel_size), persistent=False)
+        self.out_channels = out_channels
+
+    def forward(self, x: SparseVoxels):
+        n, c = x.feats.shape
+        nbrs = x.neighbours(self.offsets)
+        padded = torch.cat([x.feats, x.feats.new_zeros(1, c)], 0)
+        cols = padded[nbrs].view(n, -1)
+        # (O, C, k, k, k) -> (k^3 * C, O), matching the order of cols.
+        weight = self.weight.permute(2, 3, 4, 1, 0).reshape(cols.shape[1], -1)
+        out = torch.addmm(self.bias, cols, weight)
+        out = self.activation(out) if self.activation is not None else out
+        return x.replace(out)
+
+
+class SparseDownsample3d(nn.Module):
+    """Kernel 2, stride 2 sparse conv. An output site is active when any of
+    its eight children is. Each child multiplies with the kernel slice of
+    its position within the parent, grouped into eight GEMMs."""
+
+    def __init__(self, in_channels, out_channels, activation=None):
+        super(SparseDownsample3d, self).__init__()
+        self.weight = nn.Parameter(torch.empty(
+            out_channels, in_channels, 2, 2, 2))
+        self.bias = nn.Parameter(torch.empty(out_channels))
+        self.activation = _init_conv_weight(self.weight, self.bias, activation)
+        self.out_channels = out_channels
+
+    def forward(self, x: SparseVoxels):
+        parent = x.coords.clone()
+        parent[:, 1:] //= 2
+        coarse = SparseVoxels(None, None, x.batch_size, x.spatial_size // 2)
+        out_keys, inverse = torch.unique(
+            coarse.keys(parent), sorted=True, return_inverse=True)
+        out_coords = parent.new_empty(out_keys.shape[0], 4)
+        out_coords[inverse] = parent
+        child = x.coords[:, 1:] % 2
+        child = child[:, 0] * 4 + child[:, 1] * 2 + child[:, 2]
+        weight = self.weight.permute(2, 3, 4, 1, 0).reshape(
+            8, x.feats.shape[1], -1)
+        out = x.feats.new_zeros(out_keys.shape[0], self.out_channels)
+        for k in range(8):
+            idx = (child == k).nonzero().view(-1)
+            if idx.numel() > 0:
+                out.index_add_(0, inverse[idx], x.feats[idx] @ weight[k])
+        out = out + self.bias
+        out = self.activation(out) if self.activation is not None else out
+        return SparseVoxels(out_coords, out, x.batch_size, coarse.spatial_size)
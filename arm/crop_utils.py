@@ -0,0 +1,106 @@
+from typing import List
+
+import torch
+import torch.nn.functional as F
+
+
+class CropEngine(object):
+    """Square nearest-neighbour crops of image observations, taken with
+    integer gathers.
+
+    A crop around pixel coordinate (row, col) starts at
+    clamp(coord - crop_size // 2, 0, w - bound_size). It matches the
+    F.grid_sample(mode='nearest', align_corners=True) crops this replaces
+    pixel for pixel. Those crops normalise by the image width rather than
+    width - 1, so offset i actually samples pixel round(i * (w - 1) / w).
+    That rounding is read off grid_sample once per image size and device,
+    and every crop after that is a table lookup plus a gather.
+
+    Images are (B, C, H, W), or (B, T, C, H, W) with the frames stacked on
+    channels like stack_on_channel does. Floating point coordinates still go
+    through grid_sample (telling whole numbers apart would sync with the
+    device), so pass pixel indices as integer tensors.
+    """
+
+    def __init__(self, crop_size: int, bound_size: int = None):
+        self._crop_size = crop_size
+        self._bound_size = crop_size if bound_size is None else bound_size
+        self._aranges = {}
+        self._luts = {}
+
+    def _lut(self, size, w, device):
+        key = (size, w, str(device))
+        if key not in self._luts:
+            idx = torch.arange(w, device=device)
+            coord = ((idx / float(w)) * 2.0) - 1.0
+            grid = torch.stack([coord, torch.full_like(coord, -1.)], -1)
+            # Shifted by one so that zero padding (out of range) reads -1.
+            image = torch.arange(1, size + 1, dtype=torch.float,
+                                 device=device).view(1, 1, 1, size)
+            lut = F.grid_sample(image, grid.view(1, 1, w, 2), mode='nearest',
+                                align_corners=True).view(-1).long() - 1
+            if (lut < 0).any():
+                raise ValueError(
+                    'Crops of %d x %d images sample outside the image.' % (
+                        size, w))
+            self._luts[key] = lut
+        return self._luts[key]
+
+    def _arange(self, device):
+        key = str(device)
+        if key not in self._aranges:
+            self._aranges[key] = torch.arange(self._crop_size, device=device)
+        return self._aranges[key]
+
+    def flat_indices(self, pixel_coords: torch.Tensor, h: int, w: int):
+        """(..., 2) pixel coords to (..., crop_size ** 2) indices into the
+        flattened h x w image."""
+        device = pixel_coords.device
+        corner = torch.clamp(
+            pixel_coords.long() - self._crop_size // 2, 0,
+            w - self._bound_size)
+        offsets = corner.unsqueeze(-1) + self._arange(device)
+        rows = self._lut(h, w, device)[offsets[..., 0, :]]
+        cols = self._lut(w, w, device)[offsets[..., 1, :]]
+        return (rows.unsqueeze(-1) * w + cols.unsqueeze(-2)).flatten(-2)
+
+    def gather(self, image: torch.Tensor, flat_indices: torch.Tensor):
+        b, h, w = image.shape[0], image.shape[-2], image.shape[-1]
+        image = image.reshape(b, -1, h * w)
+        crop = image.gather(2, flat_indices.unsqueeze(1).expand(
+            -1, image.shape[1], -1))
+        return crop.view(b, -1, self._crop_size, self._crop_size)
+
+    def _grid_sample_crop(self, pixel_coords, image):
+        # The sampling the gathers reproduce, for non-integer coordinates.
+        w = image.shape[-1]
+        corner = torch.clamp(pixel_coords - self._crop_size // 2, 0,
+                             w - self._bound_size)
+        arange = self._arange(image.device)
+        grid = torch.stack([
+            arange.view(1, 1, -1).expand(-1, self._crop_size, -1),
+            arange.view(1, -1, 1).expand(-1, -1, self._crop_size)], -1)
+        grid = grid + corner.flip(-1).view(-1, 1, 1, 2)
+        grid = ((grid / float(w)) * 2.0) - 1.0
+        image = image.reshape(image.shape[0], -1, *image.shape[-2:])
+        return F.grid_sample(image, grid, mode='nearest', align_corners=True)
+
+    def crop(self, pixel_coords: List[torch.Tensor],
+             images: List[List[torch.Tensor]]) -> List[List[torch.Tensor]]:
+        """Crops each of images[i] around the (B, 2) or (B, 1, 2)
+        pixel_coords[i], e.g. every camera's rgb and point cloud at t and
+        t + 1 in one call. All images share their size and batch size; the
+        indices are computed once."""
+        first = images[0][0]
+        h, w = first.shape[-2:]
+        if any(x.shape[-2:] != first.shape[-2:] for group in images
+               for x in group):
+            raise ValueError('All cropped images need the same size.')
+        coords = torch.stack([c.to(first.device).reshape(c.shape[0], 2)
+                              for c in pixel_coords])
+        if coords.is_floating_point():
+            return [[self._grid_sample_crop(coords[i], x) for x in group]
+                    for i, group in enumerate(images)]
+        flat = self.flat_indices(coords, h, w)
+        return [[self.gather(x, flat[i]) for x in group]
+                for i, group in enumerate(images)]
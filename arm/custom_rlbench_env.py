@@ -14,6 +14,8 @@ from yarr.envs.rlbench_env import RLBenchEnv
 from yarr.utils.observation_type import ObservationElement
 from yarr.utils.transition import Transition
 
+from arm.utils import COMPACT_DEPTH_SCALE
+
 # New(Mandi):
 from rlbench.backend.utils import task_file_to_task_class 
 from hydra.utils import instantiate
@@ -33,11 +35,27 @@ class CustomRLBenchEnv(RLBenchEnv):
                  dataset_root: str = '',
                  channels_last: bool = False,
                  reward_scale=100.0,
-                 headless: bool = True,):
+                 headless: bool = True,
+                 state_includes_remaining_time: bool = True,
+                 include_previous_action: bool = False,
+                 compact_depth: bool = False):
         super(CustomRLBenchEnv, self).__init__(
             task_class, observation_config, action_mode, dataset_root,
             channels_last, headless=headless)
         self._reward_scale = reward_scale
+        self._state_includes_remaining_time = state_includes_remaining_time
+        self._include_previous_action = include_previous_action
+        # Store int16 depth plus camera matrices instead of float point
+        # clouds; PreprocessAgent rebuilds the point clouds on device.
+        self._compact_depth = compact_depth
+        self._depth_cameras = []
+        if compact_depth:
+            self._depth_cameras = [name for config, name in [
+                (observation_config.left_shoulder_camera, 'left_shoulder'),
+                (observation_config.right_shoulder_camera, 'right_shoulder'),
+                (observation_config.overhead_camera, 'overhead'),
+                (observation_config.wrist_camera, 'wrist'),
+                (observation_config.front_camera, 'front')] if config.depth]
         self._episode_index = 0
         self._record_current_episode = False
         self._record_cam = None
@@ -53,8 +71,32 @@ class CustomRLBenchEnv(RLBenchEnv):
             if oe.name == 'low_dim_state':
                 oe.shape = (oe.shape[0] - 7 * 2,)  # remove pose and joint velocities as they will not be included
                 self.low_dim_state_len = oe.shape[0]
+            elif oe.name in ['%s_depth' % n for n in self._depth_cameras]:
+                oe.type = np.int16
+        names = [oe.name for oe in obs_elems]
+        for n in self._depth_cameras:
+            if '%s_camera_extrinsics' % n not in names:
+                obs_elems.append(ObservationElement(
+                    '%s_camera_extrinsics' % n, (4, 4), np.float32))
+                obs_elems.append(ObservationElement(
+                    '%s_camera_intrinsics' % n, (3, 3), np.float32))
         return obs_elems
 
+    def _compact_depth_obs(self, obs: Observation, obs_dict: dict):
+        for n in self._depth_cameras:
+            # RLBench depth is normalised between the clipping planes.
+            near = obs.misc['%s_camera_near' % n]
+            far = obs.misc['%s_camera_far' % n]
+            depth = near + obs_dict['%s_depth' % n] * (far - near)
+            obs_dict['%s_depth' % n] = np.clip(
+                np.around(depth * COMPACT_DEPTH_SCALE), 0,
+                np.iinfo(np.int16).max).astype(np.int16)
+            obs_dict['%s_camera_extrinsics' % n] = obs.misc[
+                '%s_camera_extrinsics' % n].astype(np.float32)
+            obs_dict['%s_camera_intrinsics' % n] = obs.misc[
+                '%s_camera_intrinsics' % n].astype(np.float32)
+        return obs_dict
+
     def extract_obs(self, obs: Observation, t=None, prev_action=None):
         obs.joint_velocities = None
         grip_mat = obs.gripper_matrix
@@ -69,6 +111,8 @@ class CustomRLBenchEnv(RLBenchEnv):
         obs_dict = super(CustomRLBenchEnv, self).extract_obs(obs)
         obs.gripper_matrix = grip_mat
         obs.gripper_pose = grip_pose
+        if self._compact_depth:
+            obs_dict = self._compact_depth_obs(obs, obs_dict)
         return obs_dict
 
     def launch(self):
@@ -155,7 +199,8 @@ class MultiTaskRLBenchEnv(CustomRLBenchEnv):
                  headless: bool = True,
                  state_includes_remaining_time: bool = True,
                  include_previous_action: bool = False,
-                 sample_method: str = 'uniform'
+                 sample_method: str = 'uniform',
+                 compact_depth: bool = False
                  ):
         self.train_tasks = train_tasks
         self.train_task_classes = {
@@ -175,7 +220,8 @@ class MultiTaskRLBenchEnv(CustomRLBenchEnv):
             reward_scale,
             headless,
             state_includes_remaining_time,
-            include_previous_action)
+            include_previous_action,
+            compact_depth=compact_depth)
         
         self.n_train_tasks, self.n_eval_tasks = len(train_tasks), len(eval_tasks)
         self.n_unique_tasks = len( set(train_tasks + eval_tasks) )
@@ -1,8 +1,13 @@
+from __future__ import annotations
+
 import logging
-from typing import List
+from typing import List, TYPE_CHECKING
 
 import numpy as np
-from rlbench.demo import Demo
+
+if TYPE_CHECKING:
+    # Type hints only; RLBench needs CoppeliaSim to import.
+    from rlbench.demo import Demo
 
 
 def _is_stopped(demo, i, obs, stopped_buffer, delta=0.1):
@@ -37,6 +37,19 @@ def norm_layer2d(norm, channels):
         raise ValueError('%s not recognized.' % norm)
 
 
+def norm_layer3d(norm, channels):
+    if norm == 'batch':
+        return nn.BatchNorm3d(channels)
+    elif norm == 'instance':
+        return nn.InstanceNorm3d(channels, affine=True)
+    elif norm == 'layer':
+        return nn.GroupNorm(1, channels, affine=True)
+    elif norm == 'group':
+        return nn.GroupNorm(4, channels, affine=True)
+    else:
+        raise ValueError('%s not recognized.' % norm)
+
+
 def norm_layer1d(norm, num_channels):
     if norm == 'batch':
         return nn.BatchNorm1d(num_channels)
@@ -48,6 +61,66 @@ def norm_layer1d(norm, num_channels):
         raise ValueError('%s not recognized.' % norm)
 
 
+def _tile_low_dim(low_dim, x):
+    return low_dim.view(low_dim.shape + (1,) * (x.dim() - 2)).expand(
+        (-1, -1) + x.shape[2:])
+
+
+def _is_fused(module):
+    # Set on a leaf while an EnsembleForward is running it (see below).
+    return getattr(module, '_ensemble_members', None) is not None
+
+
+def _is_channels_last_3d(x):
+    return x.dim() == 5 and not x.is_contiguous() and x.is_contiguous(
+        memory_format=torch.channels_last_3d)
+
+
+def _pointwise_conv3d(conv, x, weight):
+    # A 1x1x1 conv over channels_last_3d data is a linear layer over the
+    # last dim of the (b, d, h, w, c) view; conv3d would return it
+    # channels-first because the weight layout is ambiguous.
+    return F.linear(x.permute(0, 2, 3, 4, 1), weight.flatten(1),
+                    conv.bias).permute(0, 4, 1, 2, 3)
+
+
+def _use_pointwise_conv3d(conv, x):
+    return (isinstance(conv, nn.Conv3d) and conv.kernel_size == (1, 1, 1)
+            and conv.stride == (1, 1, 1) and conv.groups == 1 and
+            _is_channels_last_3d(x) and not _is_fused(conv))
+
+
+def conv_with_low_dim(conv, x, low_dim):
+    """Applies conv to x concatenated with low_dim tiled over space.
+
+    A spatially constant input channel only adds a per output channel bias
+    when the padding repeats it, so the low_dim part of the weight is summed
+    over the kernel and applied as a bias instead of materialising the tiled
+    tensor. Zero padding breaks this at the borders, so that case still tiles,
+    as do convs that an EnsembleForward is currently running and stand-ins
+    for nn convs (e.g. arm.quantization's).
+    """
+    if conv.groups != 1:
+        raise ValueError('Low dim conditioning needs groups == 1.')
+    zero_padded = conv.padding_mode == 'zeros' and any(
+        p > 0 for p in conv.padding)
+    stand_in = not isinstance(conv, (nn.Conv2d, nn.Conv3d))
+    if zero_padded or stand_in or _is_fused(conv):
+        return conv(torch.cat([x, _tile_low_dim(low_dim, x)], dim=1))
+    conv_fn = F.conv3d if x.dim() == 5 else F.conv2d
+    if conv.padding_mode != 'zeros':
+        x = F.pad(x, conv._reversed_padding_repeated_twice,
+                  mode=conv.padding_mode)
+    channels = x.shape[1]
+    if _use_pointwise_conv3d(conv, x):
+        out = _pointwise_conv3d(conv, x, conv.weight[:, :channels])
+    else:
+        out = conv_fn(x, conv.weight[:, :channels], conv.bias, conv.stride,
+                      0, conv.dilation)
+    bias = F.linear(low_dim, conv.weight[:, channels:].flatten(2).sum(-1))
+    return out + bias.view(bias.shape + (1,) * (out.dim() - 2))
+
+
 class Conv2DBlock(nn.Module):
 
     def __init__(self, in_channels, out_channels, kernel_sizes, strides,
@@ -84,8 +157,11 @@ class Conv2DBlock(nn.Module):
         if activation is not None:
             self.activation = act_layer(activation)
 
-    def forward(self, x):
-        x = self.conv2d(x)
+    def forward(self, x, low_dim=None):
+        if low_dim is None:
+            x = self.conv2d(x)
+        else:
+            x = conv_with_low_dim(self.conv2d, x, low_dim)
         x = self.norm(x) if self.norm is not None else x
         x = self.activation(x) if self.activation is not None else x
         return x
@@ -128,8 +204,13 @@ class Conv3DBlock(nn.Module):
         if activation is not None:
             self.activation = act_layer(activation)
 
-    def forward(self, x):
-        x = self.conv3d(x)
+    def forward(self, x, low_dim=None):
+        if low_dim is None and _use_pointwise_conv3d(self.conv3d, x):
+            x = _pointwise_conv3d(self.conv3d, x, self.conv3d.weight)
+        elif low_dim is None:
+            x = self.conv3d(x)
+        else:
+            x = conv_with_low_dim(self.conv3d, x, low_dim)
         x = self.norm(x) if self.norm is not None else x
         x = self.activation(x) if self.activation is not None else x
         return x
@@ -207,6 +288,9 @@ class SiameseNet(nn.Module):
         self._norm = norm
         self._activation = activation
         self.output_channels = filters[-1] #* len(input_channels)
+        # Whether forward records (detached, spatially averaged) streams.
+        self.capture_latents = True
+        self.streams = []
 
     def build(self):
         self._siamese_blocks = nn.ModuleList()
@@ -226,8 +310,10 @@ class SiameseNet(nn.Module):
         if len(x) != len(self._siamese_blocks):
             raise ValueError('Expected a list of tensors of size %d.' % len(
                 self._siamese_blocks))
-        self.streams = [stream(y) for y, stream in zip(x, self._siamese_blocks)]
-        y = self._fuse(torch.cat(self.streams, 1))
+        streams = [stream(y) for y, stream in zip(x, self._siamese_blocks)]
+        self.streams = [z.detach().flatten(2).mean(-1) for z in streams] if (
+            self.capture_latents) else []
+        y = self._fuse(torch.cat(streams, 1))
         return y
 
 
@@ -282,11 +368,8 @@ class CNNAndFcsNet(nn.Module):
 
     def forward(self, observations, low_dim_ins):
         x = self._siamese_net(observations)
-        _, _, h, w = x.shape
-        low_dim_latents = low_dim_ins.unsqueeze(
-            -1).unsqueeze(-1).repeat(1, 1, h, w)
-        combined = torch.cat([x, low_dim_latents], dim=1)
-        x = self._cnn(combined)
+        x = self._cnn[0](x, low_dim_ins)
+        x = self._cnn[1:](x)
         x = self._maxp(x).squeeze(-1).squeeze(-1)
         return self._fcs(x)
 
@@ -294,12 +377,14 @@ class CNNAndFcsNet(nn.Module):
 class Conv3DInceptionBlockUpsampleBlock(nn.Module):
 
     def __init__(self, in_channels, out_channels, scale_factor,
-                 norm=None, activation=None, residual=False):
+                 norm=None, activation=None, residual=False,
+                 padding_mode='replicate'):
         super(Conv3DInceptionBlockUpsampleBlock, self).__init__()
         layer = []
 
         convt_block = Conv3DInceptionBlock(
-            in_channels, out_channels, norm, activation)
+            in_channels, out_channels, norm, activation,
+            padding_mode=padding_mode)
         layer.append(convt_block)
 
         if scale_factor > 1:
@@ -308,7 +393,8 @@ class Conv3DInceptionBlockUpsampleBlock(nn.Module):
                 align_corners=False))
 
         convt_block = Conv3DInceptionBlock(
-            out_channels, out_channels, norm, activation)
+            out_channels, out_channels, norm, activation,
+            padding_mode=padding_mode)
         layer.append(convt_block)
 
         self.conv_up = nn.Sequential(*layer)
@@ -318,55 +404,122 @@ class Conv3DInceptionBlockUpsampleBlock(nn.Module):
 
 
 class Conv3DInceptionBlock(nn.Module):
+    """The three 1x1 branches run as one conv whose output is split between
+    the 1x1 output, the 3x3 branch and the 5x5-via-3x3 branch."""
+
+    _1X1_BRANCHES = ['_1x1conv', '_1x1conv_a', '_1x1conv_b']
 
     def __init__(self, in_channels, out_channels, norm=None, activation=None,
-                 residual=False):
+                 residual=False, padding_mode='replicate'):
         super(Conv3DInceptionBlock, self).__init__()
         self._residual = residual
         cs = out_channels // 4
         assert out_channels % 4 == 0
         latent = 32
-        self._1x1conv = Conv3DBlock(
-            in_channels, cs * 2, kernel_sizes=1, strides=1, norm=norm,
-            activation=activation)
+        self._1x1_splits = [cs * 2, latent, latent]
+        self._1x1convs = Conv3DBlock(
+            in_channels, sum(self._1x1_splits), kernel_sizes=1, strides=1,
+            norm=None, activation=activation)
+        self._1x1norms = None
+        if norm is not None:
+            # Normalise each branch on its own before the activation.
+            self._1x1convs.activation = None
+            self._1x1norms = nn.ModuleList(
+                [norm_layer3d(norm, c) for c in self._1x1_splits])
+            self._1x1activation = act_layer(activation) if (
+                activation is not None) else None
 
-        self._1x1conv_a = Conv3DBlock(
-            in_channels, latent, kernel_sizes=1, strides=1, norm=norm,
-            activation=activation)
         self._3x3conv = Conv3DBlock(
             latent, cs, kernel_sizes=3, strides=1,
-            norm=norm, activation=activation)
+            norm=norm, activation=activation, padding_mode=padding_mode)
 
-        self._1x1conv_b = Conv3DBlock(
-            in_channels, latent, kernel_sizes=1, strides=1, norm=norm,
-            activation=activation)
         self._5x5_via_3x3conv_a = Conv3DBlock(
             latent, latent, kernel_sizes=3, strides=1, norm=norm,
-            activation=activation)
+            activation=activation, padding_mode=padding_mode)
         self._5x5_via_3x3conv_b = Conv3DBlock(
             latent, cs, kernel_sizes=3, strides=1, norm=norm,
-            activation=activation)
+            activation=activation, padding_mode=padding_mode)
         self.out_channels = out_channels + (in_channels if residual else 0)
 
-    def forward(self, x):
-        yy = []
+    def _load_from_state_dict(self, state_dict, prefix, local_metadata,
+                              strict, missing_keys, unexpected_keys,
+                              error_msgs):
+        # Checkpoints from before the fusion hold three separate 1x1 convs.
+        legacy = [prefix + '%s.conv3d.' % n for n in self._1X1_BRANCHES]
+        if legacy[0] + 'weight' in state_dict:
+            for param in ['weight', 'bias']:
+                state_dict[prefix + '_1x1convs.conv3d.' + param] = torch.cat(
+                    [state_dict.pop(l + param) for l in legacy], 0)
+            for i, n in enumerate(self._1X1_BRANCHES):
+                norm_prefix = prefix + '%s.norm.' % n
+                for k in [k for k in state_dict if k.startswith(norm_prefix)]:
+                    state_dict[prefix + '_1x1norms.%d.' % i + k[len(
+                        norm_prefix):]] = state_dict.pop(k)
+        super(Conv3DInceptionBlock, self)._load_from_state_dict(
+            state_dict, prefix, local_metadata, strict, missing_keys,
+            unexpected_keys, error_msgs)
+
+    def forward(self, x, low_dim=None):
+        # low_dim is treated as extra input channels tiled over the volume.
+        y = self._1x1convs(x, low_dim)
+        y1x1, ya, yb = y.split(self._1x1_splits, 1)
+        if self._1x1norms is not None:
+            y1x1, ya, yb = [n(z) for n, z in zip(self._1x1norms, [y1x1, ya, yb])]
+            if self._1x1activation is not None:
+                y1x1, ya, yb = [self._1x1activation(z) for z in [y1x1, ya, yb]]
+
+        # Keep channels_last_3d activations in that format.
+        out = torch.empty(
+            (y.shape[0], self.out_channels) + y.shape[2:], dtype=y.dtype,
+            device=y.device, memory_format=torch.channels_last_3d if (
+                _is_channels_last_3d(y)) else torch.contiguous_format)
+        c = 0
         if self._residual:
-            yy = [x]
-        return torch.cat(yy + [self._1x1conv(x),
-                               self._3x3conv(self._1x1conv_a(x)),
-                               self._5x5_via_3x3conv_b(self._5x5_via_3x3conv_a(
-                                   self._1x1conv_b(x)))], 1)
+            out[:, :x.shape[1]] = x
+            c = x.shape[1]
+            if low_dim is not None:
+                out[:, c:c + low_dim.shape[1]] = _tile_low_dim(low_dim, x)
+                c += low_dim.shape[1]
+        for z in [y1x1, self._3x3conv(ya),
+                  self._5x5_via_3x3conv_b(self._5x5_via_3x3conv_a(yb))]:
+            out[:, c:c + z.shape[1]] = z
+            c += z.shape[1]
+        return out
+
+
+def convert_padding_mode(module: nn.Module, padding_mode: str):
+    """Switches the padding mode of every conv in module in place, e.g. to
+    fine-tune a replicate-padded checkpoint with implicit zero padding.
+    Any mode other than 'zeros' makes a padded copy of each conv input.
+    Networks that record their padding mode (e.g. for hparams) are updated
+    too, so that rebuilding them from hparams gives the converted network."""
+    for m in module.modules():
+        if isinstance(m, (nn.Conv2d, nn.Conv3d)):
+            m.padding_mode = padding_mode
+        elif hasattr(m, '_padding_mode'):
+            m._padding_mode = padding_mode
+    return module
+
+
+def _autocast_disabled(device_type: str):
+    # torch.autocast (PyTorch 1.10+) also covers CPU autocast; before it
+    # there was only the CUDA one.
+    if hasattr(torch, 'autocast'):
+        return torch.autocast(device_type=device_type, enabled=False)
+    return torch.cuda.amp.autocast(enabled=False)
 
 
 class SpatialSoftmax3D(torch.nn.Module):
 
-    def __init__(self, depth, height, width, channel):
+    def __init__(self, depth, height, width, channel, log_sum_exp=False):
         super(SpatialSoftmax3D, self).__init__()
         self.depth = depth
         self.height = height
         self.width = width
         self.channel = channel
         self.temperature = 0.01
+        # Normalise in fp32 via log-sum-exp; logits / 0.01 overflow in fp16.
+        self.log_sum_exp = log_sum_exp
         pos_x, pos_y, pos_z = np.meshgrid(
             np.linspace(-1., 1., self.depth),
             np.linspace(-1., 1., self.height),
@@ -381,17 +534,221 @@ class SpatialSoftmax3D(torch.nn.Module):
         self.register_buffer('pos_x', pos_x)
         self.register_buffer('pos_y', pos_y)
         self.register_buffer('pos_z', pos_z)
+        # (d*h*w, 3); rebuilt from the above, so not saved in checkpoints.
+        self.register_buffer(
+            'pos', torch.stack([pos_x, pos_y, pos_z], 1), persistent=False)
 
     def forward(self, feature):
-        feature = feature.view(
-            -1, self.height * self.width * self.depth)  # (B, c*d*h*w)
-        softmax_attention = F.softmax(feature / self.temperature, dim=-1)
-        expected_x = torch.sum(self.pos_x * softmax_attention, dim=1,
-                               keepdim=True)
-        expected_y = torch.sum(self.pos_y * softmax_attention, dim=1,
-                               keepdim=True)
-        expected_z = torch.sum(self.pos_z * softmax_attention, dim=1,
-                               keepdim=True)
-        expected_xy = torch.cat([expected_x, expected_y, expected_z], 1)
-        feature_keypoints = expected_xy.view(-1, self.channel * 3)
+        feature = feature.reshape(
+            -1, self.height * self.width * self.depth)  # (B*c, d*h*w)
+        if self.log_sum_exp:
+            with _autocast_disabled(feature.device.type):
+                logits = feature.float() / self.temperature
+                softmax_attention = torch.exp(
+                    logits - torch.logsumexp(logits, dim=-1, keepdim=True))
+                expected_xyz = torch.matmul(softmax_attention, self.pos)
+            expected_xyz = expected_xyz.to(feature.dtype)
+        else:
+            softmax_attention = F.softmax(feature / self.temperature, dim=-1)
+            expected_xyz = torch.matmul(
+                softmax_attention, self.pos.to(softmax_attention.dtype))
+        # Interleaved (x, y, z) per channel, as the dense heads expect.
+        feature_keypoints = expected_xyz.view(-1, self.channel * 3)
         return feature_keypoints
+
+
+
+def _member_affine(x, n, weight, bias, param_shape):
+    # x is (b * n, ...) and weight/bias stack one parameter per member.
+    # param_shape is how a single member's parameter broadcasts against
+    # x.shape[1:], e.g. (c, 1, 1) for a channel affine over (c, h, w).
+    xs = x.view(-1, n, *x.shape[1:])
+    shape = (n,) + tuple(param_shape)
+    xs = xs * weight.view(shape)
+    if bias is not None:
+        xs = xs + bias.view(shape)
+    return xs.view(x.shape)
+
+
+def _channel_shape(x, channels):
+    return (channels,) + (1,) * (x.dim() - 2)
+
+
+def _fused_conv(convs, x):
+    conv, n = convs[0], len(convs)
+    padding = conv.padding
+    if conv.padding_mode != 'zeros':
+        x = F.pad(x, conv._reversed_padding_repeated_twice,
+                  mode=conv.padding_mode)
+        padding = 0
+    conv_fn = [F.conv1d, F.conv2d, F.conv3d][x.dim() - 3]
+    bias = None if conv.bias is None else torch.cat([m.bias for m in convs])
+    # Member-minor batch: (b * n, c, ...) is (b, n * c, ...) for free.
+    out = conv_fn(x.reshape(-1, n * x.shape[1], *x.shape[2:]),
+                  torch.cat([m.weight for m in convs]), bias, conv.stride,
+                  padding, conv.dilation, conv.groups * n)
+    return out.view(-1, out.shape[1] // n, *out.shape[2:])
+
+
+def _fused_linear(linears, x):
+    n = len(linears)
+    weight = torch.stack([m.weight for m in linears]).transpose(1, 2)
+    xs = x.reshape(-1, n, x.shape[-1]).transpose(0, 1)
+    if linears[0].bias is None:
+        out = torch.bmm(xs, weight)
+    else:
+        bias = torch.stack([m.bias for m in linears]).unsqueeze(1)
+        out = torch.baddbmm(bias, xs, weight)
+    return out.transpose(0, 1).reshape(x.shape[:-1] + (-1,))
+
+
+def _fused_group_norm(norms, x):
+    norm = norms[0]
+    out = F.group_norm(x, norm.num_groups, None, None, norm.eps)
+    if not norm.affine:
+        return out
+    return _member_affine(
+        out, len(norms), torch.stack([m.weight for m in norms]),
+        torch.stack([m.bias for m in norms]),
+        _channel_shape(x, norm.num_channels))
+
+
+def _fused_instance_norm(norms, x):
+    norm = norms[0]
+    out = F.instance_norm(x, eps=norm.eps)
+    if not norm.affine:
+        return out
+    return _member_affine(
+        out, len(norms), torch.stack([m.weight for m in norms]),
+        torch.stack([m.bias for m in norms]),
+        _channel_shape(x, norm.num_features))
+
+
+def _fused_layer_norm(norms, x):
+    norm = norms[0]
+    out = F.layer_norm(x, norm.normalized_shape, None, None, norm.eps)
+    if not norm.elementwise_affine:
+        return out
+    shape = (1,) * (x.dim() - 1 - len(norm.normalized_shape)) + tuple(
+        norm.normalized_shape)
+    return _member_affine(
+        out, len(norms), torch.stack([m.weight for m in norms]),
+        torch.stack([m.bias for m in norms]), shape)
+
+
+def _fused_prelu(prelus, x):
+    weight = torch.stack([m.weight for m in prelus])
+    shape = (1,) * (x.dim() - 1) if weight.shape[1] == 1 else (
+        _channel_shape(x, weight.shape[1]))
+    return torch.where(
+        x >= 0, x, _member_affine(x, len(prelus), weight, None, shape))
+
+
+# Leaf modules with parameters that EnsembleForward knows how to batch.
+_FUSED_FORWARDS = [
+    ((nn.Conv1d, nn.Conv2d, nn.Conv3d), _fused_conv),
+    (nn.Linear, _fused_linear),
+    (nn.GroupNorm, _fused_group_norm),
+    ((nn.InstanceNorm1d, nn.InstanceNorm2d, nn.InstanceNorm3d),
+     _fused_instance_norm),
+    (nn.LayerNorm, _fused_layer_norm),
+    (nn.PReLU, _fused_prelu),
+]
+
+
+class EnsembleForward(object):
+    """Calls N >= 2 identically built modules, e.g. twin critics, on the
+    same inputs in one batched pass and returns the N outputs.
+
+    The batch is laid out member-minor, (b * n, ...), so that a conv input
+    is (b, n * c, ...) for free and runs as one grouped conv over the
+    members' concatenated weights; linears become one bmm and norm affines
+    one broadcast. The members' parameters are stacked on every call, so
+    gradients reach them and their state_dicts are unchanged. This is not
+    an nn.Module: the owner keeps the members as its own submodules.
+
+    Members with a parametrised leaf outside _FUSED_FORWARDS (batch norm,
+    say) or with differing buffers are simply called in turn, as are all
+    members on CPU unless cpu is set: there the grouped convs are slower
+    than separate ones (see benchmarks/fused_critics.py). Attributes a
+    member records during forward (latents) describe the fused batch and
+    are only set on the first member.
+    """
+
+    def __init__(self, members: List[nn.Module], cpu: bool = False):
+        if len(members) < 2:
+            raise ValueError(
+                'An ensemble needs at least 2 members, got %d.' % len(
+                    members))
+        self._members = members
+        self._cpu = cpu
+        self._leaves = self._fusable_leaves()
+        self.fused = self._leaves is not None
+
+    def _fusable_leaves(self):
+        named = [dict(m.named_modules()) for m in self._members]
+        if any(list(n.keys()) != list(named[0].keys()) for n in named[1:]):
+            return None
+        leaves = []
+        for name, module in named[0].items():
+            group = [n[name] for n in named]
+            if any(type(m) != type(module) for m in group):
+                return None
+            params = [list(m.parameters(recurse=False)) for m in group]
+            buffers = [list(m.buffers(recurse=False)) for m in group]
+            if len(params[0]) == 0:
+                # Constant buffers (e.g. SpatialSoftmax3D's grid) are fine.
+                if any(not all(torch.equal(a, b) for a, b in zip(
+                        buffers[0], other)) for other in buffers[1:]):
+                    return None
+                continue
+            fused = [fn for types, fn in _FUSED_FORWARDS
+                     if isinstance(module, types)]
+            if len(fused) == 0 or len(buffers[0]) > 0 or any(
+                    [p.shape for p in ps] != [p.shape for p in params[0]]
+                    for ps in params[1:]):
+                return None
+            leaves.append((group, fused[0]))
+        return leaves
+
+    def _expand(self, x):
+        n = len(self._members)
+        if isinstance(x, torch.Tensor):
+            return x.unsqueeze(1).expand(
+                x.shape[0], n, *x.shape[1:]).reshape(-1, *x.shape[1:])
+        if isinstance(x, (list, tuple)):
+            return type(x)(self._expand(y) for y in x)
+        return x
+
+    def _split(self, x, i):
+        n = len(self._members)
+        if isinstance(x, torch.Tensor):
+            return x.view(-1, n, *x.shape[1:])[:, i]
+        if isinstance(x, (list, tuple)):
+            return type(x)(self._split(y, i) for y in x)
+        return x
+
+    def _on_cpu(self, x):
+        if isinstance(x, torch.Tensor):
+            return x.device.type == 'cpu'
+        if isinstance(x, (list, tuple)):
+            return any(self._on_cpu(y) for y in x)
+        return False
+
+    def __call__(self, *args, **kwargs):
+        if not self.fused or (not self._cpu and self._on_cpu(args)):
+            return [m(*args, **kwargs) for m in self._members]
+        leaders = [group[0] for group, _ in self._leaves]
+        for group, fn in self._leaves:
+            leader = group[0]
+            leader._ensemble_members = group
+            leader.forward = (lambda g, f: lambda x: f(g, x))(group, fn)
+        try:
+            out = self._members[0](*self._expand(args),
+                                   **{k: self._expand(v)
+                                      for k, v in kwargs.items()})
+        finally:
+            for leader in leaders:
+                del leader._ensemble_members
+                del leader.forward
+        return [self._split(out, i) for i in range(len(self._members))]
@@ -5,12 +5,17 @@ import torch
 from yarr.agents.agent import Agent, Summary, ActResult, \
     ScalarSummary, HistogramSummary, ImageSummary
 
+from arm.utils import COMPACT_DEPTH_SCALE, depth_to_point_cloud
+
 
 class PreprocessAgent(Agent):
 
     def __init__(self,
-                 pose_agent: Agent):
+                 pose_agent: Agent,
+                 compact_depth: bool = False):
         self._pose_agent = pose_agent
+        self._compact_depth = compact_depth
+        self._summary_capture = True
 
     def build(self, training: bool, device: torch.device = None):
         self._pose_agent.build(training, device)
@@ -19,18 +24,33 @@ class PreprocessAgent(Agent):
     def _norm_rgb_(self, x):
         return (x.float() / 255.0) * 2.0 - 1.0
 
+    def _point_clouds_from_depth_(self, x: dict):
+        # Rebuilds '<cam>_point_cloud(_tp1)' from compact depth in place.
+        for k in [k for k in x.keys() if k.endswith(('_depth', '_depth_tp1'))]:
+            cam, _, suffix = k.partition('_depth')
+            depth = x.pop(k).float() / COMPACT_DEPTH_SCALE
+            x['%s_point_cloud%s' % (cam, suffix)] = depth_to_point_cloud(
+                depth, x['%s_camera_extrinsics%s' % (cam, suffix)],
+                x['%s_camera_intrinsics%s' % (cam, suffix)])
+        return x
+
     def update(self, step: int, replay_sample: dict) -> dict:
         # Samples are (B, N, ...) where N is number of buffers/tasks. This is a single task setup, so 0 index.
         replay_sample = {k: v[:, 0] for k, v in replay_sample.items()}
+        if self._compact_depth:
+            replay_sample = self._point_clouds_from_depth_(replay_sample)
         for k, v in replay_sample.items():
             if 'rgb' in k:
                 replay_sample[k] = self._norm_rgb_(v)
-        self._replay_sample = replay_sample
+        # Only hold on to the batch when it will be summarised.
+        self._replay_sample = replay_sample if self._summary_capture else None
         return self._pose_agent.update(step, replay_sample)
 
     def act(self, step: int, observation: dict,
             deterministic=False) -> ActResult:
         observation = {k: torch.tensor(v).to(self._device) for k, v in observation.items()}
+        if self._compact_depth:
+            observation = self._point_clouds_from_depth_(observation)
         for k, v in observation.items():
             if 'rgb' in k:
                 observation[k] = self._norm_rgb_(v)
@@ -38,6 +58,38 @@ class PreprocessAgent(Agent):
         act_res.replay_elements.update({'demo': False})
         return act_res
 
+    def update_keys(self) -> List[str]:
+        """Replay keys read by update. The trainer only gathers and moves
+        these (plus summary_keys on log iterations) to the device."""
+        return self._replay_keys(self._pose_agent.update_keys())
+
+    def summary_keys(self) -> List[str]:
+        keys = ['demo', 'low_dim_state', 'low_dim_state_tp1', 'timeout',
+                'sampling_probabilities']
+        return keys + [k for k in self._replay_keys(
+            self._pose_agent.summary_keys()) if k not in keys]
+
+    def _replay_keys(self, keys: List[str]) -> List[str]:
+        if not self._compact_depth:
+            return keys
+        replay_keys = []
+        for k in keys:
+            if '_point_cloud' in k:
+                cam, _, suffix = k.partition('_point_cloud')
+                mapped = ['%s_%s%s' % (cam, name, suffix) for name in [
+                    'depth', 'camera_extrinsics', 'camera_intrinsics']]
+            else:
+                mapped = [k]
+            replay_keys.extend([m for m in mapped if m not in replay_keys])
+        return replay_keys
+
+    def set_summary_capture(self, capture: bool):
+        """Toggled by the trainer so that activations and inputs are only
+        kept for summaries on log iterations."""
+        self._summary_capture = capture
+        if hasattr(self._pose_agent, 'set_summary_capture'):
+            self._pose_agent.set_summary_capture(capture)
+
     def update_summaries(self) -> List[Summary]:
         prefix = 'inputs'
         demo_f = self._replay_sample['demo'].float()
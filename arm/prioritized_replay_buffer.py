@@ -0,0 +1,124 @@
+import numpy as np
+import torch
+from yarr.replay_buffer import prioritized_replay_buffer
+
+
+class SumTree(object):
+    """Array-backed sum tree. Node 1 is the root and the children of node i
+    are 2i and 2i + 1; leaf j lives at node j + leaf_offset. All batched
+    operations walk the tree one level at a time, so their cost is
+    O(log capacity) NumPy calls regardless of the batch size."""
+
+    def __init__(self, capacity: int):
+        if capacity <= 0:
+            raise ValueError(
+                'Sum tree capacity should be positive. Got: %d' % capacity)
+        self._capacity = capacity
+        self._depth = int(np.ceil(np.log2(capacity))) if capacity > 1 else 0
+        self._leaf_offset = 2 ** self._depth
+        self._nodes = np.zeros(2 * self._leaf_offset, dtype=np.float64)
+        self.max_recorded_priority = 1.0
+
+    def _total_priority(self):
+        return self._nodes[1]
+
+    def _retrieve(self, query_values: np.ndarray) -> np.ndarray:
+        nodes = np.ones(len(query_values), dtype=np.int64)
+        for _ in range(self._depth):
+            left = 2 * nodes
+            left_sum = self._nodes[left]
+            # Never walk into an empty subtree because of rounding.
+            go_right = np.logical_and(
+                query_values >= left_sum, self._nodes[left + 1] > 0)
+            query_values = query_values - left_sum * go_right
+            nodes = left + go_right
+        return np.minimum(nodes - self._leaf_offset, self._capacity - 1)
+
+    def sample(self, batch_size: int = None):
+        if self._total_priority() == 0.0:
+            raise Exception('Cannot sample from an empty sum tree.')
+        n = 1 if batch_size is None else batch_size
+        query_values = np.random.random(n) * self._total_priority()
+        indices = self._retrieve(query_values)
+        return indices[0] if batch_size is None else indices
+
+    def stratified_sample(self, batch_size: int) -> np.ndarray:
+        if self._total_priority() == 0.0:
+            raise Exception('Cannot sample from an empty sum tree.')
+        bounds = np.linspace(0., 1., batch_size + 1)
+        query_values = (bounds[:-1] + np.random.random(batch_size) * (
+            bounds[1:] - bounds[:-1])) * self._total_priority()
+        return self._retrieve(query_values)
+
+    def get(self, node_index):
+        return self._nodes[np.asarray(node_index) + self._leaf_offset]
+
+    def set(self, node_index, value):
+        self.update([node_index], [value])
+
+    def update(self, indices, priorities):
+        indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+        priorities = np.asarray(priorities, dtype=np.float64).reshape(-1)
+        if np.any(priorities < 0.0):
+            raise ValueError('Sum tree values should be nonnegative.')
+        if len(indices) == 0:
+            return
+        self.max_recorded_priority = max(
+            float(priorities.max()), self.max_recorded_priority)
+        nodes = indices + self._leaf_offset
+        self._nodes[nodes] = priorities
+        for _ in range(self._depth):
+            # Duplicate parents just write the same sum twice.
+            nodes = nodes // 2
+            self._nodes[nodes] = self._nodes[2 * nodes] + self._nodes[
+                2 * nodes + 1]
+
+
+class PrioritizedReplayBuffer(
+        prioritized_replay_buffer.PrioritizedReplayBuffer):
+    """YARR's prioritized replay with batched sum-tree sampling and
+    priority updates."""
+
+    def __init__(self, *args, **kwargs):
+        super(PrioritizedReplayBuffer, self).__init__(*args, **kwargs)
+        self._sum_tree = SumTree(self._replay_capacity)
+
+    def _valid_transitions(self, indices: np.ndarray) -> np.ndarray:
+        # Frame stacks with a terminal inside them are only rejected by
+        # is_valid_transition.
+        if self._disk_saving or self._timesteps > 1:
+            return np.array([self.is_valid_transition(i) for i in indices],
+                            dtype=bool)
+        valid = np.logical_and(indices >= 0, indices < self._replay_capacity)
+        if not self.is_full():
+            valid &= indices < self._add_count.value - self._update_horizon
+            valid &= indices >= self._timesteps - 1
+        valid &= ~np.isin(indices, self.invalid_range)
+        valid &= self._store['terminal'][
+            indices % self._replay_capacity] != -1
+        return valid
+
+    def sample_index_batch(self, batch_size):
+        indices = self._sum_tree.stratified_sample(batch_size)
+        invalid = ~self._valid_transitions(indices)
+        allowed_attempts = self._max_sample_attempts
+        while invalid.any():
+            if allowed_attempts <= 0:
+                raise RuntimeError(
+                    'Max sample attempts: Tried {} times but only sampled {}'
+                    ' valid indices. Batch size is {}'.format(
+                        self._max_sample_attempts,
+                        batch_size - invalid.sum(), batch_size))
+            # Resampled entries are no longer stratified, as in YARR.
+            indices[invalid] = self._sum_tree.sample(int(invalid.sum()))
+            allowed_attempts -= int(invalid.sum())
+            invalid = ~self._valid_transitions(indices)
+        return indices
+
+    def set_priority(self, indices, priorities):
+        if isinstance(priorities, torch.Tensor):
+            priorities = priorities.detach().cpu().numpy()
+        self._sum_tree.update(indices, priorities)
+
+    def get_priority(self, indices):
+        return self._sum_tree.get(indices)
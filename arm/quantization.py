@@ -0,0 +1,125 @@
+"""Post-training int8 quantization of networks for acting on CPU.
+
+Every nn.Conv2d / nn.Conv3d becomes a static int8 conv whose input and
+output scales come from a calibration pass, and every nn.Linear a dynamic
+int8 linear. The stand-ins take and return fp32 tensors, so the blocks
+around them (norms, activations, softmaxes, concatenations) stay fp32 and
+unchanged. Quantized conv3d needs the fbgemm (x86) engine.
+
+    observed = prepare_int8(net)
+    for batch in calibration_batches:
+        observed(*batch)
+    net_int8 = convert_int8(observed)
+"""
+import copy
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.nn.quantized as nnq
+
+
+def _qconfig():
+    return torch.quantization.get_default_qconfig(
+        torch.backends.quantized.engine)
+
+
+class _ConvStandIn(nn.Module):
+    # The conv attributes network_utils.conv_with_low_dim reads. Anything
+    # that is not an nn.Conv2d / nn.Conv3d is run on the tiled input there.
+
+    def _copy_conv_attributes(self, conv):
+        self.in_channels = conv.in_channels
+        self.out_channels = conv.out_channels
+        self.groups = conv.groups
+        self.padding = conv.padding
+        self.padding_mode = conv.padding_mode
+
+
+class ObservedConv(_ConvStandIn):
+    """Runs a float conv and records the range of its input and output."""
+
+    def __init__(self, conv, qconfig=None):
+        super(ObservedConv, self).__init__()
+        qconfig = qconfig or _qconfig()
+        self.conv = conv
+        self.input_observer = qconfig.activation()
+        self.output_observer = qconfig.activation()
+        self.weight_observer = qconfig.weight()
+        self._copy_conv_attributes(conv)
+
+    def forward(self, x):
+        self.input_observer(x.detach())
+        out = self.conv(x)
+        self.output_observer(out.detach())
+        return out
+
+
+class Int8Conv(_ConvStandIn):
+    """Static int8 version of a calibrated ObservedConv, fp32 in and out.
+    Quantized convs only zero pad, so other padding modes pad in fp32
+    first."""
+
+    def __init__(self, observed: ObservedConv):
+        super(Int8Conv, self).__init__()
+        conv = observed.conv
+        self._copy_conv_attributes(conv)
+        self._pad = None
+        padding = conv.padding
+        if conv.padding_mode != 'zeros':
+            self._pad = conv._reversed_padding_repeated_twice
+            padding = 0
+        quantized_conv = nnq.Conv3d if isinstance(conv, nn.Conv3d) else (
+            nnq.Conv2d)
+        self.qconv = quantized_conv(
+            conv.in_channels, conv.out_channels, conv.kernel_size,
+            conv.stride, padding, conv.dilation, conv.groups,
+            conv.bias is not None)
+        weight = conv.weight.detach().float()
+        observed.weight_observer(weight)
+        scale, zero_point = observed.weight_observer.calculate_qparams()
+        self.qconv.set_weight_bias(
+            torch.quantize_per_channel(
+                weight, scale.double(), zero_point.long(), 0, torch.qint8),
+            None if conv.bias is None else conv.bias.detach().float())
+        scale, zero_point = observed.output_observer.calculate_qparams()
+        self.qconv.scale = float(scale)
+        self.qconv.zero_point = int(zero_point)
+        scale, zero_point = observed.input_observer.calculate_qparams()
+        self.input_scale = float(scale)
+        self.input_zero_point = int(zero_point)
+
+    def forward(self, x):
+        if self._pad is not None:
+            x = F.pad(x, self._pad, mode=self.padding_mode)
+        x = torch.quantize_per_tensor(
+            x.contiguous(), self.input_scale, self.input_zero_point,
+            torch.quint8)
+        return self.qconv(x).dequantize()
+
+
+def _swap_modules(module, swap):
+    for name, child in module.named_children():
+        new = swap(child)
+        if new is not None:
+            setattr(module, name, new)
+        else:
+            _swap_modules(child, swap)
+    return module
+
+
+def prepare_int8(module: nn.Module, qconfig=None) -> nn.Module:
+    """A copy of module, in eval mode, with every conv observed. Run the
+    calibration inputs through it, then pass it to convert_int8."""
+    observed = copy.deepcopy(module).cpu().eval()
+    return _swap_modules(observed, lambda m: ObservedConv(m, qconfig) if (
+        isinstance(m, (nn.Conv2d, nn.Conv3d))) else None)
+
+
+def convert_int8(observed: nn.Module) -> nn.Module:
+    """Replaces the calibrated convs of a prepare_int8 copy with Int8Conv
+    and its linear layers with dynamic int8 ones, in place."""
+    _swap_modules(observed, lambda m: Int8Conv(m) if (
+        isinstance(m, ObservedConv)) else None)
+    return torch.quantization.quantize_dynamic(
+        observed, {nn.Linear}, dtype=torch.qint8, inplace=True)
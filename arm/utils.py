@@ -3,11 +3,21 @@ import pyrender
 import torch
 import trimesh
 from pyrender.trackball import Trackball
-from rlbench.backend.const import DEPTH_SCALE
 from scipy.spatial.transform import Rotation
 
-SCALE_FACTOR = DEPTH_SCALE
 DEFAULT_SCENE_SCALE = 2.0
+# Compact depth is stored as int16 millimetres (torch has no uint16 tensors).
+COMPACT_DEPTH_SCALE = 1000.0
+
+
+def __getattr__(name):
+    # SCALE_FACTOR is RLBench's DEPTH_SCALE, imported only when it is used
+    # as RLBench needs CoppeliaSim to import.
+    if name == 'SCALE_FACTOR':
+        from rlbench.backend.const import DEPTH_SCALE
+        return DEPTH_SCALE
+    raise AttributeError(
+        'module %r has no attribute %r' % (__name__, name))
 
 
 def loss_weights(replay_sample, beta=1.0):
@@ -19,11 +29,47 @@ def loss_weights(replay_sample, beta=1.0):
     return loss_weights
 
 
-def soft_updates(net, target_net, tau):
-    for param, target_param in zip(net.parameters(), target_net.parameters()):
-        target_param.data.copy_(
-            tau * param.data + (1 - tau) * target_param.data
-        )
+def soft_updates(net, target_net, tau, every: int = 1, step: int = None):
+    """target = (1 - tau) * target + tau * net, in place over all parameters
+    with multi-tensor ops.
+
+    With every > 1 the update only runs when step % every == 0, with the tau
+    that every single updates towards an unchanged net would compound to,
+    1 - (1 - tau) ** every.
+    """
+    if every > 1:
+        if step is None:
+            raise ValueError('soft_updates needs the step when every > 1.')
+        if step % every != 0:
+            return
+        tau = 1. - (1. - tau) ** every
+    params = [p.data for p in net.parameters()]
+    target_params = [p.data for p in target_net.parameters()]
+    if len(params) != len(target_params):
+        raise ValueError('net and target_net have different parameters.')
+    if tau == 1.:
+        for param, target_param in zip(params, target_params):
+            target_param.copy_(param)
+    elif hasattr(torch, '_foreach_lerp_'):
+        torch._foreach_lerp_(target_params, params, tau)
+    else:
+        torch._foreach_mul_(target_params, 1. - tau)
+        torch._foreach_add_(target_params, params, alpha=tau)
+
+
+def create_adam(params, **kwargs):
+    """torch.optim.Adam using the multi-tensor implementation where this
+    PyTorch has one: the foreach flag (1.12 on) or optim._multi_tensor
+    (1.7 to 1.11). Either way the state_dict layout is Adam's."""
+    params = list(params)
+    try:
+        return torch.optim.Adam(params, foreach=True, **kwargs)
+    except TypeError:
+        pass
+    multi_tensor = getattr(torch.optim, '_multi_tensor', None)
+    if multi_tensor is not None and hasattr(multi_tensor, 'Adam'):
+        return multi_tensor.Adam(params, **kwargs)
+    return torch.optim.Adam(params, **kwargs)
 
 
 def stack_on_channel(x):
@@ -76,6 +122,29 @@ def point_to_pixel_index(
     return px, py
 
 
+def depth_to_point_cloud(
+        depth: torch.Tensor,
+        extrinsics: torch.Tensor,
+        intrinsics: torch.Tensor):
+    """Batched version of RLBench's pointcloud_from_depth_and_camera_params.
+
+    depth is (..., 1, H, W) in metres, extrinsics (..., 4, 4) camera to world
+    and intrinsics (..., 3, 3). Returns world coordinates as (..., 3, H, W).
+    """
+    h, w = depth.shape[-2:]
+    lead = depth.shape[:-3]
+    u = torch.arange(w, device=depth.device, dtype=torch.float32).repeat(h)
+    v = torch.arange(h, device=depth.device,
+                     dtype=torch.float32).repeat_interleave(w)
+    pixels = torch.stack([u, v, torch.ones_like(u)], 0)
+    rays = torch.matmul(torch.inverse(intrinsics.float()), pixels)
+    points = rays * depth.float().reshape(lead + (1, h * w))
+    extrinsics = extrinsics.float()
+    points = torch.matmul(extrinsics[..., :3, :3], points) + \
+        extrinsics[..., :3, 3:]
+    return points.reshape(lead + (3, h, w))
+
+
 def _compute_initial_camera_pose(scene):
     # Adapted from:
     # https://github.com/mmatl/pyrender/blob/master/pyrender/viewer.py#L1032
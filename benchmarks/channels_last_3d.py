@@ -0,0 +1,107 @@
+"""Qattention3DNet forward and forward + backward latency with the default
+channels-first weights against channels_last_3d weights. In both cases the
+input is the voxelizer's (B, D, H, W, C) output permuted to (B, C, D, H, W),
+as in QFunction.forward; only the channels_last_3d net can consume that view
+without first copying it. Also reports which block outputs keep the
+channels_last_3d format on this PyTorch build.
+
+    python benchmarks/channels_last_3d.py --batch_size 8 --voxel_size 16
+"""
+import argparse
+import time
+
+import torch
+import torch.nn as nn
+
+from arm.c2farm.networks import Qattention3DNet
+
+
+def _time(fn, iterations, device):
+    for _ in range(3):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    return (time.perf_counter() - start) / iterations * 1e3
+
+
+def _formats(net, x, proprio):
+    formats = {}
+
+    def hook(name):
+        def fn(module, ins, out):
+            if isinstance(out, torch.Tensor) and out.dim() == 5:
+                formats[name] = out.is_contiguous(
+                    memory_format=torch.channels_last_3d)
+        return fn
+
+    handles = [m.register_forward_hook(hook(n))
+               for n, m in net.named_children() if isinstance(m, nn.Module)]
+    with torch.no_grad():
+        net(x, proprio, None)
+    for h in handles:
+        h.remove()
+    return formats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--voxel_size', type=int, default=16)
+    parser.add_argument('--kernels', type=int, default=64)
+    parser.add_argument('--low_dim_size', type=int, default=10)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--device', type=str, default=(
+        'cuda' if torch.cuda.is_available() else 'cpu'))
+    args = parser.parse_args()
+    device = torch.device(args.device)
+    if device.type == 'cuda':
+        torch.backends.cudnn.benchmark = True
+
+    v = args.voxel_size
+    x = torch.randn(args.batch_size, v, v, v, 10, device=device).permute(
+        0, 4, 1, 2, 3)
+    proprio = torch.randn(args.batch_size, args.low_dim_size, device=device)
+
+    torch.manual_seed(0)
+    net = Qattention3DNet(
+        in_channels=10, out_channels=2, out_dense=72, voxel_size=v,
+        low_dim_size=args.low_dim_size, kernels=args.kernels,
+        activation='lrelu', dense_feats=128)
+    net.build()
+    net = net.to(device)
+    with torch.no_grad():
+        reference, _ = net(x, proprio, None)
+
+    print('batch %d, voxel %d on %s (ms per call)' % (
+        args.batch_size, v, device))
+    for name in ['channels_first', 'channels_last_3d']:
+        if name == 'channels_last_3d':
+            net = net.to(memory_format=torch.channels_last_3d)
+        with torch.no_grad():
+            trans, _ = net(x, proprio, None)
+            err = (trans - reference).abs().max().item()
+            fwd = _time(lambda: net(x, proprio, None), args.iterations,
+                        device)
+
+        def forward_backward():
+            trans, rot = net(x, proprio, None)
+            (trans.sum() + rot.sum()).backward()
+
+        fwd_bwd = _time(forward_backward, args.iterations, device)
+        print('%16s  forward %8.2f  forward+backward %8.2f  max abs diff '
+              '%.2e' % (name, fwd, fwd_bwd, err))
+
+    kept = _formats(net, x, proprio)
+    print('channels_last_3d kept by: %s' % ', '.join(
+        [n for n, k in kept.items() if k]))
+    print('channels_last_3d lost by: %s' % ', '.join(
+        [n for n, k in kept.items() if not k]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Memory-versus-time tradeoff of activation checkpointing in
+Qattention3DNet: forward + backward latency and peak memory for a few
+checkpoint_stages settings at each voxel size. Peak memory is only measured
+on CUDA.
+
+    python benchmarks/checkpointing.py --batch_size 64 --voxel_sizes 16 32
+"""
+import argparse
+import time
+
+import torch
+
+from arm.c2farm.networks import Qattention3DNet
+
+SETTINGS = {
+    'none': [],
+    'encoder': ['down0', 'down1', 'down2', 'down3'],
+    'decoder': ['up1', 'up2', 'up3', 'final'],
+    'all': Qattention3DNet.CHECKPOINT_STAGES,
+}
+
+
+def _measure(net, x, proprio, iterations, device):
+    def forward_backward():
+        trans, rot = net(x, proprio, None)
+        (trans.sum() + rot.sum()).backward()
+
+    forward_backward()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        forward_backward()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    elapsed = (time.perf_counter() - start) / iterations * 1e3
+    peak = torch.cuda.max_memory_allocated(device) / 2 ** 20 if (
+        device.type == 'cuda') else float('nan')
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--voxel_sizes', type=int, nargs='+', default=[16])
+    parser.add_argument('--kernels', type=int, default=64)
+    parser.add_argument('--low_dim_size', type=int, default=10)
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--device', type=str, default=(
+        'cuda' if torch.cuda.is_available() else 'cpu'))
+    args = parser.parse_args()
+    device = torch.device(args.device)
+    if device.type == 'cuda':
+        torch.backends.cudnn.benchmark = True
+
+    print('batch %d on %s (forward+backward ms, peak MiB)' % (
+        args.batch_size, device))
+    for v in args.voxel_sizes:
+        x = torch.randn(args.batch_size, 10, v, v, v, device=device)
+        proprio = torch.randn(args.batch_size, args.low_dim_size,
+                              device=device)
+        baseline = None
+        for name, stages in SETTINGS.items():
+            torch.manual_seed(0)
+            net = Qattention3DNet(
+                in_channels=10, out_channels=2, out_dense=72, voxel_size=v,
+                low_dim_size=args.low_dim_size, kernels=args.kernels,
+                activation='lrelu', dense_feats=128,
+                checkpoint_stages=stages)
+            net.build()
+            net = net.to(device)
+            elapsed, peak = _measure(net, x, proprio, args.iterations,
+                                     device)
+            if baseline is None:
+                baseline = (elapsed, peak)
+            print('voxel %3d %8s  %9.2f ms (x%.2f)  %9.1f MiB (x%.2f)' % (
+                v, name, elapsed, elapsed / baseline[0], peak,
+                peak / baseline[1]))
+            del net
+            if device.type == 'cuda':
+                torch.cuda.empty_cache()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Wall time of a QAttentionStackAgent update with its depths updated one
+after the other against concurrently (a CUDA stream per depth, or the CPU
+threads split between them), on random replay samples. Also checks that
+both give the same priorities from the same weights.
+
+    python benchmarks/concurrent_depths.py --batch_size 16 --depths 2 3
+"""
+import argparse
+import copy
+import time
+
+import torch
+
+from arm.c2farm.networks import Qattention3DNet
+from arm.c2farm.qattention_agent import QAttentionAgent
+from arm.c2farm.qattention_stack_agent import QAttentionStackAgent
+
+CAMERAS = ['front', 'left_shoulder', 'right_shoulder', 'wrist']
+LOW_DIM_SIZE = 4
+BOUNDS = [-0.3, -0.5, 0.6, 0.7, 0.5, 1.6]
+
+
+def _agents(args, depths):
+    agents = []
+    for depth in range(depths):
+        last = depth == depths - 1
+        unet3d = Qattention3DNet(
+            in_channels=10, out_channels=1 if depth == 0 else 2,
+            out_dense=216 if last else 0, voxel_size=args.voxel_size,
+            low_dim_size=LOW_DIM_SIZE, kernels=64, activation='lrelu',
+            dense_feats=128)
+        agents.append(QAttentionAgent(
+            layer=depth, coordinate_bounds=BOUNDS, unet3d=unet3d,
+            camera_names=CAMERAS, batch_size=args.batch_size,
+            voxel_size=args.voxel_size,
+            bounds_offset=0.15 if depth > 0 else None, voxel_feature_size=3,
+            image_crop_size=64, exploration_strategy='gaussian',
+            num_rotation_classes=72, rotation_resolution=5,
+            include_low_dim_state=True,
+            image_resolution=[args.resolution] * 2))
+    return agents
+
+
+def _replay_sample(args, depths, device):
+    b, r = args.batch_size, args.resolution
+    lo, hi = torch.tensor(BOUNDS[:3]), torch.tensor(BOUNDS[3:])
+    sample = {
+        'trans_action_indicies': torch.randint(
+            0, args.voxel_size, (b, 1, 3 * depths)),
+        'rot_grip_action_indicies': torch.cat([
+            torch.randint(0, 72, (b, 1, 3)), torch.randint(0, 2, (b, 1, 1))],
+            -1),
+        'reward': torch.rand(b) * 100, 'terminal': torch.zeros(b),
+        'timeout': torch.zeros(b), 'sampling_probabilities': torch.rand(b),
+        'low_dim_state': torch.randn(b, 1, LOW_DIM_SIZE),
+        'low_dim_state_tp1': torch.randn(b, 1, LOW_DIM_SIZE)}
+    for depth in range(depths):
+        for suffix in ['', '_tp1']:
+            sample['attention_coordinate_layer_%d%s' % (depth, suffix)] = (
+                lo + torch.rand(b, 1, 3) * (hi - lo))
+    for n in CAMERAS:
+        for suffix in ['', '_tp1']:
+            sample['%s_rgb%s' % (n, suffix)] = torch.rand(
+                b, 1, 3, r, r) * 2 - 1
+            sample['%s_point_cloud%s' % (n, suffix)] = (
+                lo + torch.rand(b, 1, r, r, 3) * (hi - lo)).permute(
+                0, 1, 4, 2, 3)
+            sample['%s_pixel_coord%s' % (n, suffix)] = torch.randint(
+                0, r, (b, 1, 2), dtype=torch.int32)
+    return {k: v.to(device) for k, v in sample.items()}
+
+
+def _time(fn, iterations, device):
+    fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    return (time.perf_counter() - start) / iterations * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--depths', type=int, nargs='+', default=[2, 3])
+    parser.add_argument('--voxel_size', type=int, default=16)
+    parser.add_argument('--resolution', type=int, default=128)
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--device', type=str, default=(
+        'cuda' if torch.cuda.is_available() else 'cpu'))
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    print('batch %d, %d threads on %s (ms per update)' % (
+        args.batch_size, torch.get_num_threads(), device))
+    for depths in args.depths:
+        agents = _agents(args, depths)
+        stacks = {}
+        for name, concurrent in [('sequential', False), ('concurrent', True)]:
+            stacks[name] = QAttentionStackAgent(
+                copy.deepcopy(agents), rotation_resolution=5,
+                camera_names=CAMERAS, concurrent_updates=concurrent)
+            torch.manual_seed(0)
+            stacks[name].build(training=True, device=device)
+        for qa, other in zip(stacks['sequential']._qattention_agents,
+                             stacks['concurrent']._qattention_agents):
+            other._q.load_state_dict(qa._q.state_dict())
+            other._q_target.load_state_dict(qa._q_target.state_dict())
+        sample = _replay_sample(args, depths, device)
+        priorities = [stacks[name].update(0, dict(sample))['priority']
+                      for name in stacks]
+        err = (priorities[0] - priorities[1]).abs().max().item()
+        for name, stack in stacks.items():
+            stack.set_summary_capture(False)
+            ms = _time(lambda: stack.update(0, dict(sample)),
+                       args.iterations, device)
+            print('depths %d %10s %9.2f' % (depths, name, ms))
+        print('depths %d priority max abs difference %.2e' % (depths, err))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Latency of the layer 1+ crop preprocessing: one nearest grid_sample per
+camera and modality at t and t + 1, as the Q-attention agents used to do,
+against a single CropEngine call. Also checks that both crop the same
+pixels.
+
+    python benchmarks/crop_engine.py --batch_size 128 --cameras 3
+"""
+import argparse
+import time
+
+import torch
+import torch.nn.functional as F
+
+from arm.crop_utils import CropEngine
+from arm.utils import stack_on_channel
+
+
+def _grid_sample_crop(pixel_coords, observation, crop_size):
+    grid_for_crop = torch.arange(
+        0, crop_size, device=observation.device).unsqueeze(0).repeat(
+        crop_size, 1).unsqueeze(-1)
+    grid_for_crop = torch.cat([grid_for_crop.transpose(1, 0),
+                               grid_for_crop], dim=2).unsqueeze(0)
+    observation = stack_on_channel(observation)
+    h = observation.shape[-1]
+    top_left_corner = torch.clamp(
+        pixel_coords - crop_size // 2, 0, h - crop_size)
+    grid = grid_for_crop + top_left_corner.unsqueeze(1).unsqueeze(1)
+    grid = ((grid / float(h)) * 2.0) - 1.0
+    grid = torch.cat((grid[:, :, :, 1:2], grid[:, :, :, 0:1]), dim=-1)
+    return F.grid_sample(observation, grid, mode='nearest',
+                         align_corners=True)
+
+
+def _time(fn, iterations, device):
+    for _ in range(3):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    return (time.perf_counter() - start) / iterations * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=128)
+    parser.add_argument('--cameras', type=int, default=3)
+    parser.add_argument('--resolution', type=int, default=128)
+    parser.add_argument('--crop_size', type=int, default=64)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--device', type=str, default=(
+        'cuda' if torch.cuda.is_available() else 'cpu'))
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    b, r = args.batch_size, args.resolution
+    coords, images = [], []
+    for _ in range(args.cameras * 2):
+        coords.append(torch.randint(0, r, (b, 2), device=device))
+        images.append([torch.randn(b, 1, 3, r, r, device=device),
+                       torch.randn(b, 1, 3, r, r, device=device)])
+    engine = CropEngine(args.crop_size)
+
+    def grid_sample():
+        return [[_grid_sample_crop(c, x, args.crop_size) for x in group]
+                for c, group in zip(coords, images)]
+
+    def gather():
+        return engine.crop(coords, images)
+
+    same = all(torch.equal(a, b) for ga, gb in zip(grid_sample(), gather())
+               for a, b in zip(ga, gb))
+    print('batch %d, %d cameras on %s, identical crops: %s (ms per update)' % (
+        b, args.cameras, device, same))
+    print('grid_sample %8.3f  crop engine %8.3f' % (
+        _time(grid_sample, args.iterations, device),
+        _time(gather, args.iterations, device)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Distils a Qattention3DNet teacher into the narrower student acting workers
+can use (arm.c2farm.distillation), on table-top like voxel grids, and
+reports the student's agreement with the teacher on held-out grids, the
+parameter counts and the batch 1 CPU latency of both, traced and frozen as
+the act modules are. With --weights (a QAttentionAgent_layer<n>.pt) the
+teacher has trained weights instead of the random initialisation.
+
+    python benchmarks/distillation.py --steps 2000 --student_kernels 16
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from int8_acting import _scenes, _Traceable  # noqa: E402
+
+from arm.c2farm.distillation import Distiller, greedy_actions  # noqa: E402
+from arm.c2farm.networks import Qattention3DNet  # noqa: E402
+from arm.c2farm.qfunction import QFunction  # noqa: E402
+
+
+def _time(fn, iterations):
+    for _ in range(3):
+        fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e3
+
+
+def _params(module):
+    return sum(p.numel() for p in module.parameters())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--voxel_size', type=int, default=16)
+    parser.add_argument('--low_dim_size', type=int, default=4)
+    parser.add_argument('--student_kernels', type=int, default=16)
+    parser.add_argument('--student_dense_feats', type=int, default=32)
+    parser.add_argument('--steps', type=int, default=500)
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--lr', type=float, default=0.001)
+    parser.add_argument('--eval_samples', type=int, default=64)
+    parser.add_argument('--weights', type=str, default=None)
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    device = torch.device('cpu')
+
+    net = Qattention3DNet(
+        in_channels=10, out_channels=2, out_dense=216,
+        voxel_size=args.voxel_size, low_dim_size=args.low_dim_size,
+        kernels=64, activation='lrelu', dense_feats=128)
+    teacher = QFunction(net, None, 0.15, 5, device).eval()
+    if args.weights is not None:
+        teacher.load_state_dict(torch.load(args.weights, map_location='cpu'))
+    teacher._qnet.capture_latents = False
+    distiller = Distiller(
+        net, 5, device, args.student_kernels, args.student_dense_feats,
+        lr=args.lr, agreement_window=min(100, args.steps))
+
+    start = time.perf_counter()
+    for step in range(args.steps):
+        x, proprio = _scenes(args.batch_size, args.voxel_size,
+                             args.low_dim_size)
+        with torch.no_grad():
+            q_trans, q_rot_grip = teacher._qnet(x, proprio, None)
+        summaries = distiller.update(x, proprio, q_trans, q_rot_grip)
+        if (step + 1) % max(1, args.steps // 10) == 0:
+            print('step %5d  loss %.4f  batch agreement %.2f' % (
+                step + 1, summaries['distillation/loss'],
+                summaries['distillation/agreement']))
+    print('%.1f ms per distillation step' % (
+        (time.perf_counter() - start) / max(1, args.steps) * 1e3))
+
+    student = distiller.q.eval()
+    x, proprio = _scenes(args.eval_samples, args.voxel_size,
+                         args.low_dim_size)
+    with torch.no_grad():
+        actions = [greedy_actions(q, *q._qnet(x, proprio, None))
+                   for q in [teacher, student]]
+    same = actions[0] == actions[1]
+    print('held-out agreement: voxel %.1f%%  rotation and gripper %.1f%%  '
+          'all %.1f%%  (window %.1f%%)' % (
+              100 * same[:, :3].all(1).float().mean(),
+              100 * same[:, 3:].all(1).float().mean(),
+              100 * same.all(1).float().mean(), 100 * distiller.agreement))
+
+    x1, proprio1 = x[:1], proprio[:1]
+    print('batch 1 on cpu with %d threads (ms per forward)' % args.threads)
+    with torch.no_grad():
+        for name, q in [('teacher', teacher), ('student', student)]:
+            traced = torch.jit.freeze(torch.jit.trace(
+                _Traceable(q._qnet).eval(), (x1, proprio1),
+                check_trace=False))
+            print('%-8s %9d params  eager %8.2f  traced %8.2f' % (
+                name, _params(q), _time(lambda: q._qnet(x1, proprio1, None),
+                                        args.iterations),
+                _time(lambda: traced(x1, proprio1), args.iterations)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Forward and forward + backward latency of an ensemble of critics called
+one after the other against EnsembleForward's single batched pass. The
+critic is the TD3 baseline's CNNAndFcsNet on two 128x128 camera inputs.
+The fused pass is forced on CPU too, where it is not used by default.
+
+    python benchmarks/fused_critics.py --batch_size 128 --ensemble_sizes 2 4
+"""
+import argparse
+import time
+
+import torch
+
+from arm.network_utils import CNNAndFcsNet, EnsembleForward, SiameseNet
+
+
+def _time(fn, iterations, device):
+    for _ in range(3):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    return (time.perf_counter() - start) / iterations * 1e3
+
+
+def _critic(norm):
+    siamese = SiameseNet([3, 3], [16], [5], [1], norm=norm,
+                         activation='lrelu')
+    critic = CNNAndFcsNet(
+        siamese, 18, [128, 128], [32, 32, 32], [5, 3, 3], [2, 2, 2],
+        norm=norm, fc_layers=[256, 256, 1], activation='lrelu')
+    critic.build()
+    return critic
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=128)
+    parser.add_argument('--resolution', type=int, default=128)
+    parser.add_argument('--ensemble_sizes', type=int, nargs='+',
+                        default=[2])
+    parser.add_argument('--norm', type=str, default=None)
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--device', type=str, default=(
+        'cuda' if torch.cuda.is_available() else 'cpu'))
+    args = parser.parse_args()
+    device = torch.device(args.device)
+    if device.type == 'cuda':
+        torch.backends.cudnn.benchmark = True
+
+    r = args.resolution
+    obs = [torch.randn(args.batch_size, 3, r, r, device=device),
+           torch.randn(args.batch_size, 3, r, r, device=device)]
+    low_dim = torch.randn(args.batch_size, 18, device=device)
+
+    print('batch %d on %s (ms per call)' % (args.batch_size, device))
+    for n in args.ensemble_sizes:
+        members = [_critic(args.norm).to(device) for _ in range(n)]
+        fused = EnsembleForward(members, cpu=True)
+        if not fused.fused:
+            print('%d critics cannot be fused' % n)
+            continue
+        with torch.no_grad():
+            err = max((a - b).abs().max().item() for a, b in zip(
+                fused(obs, low_dim), [m(obs, low_dim) for m in members]))
+        for name, fn in [('sequential', lambda: [
+                m(obs, low_dim) for m in members]),
+                         ('fused', lambda: fused(obs, low_dim))]:
+            with torch.no_grad():
+                fwd = _time(fn, args.iterations, device)
+            fwd_bwd = _time(lambda: sum(q.sum() for q in fn()).backward(),
+                            args.iterations, device)
+            print('N=%d %10s  forward %8.2f  forward+backward %8.2f' % (
+                n, name, fwd, fwd_bwd))
+        print('N=%d max abs difference %.2e' % (n, err))
+
+
+if __name__ == '__main__':
+    main()
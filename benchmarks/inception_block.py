@@ -0,0 +1,105 @@
+"""Per-block latency of Conv3DInceptionBlock (forward and forward + backward)
+against the unfused layout it replaced, which ran the three 1x1 branches as
+separate convs and joined the branches with torch.cat.
+
+    python benchmarks/inception_block.py --batch_size 8 --voxel_sizes 16 32 64
+"""
+import argparse
+import time
+
+import torch
+import torch.nn as nn
+
+from arm.network_utils import Conv3DBlock, Conv3DInceptionBlock
+
+
+class UnfusedConv3DInceptionBlock(nn.Module):
+
+    def __init__(self, in_channels, out_channels, norm=None, activation=None):
+        super(UnfusedConv3DInceptionBlock, self).__init__()
+        cs = out_channels // 4
+        latent = 32
+        self._1x1conv = Conv3DBlock(
+            in_channels, cs * 2, kernel_sizes=1, strides=1, norm=norm,
+            activation=activation)
+        self._1x1conv_a = Conv3DBlock(
+            in_channels, latent, kernel_sizes=1, strides=1, norm=norm,
+            activation=activation)
+        self._3x3conv = Conv3DBlock(
+            latent, cs, kernel_sizes=3, strides=1,
+            norm=norm, activation=activation)
+        self._1x1conv_b = Conv3DBlock(
+            in_channels, latent, kernel_sizes=1, strides=1, norm=norm,
+            activation=activation)
+        self._5x5_via_3x3conv_a = Conv3DBlock(
+            latent, latent, kernel_sizes=3, strides=1, norm=norm,
+            activation=activation)
+        self._5x5_via_3x3conv_b = Conv3DBlock(
+            latent, cs, kernel_sizes=3, strides=1, norm=norm,
+            activation=activation)
+
+    def forward(self, x):
+        return torch.cat([self._1x1conv(x),
+                          self._3x3conv(self._1x1conv_a(x)),
+                          self._5x5_via_3x3conv_b(self._5x5_via_3x3conv_a(
+                              self._1x1conv_b(x)))], 1)
+
+
+def _time(fn, iterations, device):
+    for _ in range(3):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    return (time.perf_counter() - start) / iterations * 1e3
+
+
+def _forward_backward(block, x):
+    block(x).sum().backward()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--in_channels', type=int, default=64)
+    parser.add_argument('--kernels', type=int, default=64)
+    parser.add_argument('--voxel_sizes', type=int, nargs='+',
+                        default=[16, 32, 64])
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--device', type=str, default=(
+        'cuda' if torch.cuda.is_available() else 'cpu'))
+    args = parser.parse_args()
+    device = torch.device(args.device)
+    if device.type == 'cuda':
+        torch.backends.cudnn.benchmark = True
+
+    unfused = UnfusedConv3DInceptionBlock(
+        args.in_channels, args.kernels, activation='lrelu').to(device)
+    fused = Conv3DInceptionBlock(
+        args.in_channels, args.kernels, activation='lrelu').to(device)
+    # Also checks that unfused checkpoints load into the fused block.
+    fused.load_state_dict(unfused.state_dict())
+
+    print('batch %d, %d -> %d channels on %s (ms per call)' % (
+        args.batch_size, args.in_channels, args.kernels, device))
+    for v in args.voxel_sizes:
+        x = torch.randn(args.batch_size, args.in_channels, v, v, v,
+                        device=device)
+        with torch.no_grad():
+            err = (fused(x) - unfused(x)).abs().max().item()
+        for name, block in [('unfused', unfused), ('fused', fused)]:
+            with torch.no_grad():
+                fwd = _time(lambda: block(x), args.iterations, device)
+            fwd_bwd = _time(lambda: _forward_backward(block, x),
+                            args.iterations, device)
+            print('voxel %3d %8s  forward %8.2f  forward+backward %8.2f' % (
+                v, name, fwd, fwd_bwd))
+        print('voxel %3d max abs difference %.2e' % (v, err))
+
+
+if __name__ == '__main__':
+    main()
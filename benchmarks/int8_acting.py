@@ -0,0 +1,111 @@
+"""Batch 1 CPU latency of Qattention3DNet in fp32 against the int8 version
+arm.quantization makes, both traced and frozen as the act modules are, and
+how often the two pick the same voxel and rotation / gripper indices.
+Calibration and evaluation use separate table-top like voxel grids. With
+--weights (a QAttentionAgent_layer<n>.pt) trained weights are used instead
+of the random initialisation, which agrees far less often.
+
+    python benchmarks/int8_acting.py --threads 1 --voxel_size 16
+"""
+import argparse
+import time
+
+import torch
+
+from arm import quantization
+from arm.c2farm.networks import Qattention3DNet
+from arm.c2farm.qfunction import QFunction
+
+
+class _Traceable(torch.nn.Module):
+
+    def __init__(self, net):
+        super(_Traceable, self).__init__()
+        self._net = net
+
+    def forward(self, x, proprio):
+        return self._net(x, proprio, None)
+
+
+def _scenes(batch_size, v, low_dim_size):
+    x = torch.zeros(batch_size, 10, v, v, v)
+    occupancy = torch.zeros(batch_size, v, v, v, dtype=torch.bool)
+    occupancy[:, v // 4] = True
+    for b in range(batch_size):
+        lo = torch.randint(0, v - v // 4, (3,))
+        lo[0] = v // 4 + 1
+        occupancy[b, lo[0]:lo[0] + v // 4, lo[1]:lo[1] + v // 4,
+                  lo[2]:lo[2] + v // 4] = True
+    # rgb in [-1, 1], a point in the voxel, its index and occupancy.
+    x[:, 3:6] = torch.rand(batch_size, 3, v, v, v) * 2 - 1
+    x[:, :3] = torch.rand(batch_size, 3, v, v, v)
+    index = torch.stack(torch.meshgrid(*[torch.arange(v)] * 3), 0) / v
+    x[:, 6:9] = index.float()
+    x[:, 9] = occupancy.float()
+    x[:, :6] *= occupancy.unsqueeze(1).float()
+    return x, torch.randn(batch_size, low_dim_size)
+
+
+def _time(fn, iterations):
+    for _ in range(3):
+        fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--voxel_size', type=int, default=16)
+    parser.add_argument('--low_dim_size', type=int, default=4)
+    parser.add_argument('--calibration_samples', type=int, default=64)
+    parser.add_argument('--eval_samples', type=int, default=64)
+    parser.add_argument('--weights', type=str, default=None)
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+
+    net = Qattention3DNet(
+        in_channels=10, out_channels=2, out_dense=216,
+        voxel_size=args.voxel_size, low_dim_size=args.low_dim_size,
+        kernels=64, activation='lrelu', dense_feats=128)
+    q = QFunction(net, None, 0.15, 5, torch.device('cpu')).eval()
+    if args.weights is not None:
+        q.load_state_dict(torch.load(args.weights, map_location='cpu'))
+    q._qnet.capture_latents = False
+
+    observed = quantization.prepare_int8(q._qnet)
+    with torch.no_grad():
+        observed(*_scenes(args.calibration_samples, args.voxel_size,
+                          args.low_dim_size), None)
+    q_int8 = QFunction(net, None, 0.15, 5, torch.device('cpu')).eval()
+    q_int8._qnet = quantization.convert_int8(observed)
+
+    x, proprio = _scenes(args.eval_samples, args.voxel_size,
+                         args.low_dim_size)
+    with torch.no_grad():
+        actions = [torch.cat(qf.choose_highest_action(
+            *qf._qnet(x, proprio, None)), 1) for qf in [q, q_int8]]
+        x1, proprio1 = x[:1], proprio[:1]
+        print('batch 1 on cpu with %d threads (ms per forward)' % (
+            args.threads))
+        for name, qf in [('fp32', q), ('int8', q_int8)]:
+            traced = torch.jit.freeze(torch.jit.trace(
+                _Traceable(qf._qnet).eval(), (x1, proprio1),
+                check_trace=False))
+            print('%s  eager %8.2f  traced %8.2f' % (
+                name, _time(lambda: qf._qnet(x1, proprio1, None),
+                            args.iterations),
+                _time(lambda: traced(x1, proprio1), args.iterations)))
+    same = actions[0] == actions[1]
+    print('agreement: voxel %.1f%%  rotation and gripper %.1f%%  all %.1f%%'
+          % (100 * same[:, :3].all(1).float().mean(),
+             100 * same[:, 3:].all(1).float().mean(),
+             100 * same.all(1).float().mean()))
+
+
+if __name__ == '__main__':
+    main()
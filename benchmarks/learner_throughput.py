@@ -0,0 +1,186 @@
+"""Offline learner throughput of the C2F-ARM agent, without a simulator.
+
+The replays and agent are created as launch.py creates them, from the config
+and method yaml with hydra style overrides, for the stand-in environment of
+extar.envs.synthetic_env, so the replays hold random transitions of the same
+observations instead of demos. --iterations updates are then timed through
+MultiTaskPyTorchTrainer's _sampler, _step and _priority_update, each split
+into replay sampling, the copy to the device, the agent update and the
+priority update. --json writes the timings, the config and the commit to a
+file for comparing runs. It has not yet been run end to end against YARR, so
+check the first run's stage split before relying on it.
+
+    python benchmarks/learner_throughput.py --iterations 200 \\
+        --json c2farm.json replay.batch_size=64 method.voxel_sizes=[16,16]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+from omegaconf import OmegaConf
+from yarr.replay_buffer.wrappers.pytorch_replay_buffer import \
+    PyTorchReplayBuffer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+import launch  # noqa: E402
+from extar.runners.multi_task_trainer import \
+    MultiTaskPyTorchTrainer  # noqa: E402
+from extar.utils.replay_sampler import DeferredPriorityUpdate  # noqa: E402
+from extar.envs.synthetic_env import SyntheticRLBenchEnv  # noqa: E402
+
+STAGES = ['sample', 'to_device', 'update', 'priority']
+
+
+class _TimedPriorityUpdate(DeferredPriorityUpdate):
+
+    def __init__(self, sampler):
+        super(_TimedPriorityUpdate, self).__init__(sampler)
+        self.seconds = 0.
+
+    def push(self, indices, priorities):
+        start = time.perf_counter()
+        super(_TimedPriorityUpdate, self).push(indices, priorities)
+        self.seconds += time.perf_counter() - start
+
+
+def _load(args):
+    cfg = OmegaConf.load(args.config)
+    cfg.method = OmegaConf.load(args.method)
+    return OmegaConf.merge(cfg, OmegaConf.from_dotlist(args.overrides))
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _sync(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def _trainer(args, cfg, device):
+    env = SyntheticRLBenchEnv(
+        cfg.rlbench.cameras, cfg.rlbench.camera_resolution,
+        cfg.rlbench.episode_length, cfg.rlbench.scene_bounds,
+        args.low_dim_state_len,
+        compact_depth=cfg.rlbench.get('compact_depth', False))
+    replays = {}
+    for task in range(args.tasks):
+        task_replays, _ = launch.create_replays(cfg, env, cfg.rlbench.cameras)
+        actions = launch.fill_synthetic_replays(
+            cfg, task_replays, args.transitions)
+        # The multi-task trainer samples one replay per task.
+        replays['task%d' % task] = PyTorchReplayBuffer(task_replays[0])
+    action_min_max = launch._modify_action_min_max(
+        (actions.min(0), actions.max(0)))
+    agent = launch.create_agent(cfg, env, cfg.rlbench.cameras, action_min_max)
+    agent.build(training=True, device=device)
+
+    trainer = MultiTaskPyTorchTrainer(
+        agent, SimpleNamespace(), replays, device, device_list=[0],
+        replay_buffer_sample_rates=[1.0], logdir=None, weightsdir=None)
+    update_keys, _ = trainer._create_sampler()
+    trainer._priority_update = _TimedPriorityUpdate(trainer._sampler)
+    agent.set_summary_capture(False)
+    return trainer, update_keys
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('overrides', nargs='*')
+    parser.add_argument('--config', type=str, default='conf/config.yaml')
+    parser.add_argument('--method', type=str,
+                        default='conf/method/C2FARM.yaml')
+    parser.add_argument('--low_dim_state_len', type=int, default=4)
+    parser.add_argument('--tasks', type=int, default=1)
+    parser.add_argument('--transitions', type=int, default=1000)
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--device', type=str, default=(
+        'cuda' if torch.cuda.is_available() else 'cpu'))
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--json', type=str, default=None)
+    args = parser.parse_args()
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    cfg = _load(args)
+    device = torch.device(args.device)
+
+    start = time.perf_counter()
+    trainer, update_keys = _trainer(args, cfg, device)
+    print('%s with %d task(s) of %d synthetic transitions, batch %d on %s '
+          '(setup %.1f s)' % (
+              cfg.method.name, args.tasks, args.transitions,
+              trainer._sampler.batch_size, device,
+              time.perf_counter() - start))
+
+    times = {s: [] for s in STAGES}
+    for i in range(args.warmup + args.iterations):
+        _sync(device)
+        t0 = time.perf_counter()
+        sampled_batch = trainer._sampler.sample()
+        t1 = time.perf_counter()
+        batch = {k: v.to(device) for k, v in sampled_batch.items()
+                 if k in update_keys}
+        _sync(device)
+        t2 = time.perf_counter()
+        priority = trainer._priority_update.seconds
+        trainer._step(i, batch, sampled_batch['indices'].numpy())
+        _sync(device)
+        t3 = time.perf_counter()
+        priority = trainer._priority_update.seconds - priority
+        if i >= args.warmup:
+            times['sample'].append(t1 - t0)
+            times['to_device'].append(t2 - t1)
+            times['update'].append(t3 - t2 - priority)
+            times['priority'].append(priority)
+    trainer._priority_update.flush()
+
+    total = np.sum([times[s] for s in STAGES], 0)
+    print('stage        mean ms    p50 ms    p95 ms   share')
+    stages = {}
+    for s in STAGES:
+        ms = np.array(times[s]) * 1e3
+        stages[s] = {'mean_ms': ms.mean(), 'p50_ms': np.percentile(ms, 50),
+                     'p95_ms': np.percentile(ms, 95),
+                     'share': ms.sum() / (total.sum() * 1e3)}
+        print('%-10s %9.2f %9.2f %9.2f %6.1f%%' % (
+            s, stages[s]['mean_ms'], stages[s]['p50_ms'],
+            stages[s]['p95_ms'], 100 * stages[s]['share']))
+    updates_per_second = 1. / total.mean()
+    print('%.2f updates/s, %.0f samples/s' % (
+        updates_per_second,
+        updates_per_second * trainer._sampler.batch_size))
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'method': cfg.method.name,
+                'config': OmegaConf.to_container(cfg),
+                'overrides': args.overrides,
+                'commit': _commit(),
+                'device': str(device),
+                'torch': torch.__version__,
+                'tasks': args.tasks,
+                'batch_size': trainer._sampler.batch_size,
+                'iterations': args.iterations,
+                'updates_per_second': updates_per_second,
+                'stages': stages,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
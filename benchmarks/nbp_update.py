@@ -0,0 +1,101 @@
+"""Latency of a NextBestPoseAgent update on the ARM networks, and of the
+work that is now shared within one: the crops, which the actor update used
+to take again, and the shared-network pass its Q evaluation used to repeat.
+The Q-attention agent is replaced by a stand-in so that only the next best
+pose update is timed.
+
+    python benchmarks/nbp_update.py --batch_size 128 --crop_augmentation
+"""
+import argparse
+import time
+
+import torch
+
+from arm.arm.launch_utils import SharedNet, CriticNet, ActorNet
+from arm.arm.next_best_pose_agent import NextBestPoseAgent
+
+LOW_DIM_SIZE = 4
+
+
+class _StandInQAttentionAgent(object):
+
+    def __init__(self, batch_size):
+        self._batch_size = batch_size
+
+    def build(self, training, device):
+        self._priority = torch.ones(self._batch_size, device=device)
+
+    def update(self, step, replay_sample):
+        return {'priority': self._priority}
+
+    def update_keys(self):
+        return []
+
+
+def _replay_sample(args, device):
+    b, r = args.batch_size, args.resolution
+    sample = {'action': torch.randn(b, 8), 'reward': torch.randn(b),
+              'terminal': torch.zeros(b), 'timeout': torch.zeros(b),
+              'demo': torch.ones(b),
+              'sampling_probabilities': torch.rand(b) + 0.5,
+              'low_dim_state': torch.randn(b, 1, LOW_DIM_SIZE),
+              'low_dim_state_tp1': torch.randn(b, 1, LOW_DIM_SIZE)}
+    for k in ['rgb', 'rgb_tp1', 'point_cloud', 'point_cloud_tp1']:
+        sample['front_%s' % k] = torch.randn(b, 1, 3, r, r)
+    for k in ['pixel_coord', 'pixel_coord_tp1']:
+        sample['front_%s' % k] = torch.randint(
+            0, r, (b, 1, 2), dtype=torch.int32)
+    return {k: v.to(device) for k, v in sample.items()}
+
+
+def _time(fn, iterations, device):
+    for _ in range(2):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    return (time.perf_counter() - start) / iterations * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=128)
+    parser.add_argument('--resolution', type=int, default=128)
+    parser.add_argument('--crop_size', type=int, default=16)
+    parser.add_argument('--crop_augmentation', action='store_true')
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--device', type=str, default=(
+        'cuda' if torch.cuda.is_available() else 'cpu'))
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    agent = NextBestPoseAgent(
+        qattention_agent=_StandInQAttentionAgent(args.batch_size),
+        shared_network=SharedNet('lrelu', norm='layer'),
+        critic_network=CriticNet('lrelu', LOW_DIM_SIZE + 8, norm='layer'),
+        actor_network=ActorNet('lrelu', LOW_DIM_SIZE),
+        action_min_max=([-1.] * 8, [1.] * 8), camera_name='front',
+        crop_shape=(args.crop_size, args.crop_size))
+    agent.build(training=True, device=device)
+    agent._crop_augmentation = args.crop_augmentation
+    sample = _replay_sample(args, device)
+
+    update = _time(lambda: agent.update(0, sample), args.iterations, device)
+    with torch.no_grad():
+        observations, _ = agent._crop_update_inputs(sample)
+        crops = _time(lambda: agent._crop_update_inputs(sample),
+                      args.iterations, device)
+        shared = _time(lambda: agent._q.shared(observations),
+                       args.iterations, device)
+    print('batch %d on %s (ms)' % (args.batch_size, device))
+    print('update %8.2f  no longer repeated: crops %6.2f  shared pass %6.2f'
+          ' (%.1f%% of the update)' % (
+              update, crops, shared, 100 * (crops + shared) / update))
+
+
+if __name__ == '__main__':
+    main()
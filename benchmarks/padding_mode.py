@@ -0,0 +1,87 @@
+"""Qattention3DNet forward and forward + backward latency and peak memory
+with replicate padding, where every 3x3x3 conv first makes a padded copy of
+its input, against implicit zero padding. The zero-padded net reuses the
+replicate weights via convert_padding_mode, so the printed difference is
+what a converted checkpoint has to recover by fine-tuning.
+
+    python benchmarks/padding_mode.py --batch_size 8 --voxel_size 16
+"""
+import argparse
+import time
+
+import torch
+
+from arm.c2farm.networks import Qattention3DNet
+from arm.network_utils import convert_padding_mode
+
+
+def _time(fn, iterations, device):
+    for _ in range(3):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    peak = torch.cuda.max_memory_allocated(device) / 2 ** 20 if (
+        device.type == 'cuda') else float('nan')
+    return (time.perf_counter() - start) / iterations * 1e3, peak
+
+
+def _build(args, device, padding_mode):
+    torch.manual_seed(0)
+    net = Qattention3DNet(
+        in_channels=10, out_channels=2, out_dense=72,
+        voxel_size=args.voxel_size, low_dim_size=args.low_dim_size,
+        kernels=args.kernels, activation='lrelu', dense_feats=128)
+    net.build()
+    convert_padding_mode(net, padding_mode)
+    return net.to(device)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--voxel_size', type=int, default=16)
+    parser.add_argument('--kernels', type=int, default=64)
+    parser.add_argument('--low_dim_size', type=int, default=10)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--device', type=str, default=(
+        'cuda' if torch.cuda.is_available() else 'cpu'))
+    args = parser.parse_args()
+    device = torch.device(args.device)
+    if device.type == 'cuda':
+        torch.backends.cudnn.benchmark = True
+
+    v = args.voxel_size
+    x = torch.randn(args.batch_size, 10, v, v, v, device=device)
+    proprio = torch.randn(args.batch_size, args.low_dim_size, device=device)
+
+    print('batch %d, voxel %d on %s (ms per call, peak MiB)' % (
+        args.batch_size, v, device))
+    reference = None
+    for mode in ['replicate', 'zeros']:
+        net = _build(args, device, mode)
+        with torch.no_grad():
+            trans, _ = net(x, proprio, None)
+            if reference is None:
+                reference = trans
+            err = (trans - reference).abs().max().item()
+            fwd, fwd_mem = _time(lambda: net(x, proprio, None),
+                                 args.iterations, device)
+
+        def forward_backward():
+            trans, rot = net(x, proprio, None)
+            (trans.sum() + rot.sum()).backward()
+
+        fwd_bwd, fwd_bwd_mem = _time(forward_backward, args.iterations, device)
+        print('%10s  forward %8.2f (%7.1f)  forward+backward %8.2f (%7.1f)'
+              '  max abs diff %.2e' % (mode, fwd, fwd_mem, fwd_bwd,
+                                       fwd_bwd_mem, err))
+
+
+if __name__ == '__main__':
+    main()
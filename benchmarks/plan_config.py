@@ -0,0 +1,88 @@
+"""What a C2F-ARM configuration costs, without an environment: parameters,
+FLOPs, activation memory and forward / backward / voxelisation latency per
+depth on the local device (arm.c2farm.cost_model), the replay bytes per
+transition and capacity, and the largest batch size whose estimated learner
+memory fits --memory_gb. Overrides use hydra's dotted syntax.
+
+    python benchmarks/plan_config.py --memory_gb 11 \\
+        method.voxel_sizes=[16,16] method.kernels=32 rlbench.cameras=[front]
+"""
+import argparse
+
+import torch
+from omegaconf import OmegaConf
+
+from arm.c2farm import cost_model
+
+GiB = float(1 << 30)
+MiB = float(1 << 20)
+
+
+def _load(args):
+    cfg = OmegaConf.load(args.config)
+    cfg.method = OmegaConf.load(args.method)
+    return OmegaConf.merge(cfg, OmegaConf.from_dotlist(args.overrides))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('overrides', nargs='*')
+    parser.add_argument('--config', type=str, default='conf/config.yaml')
+    parser.add_argument('--method', type=str,
+                        default='conf/method/C2FARM.yaml')
+    parser.add_argument('--low_dim_size', type=int, default=4)
+    parser.add_argument('--batch_size', type=int, default=None)
+    parser.add_argument('--memory_gb', type=float, default=None)
+    # Left for the CUDA context, allocator fragmentation and the like.
+    parser.add_argument('--reserved_gb', type=float, default=1.0)
+    parser.add_argument('--replay_size', type=int, default=None)
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--iterations', type=int, default=3)
+    args = parser.parse_args()
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    cfg = _load(args)
+    device = torch.device(args.device)
+
+    batch_size = args.batch_size or cfg.replay.batch_size
+    profile = cost_model.profile_config(
+        cfg, args.low_dim_size, device, batch_size, args.iterations)
+    print('voxel sizes %s, kernels %d, cameras %s at %s, batch %d on %s' % (
+        list(cfg.method.voxel_sizes), cfg.method.get('kernels', 64),
+        list(cfg.rlbench.cameras), list(cfg.rlbench.camera_resolution),
+        batch_size, device))
+    print('depth    params  GFLOPs/sample  act MiB/sample  forward ms  '
+          'backward ms  voxelise ms')
+    for depth, d in enumerate(profile['depths']):
+        print('%5d %9d %14.3f %15.2f %11.1f %12.1f %12.1f' % (
+            depth, d['params'], d['flops'] / 1e9,
+            d['activation_bytes'] / MiB, d['forward_ms'], d['backward_ms'],
+            d['voxelise_ms']))
+        if 'peak_cuda_bytes' in d:
+            print('      measured peak CUDA memory %.2f GiB' % (
+                d['peak_cuda_bytes'] / GiB))
+
+    per_transition = profile['replay_bytes_per_transition']
+    replay_size = args.replay_size or cfg.replay.get('replay_size', 100000)
+    print('replay %.1f KiB per transition, %.2f GiB for %d transitions' % (
+        per_transition / 1024., per_transition * replay_size / GiB,
+        replay_size))
+    for name, size in sorted(profile['replay_bytes'].items(),
+                             key=lambda kv: -kv[1])[:4]:
+        print('    %-28s %10d bytes' % (name, size))
+
+    memory = cost_model.learner_memory(profile, batch_size)
+    print('learner memory at batch %d: %.2f GiB (fixed %.2f, batch %.2f, '
+          'activations %.2f)' % (
+              batch_size, memory['total'] / GiB, memory['fixed'] / GiB,
+              memory['batch'] / GiB, memory['activations'] / GiB))
+    if args.memory_gb is not None:
+        budget = (args.memory_gb - args.reserved_gb) * GiB
+        largest = cost_model.max_batch_size(profile, budget)
+        print('largest batch size for %.1f GiB (%.1f reserved): %d' % (
+            args.memory_gb, args.reserved_gb, largest))
+
+
+if __name__ == '__main__':
+    main()
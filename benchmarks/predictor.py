@@ -0,0 +1,71 @@
+"""Cold start, memory and batched latency of the stand-alone Predictor on a
+policy saved with arm.c2farm.predictor.export_policy, on random
+observations from cameras looking down at the scene.
+
+    python benchmarks/predictor.py --policy policy.pt --batch_sizes 1 8
+"""
+import argparse
+import resource
+import time
+
+start = time.perf_counter()
+import numpy as np
+import torch
+
+from arm.c2farm.predictor import Predictor
+import_s = time.perf_counter() - start
+
+
+def _observations(predictor, batch_size, resolution):
+    r = resolution
+    extrinsics = np.eye(4)
+    extrinsics[:3, :3] = np.diag([1., -1., -1.])
+    extrinsics[:3, 3] = [0.2, 0., 2.5]
+    intrinsics = np.array([[-r / 2., 0., r / 2.], [0., -r / 2., r / 2.],
+                           [0., 0., 1.]])
+    obs = {'low_dim_state': np.random.randn(
+        batch_size, predictor._layers[0]['hparams']['low_dim_size'])}
+    for n in predictor.camera_names:
+        obs['%s_rgb' % n] = np.random.randint(
+            0, 256, (batch_size, 3, r, r), dtype=np.uint8)
+        obs['%s_point_cloud' % n] = np.random.uniform(
+            [-0.3, -0.5, 0.6], [0.7, 0.5, 1.6], (batch_size, r, r, 3)
+        ).transpose(0, 3, 1, 2).astype(np.float32)
+        obs['%s_camera_extrinsics' % n] = np.tile(
+            extrinsics, (batch_size, 1, 1))
+        obs['%s_camera_intrinsics' % n] = np.tile(
+            intrinsics, (batch_size, 1, 1))
+    return obs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--policy', type=str, required=True)
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--resolution', type=int, default=128)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--device', type=str, default='cpu')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    predictor = Predictor(args.policy, args.device, args.threads)
+    load_s = time.perf_counter() - start
+    print('imports %.2fs, load %.2fs, %d threads' % (
+        import_s, load_s, torch.get_num_threads()))
+    for b in args.batch_sizes:
+        obs = _observations(predictor, b, args.resolution)
+        predictor.predict(obs)
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            predictor.predict(obs)
+        ms = (time.perf_counter() - start) / args.iterations * 1e3
+        print('batch %3d  %9.2f ms per call  %8.2f ms per observation' % (
+            b, ms, ms / b))
+    # ru_maxrss is in KiB on Linux.
+    print('peak RSS %.0f MiB' % (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Forward and forward + backward latency of SparseQattention3DNet against
+the dense Qattention3DNet on table-top like voxel grids: a table surface and
+a few box surfaces, so that only a thin shell of voxels is occupied. Also
+checks the sparse convs against nn.functional.conv3d on the same grid.
+
+    python benchmarks/sparse_encoder.py --batch_size 2 --voxel_sizes 16 32 64
+"""
+import argparse
+import time
+
+import torch
+import torch.nn.functional as F
+
+from arm.c2farm.networks import Qattention3DNet, SparseQattention3DNet
+from arm.c2farm.sparse_conv import SparseVoxels, SubMConv3d, \
+    SparseDownsample3d
+
+
+def _scene(batch_size, v, boxes, device):
+    occupancy = torch.zeros(batch_size, v, v, v, dtype=torch.bool)
+    table = v // 4
+    occupancy[:, table] = True
+    for b in range(batch_size):
+        for _ in range(boxes):
+            size = torch.randint(2, max(v // 4, 3), (3,))
+            lo = torch.randint(0, v - int(size.max()), (3,))
+            lo[0] = table + 1
+            hi = torch.min(lo + size, torch.tensor(v))
+            box = occupancy[b, lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]]
+            box[[0, -1]] = True
+            box[:, [0, -1]] = True
+            box[:, :, [0, -1]] = True
+    x = torch.randn(batch_size, 10, v, v, v)
+    x[:, -1] = occupancy.float()
+    x[:, :-1] *= occupancy.unsqueeze(1).float()
+    return x.to(device)
+
+
+def _time(fn, iterations, device):
+    fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    return (time.perf_counter() - start) / iterations * 1e3
+
+
+def _check_convs(x):
+    mask = x[:, -1] > 0
+    sv = SparseVoxels.from_dense(x, mask)
+    subm = SubMConv3d(x.shape[1], 8).to(x.device)
+    down = SparseDownsample3d(x.shape[1], 8).to(x.device)
+    with torch.no_grad():
+        ref = F.conv3d(x, subm.weight, subm.bias, padding=1)
+        err = (subm(sv).feats - ref.permute(0, 2, 3, 4, 1)[mask]).abs().max()
+        coarse_mask = F.max_pool3d(mask.unsqueeze(1).float(), 2)[:, 0] > 0
+        ref = F.conv3d(x, down.weight, down.bias, stride=2)
+        err = max(err, (down(sv).feats - ref.permute(
+            0, 2, 3, 4, 1)[coarse_mask]).abs().max())
+    return err.item()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=2)
+    parser.add_argument('--voxel_sizes', type=int, nargs='+',
+                        default=[16, 32, 64])
+    parser.add_argument('--boxes', type=int, default=4)
+    parser.add_argument('--kernels', type=int, default=64)
+    parser.add_argument('--low_dim_size', type=int, default=10)
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--device', type=str, default=(
+        'cuda' if torch.cuda.is_available() else 'cpu'))
+    args = parser.parse_args()
+    device = torch.device(args.device)
+    torch.manual_seed(0)
+
+    print('batch %d on %s (ms per call)' % (args.batch_size, device))
+    for v in args.voxel_sizes:
+        x = _scene(args.batch_size, v, args.boxes, device)
+        proprio = torch.randn(args.batch_size, args.low_dim_size,
+                              device=device)
+        print('voxel %3d: %.2f%% occupied, sparse conv max abs diff %.2e' % (
+            v, 100 * x[:, -1].mean().item(), _check_convs(x)))
+        for net_class in [Qattention3DNet, SparseQattention3DNet]:
+            net = net_class(
+                in_channels=10, out_channels=2, out_dense=72, voxel_size=v,
+                low_dim_size=args.low_dim_size, kernels=args.kernels,
+                activation='lrelu', dense_feats=128)
+            net.build()
+            net = net.to(device)
+
+            def forward_backward():
+                trans, rot = net(x, proprio, None)
+                (trans.sum() + rot.sum()).backward()
+
+            try:
+                with torch.no_grad():
+                    fwd = _time(lambda: net(x, proprio, None),
+                                args.iterations, device)
+                fwd_bwd = _time(forward_backward, args.iterations, device)
+            except RuntimeError as e:
+                print('%24s  failed: %s' % (net_class.__name__,
+                                            str(e).split('\n')[0]))
+                continue
+            print('%24s  forward %9.2f  forward+backward %9.2f' % (
+                net_class.__name__, fwd, fwd_bwd))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Microbenchmark of batched sum-tree priority updates and stratified
+sampling: YARR's SumTree against arm.prioritized_replay_buffer.SumTree.
+
+    python benchmarks/sum_tree.py --capacity 100000 --batch_size 128
+"""
+import argparse
+import time
+
+import numpy as np
+from yarr.replay_buffer.sum_tree import SumTree as YarrSumTree
+
+from arm.prioritized_replay_buffer import SumTree
+
+
+def _yarr_update(tree, indices, priorities):
+    for i, p in zip(indices, priorities):
+        tree.set(i, p)
+
+
+def _time(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--capacity', type=int, default=int(1e5))
+    parser.add_argument('--batch_size', type=int, default=128)
+    parser.add_argument('--iterations', type=int, default=1000)
+    args = parser.parse_args()
+
+    trees = {'yarr': YarrSumTree(args.capacity),
+             'vectorized': SumTree(args.capacity)}
+    init = np.random.random(args.capacity)
+    _yarr_update(trees['yarr'], range(args.capacity), init)
+    trees['vectorized'].update(np.arange(args.capacity), init)
+
+    indices = np.random.randint(0, args.capacity, args.batch_size)
+    priorities = np.random.random(args.batch_size)
+    updates = {
+        'yarr': lambda: _yarr_update(trees['yarr'], indices, priorities),
+        'vectorized': lambda: trees['vectorized'].update(indices, priorities),
+    }
+    print('capacity %d, batch size %d (us per call)' % (
+        args.capacity, args.batch_size))
+    for name, tree in trees.items():
+        update_us = _time(updates[name], args.iterations)
+        sample_us = _time(lambda: tree.stratified_sample(args.batch_size),
+                          args.iterations)
+        print('%12s  update %10.1f  stratified_sample %10.1f' % (
+            name, update_us, sample_us))
+
+
+if __name__ == '__main__':
+    main()
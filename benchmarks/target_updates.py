@@ -0,0 +1,92 @@
+"""Per-step overhead of the target network soft update and the Adam step
+on a C2F-ARM Q-network: the per-parameter Python loop that soft_updates
+used to run against the multi-tensor version, and torch.optim.Adam against
+utils.create_adam.
+
+    python benchmarks/target_updates.py --voxel_size 16
+"""
+import argparse
+import time
+
+import torch
+
+from arm import utils
+from arm.c2farm.networks import Qattention3DNet
+
+
+def _loop_soft_updates(net, target_net, tau):
+    for param, target_param in zip(net.parameters(), target_net.parameters()):
+        target_param.data.copy_(
+            tau * param.data + (1 - tau) * target_param.data
+        )
+
+
+def _time(fn, iterations, device):
+    for _ in range(3):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    return (time.perf_counter() - start) / iterations * 1e3
+
+
+def _net(args, device):
+    net = Qattention3DNet(
+        in_channels=10, out_channels=2, out_dense=216,
+        voxel_size=args.voxel_size, low_dim_size=10, kernels=args.kernels,
+        activation='lrelu', dense_feats=128)
+    net.build()
+    return net.to(device)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--voxel_size', type=int, default=16)
+    parser.add_argument('--kernels', type=int, default=64)
+    parser.add_argument('--tau', type=float, default=0.0025)
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--device', type=str, default=(
+        'cuda' if torch.cuda.is_available() else 'cpu'))
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    net, target = _net(args, device), _net(args, device)
+    params = list(net.parameters())
+    print('%d parameter tensors on %s (ms per step)' % (len(params), device))
+
+    loop = _time(lambda: _loop_soft_updates(net, target, args.tau),
+                 args.iterations, device)
+    fused = _time(lambda: utils.soft_updates(net, target, args.tau),
+                  args.iterations, device)
+    print('soft update  loop %8.3f  multi-tensor %8.3f' % (loop, fused))
+
+    # Four single updates against one compounded update on the 4th step.
+    initial = [p.clone() for p in target.parameters()]
+    for _ in range(4):
+        _loop_soft_updates(net, target, args.tau)
+    single = [p.clone() for p in target.parameters()]
+    with torch.no_grad():
+        for p, p0 in zip(target.parameters(), initial):
+            p.copy_(p0)
+    for step in range(1, 5):
+        utils.soft_updates(net, target, args.tau, every=4, step=step)
+    err = max((a - b).abs().max().item() for a, b in zip(
+        single, target.parameters()))
+    print('every=4 max abs difference to 4 single updates %.2e' % err)
+
+    for p in params:
+        p.grad = torch.randn_like(p)
+    for name, optimizer in [
+            ('torch.optim.Adam', torch.optim.Adam(params, lr=5e-4)),
+            ('utils.create_adam', utils.create_adam(params, lr=5e-4))]:
+        step = _time(optimizer.step, args.iterations, device)
+        print('%18s  step %8.3f (%s)' % (name, step,
+                                         type(optimizer).__module__))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Batch 1 latency of QAttentionAgent.act per C2F-ARM depth, in eager mode
+against the traced and frozen act module that export_act_module saves for
+rollout workers. Runs on CPU with a fixed number of threads, and checks
+that both pick the same actions.
+
+    python benchmarks/traced_acting.py --threads 1 --depths 2
+"""
+import argparse
+import tempfile
+import time
+
+import torch
+
+from arm.c2farm.networks import Qattention3DNet
+from arm.c2farm.qattention_agent import QAttentionAgent
+
+CAMERAS = ['front', 'left_shoulder', 'right_shoulder', 'wrist']
+LOW_DIM_SIZE = 4
+BOUNDS = [-0.3, -0.5, 0.6, 0.7, 0.5, 1.6]
+
+
+def _agent(args, depth, depths):
+    last = depth == depths - 1
+    unet3d = Qattention3DNet(
+        in_channels=10, out_channels=1 if depth == 0 else 2,
+        out_dense=216 if last else 0, voxel_size=args.voxel_size,
+        low_dim_size=LOW_DIM_SIZE, kernels=64, activation='lrelu',
+        dense_feats=128)
+    agent = QAttentionAgent(
+        layer=depth, coordinate_bounds=BOUNDS, unet3d=unet3d,
+        camera_names=CAMERAS, batch_size=1, voxel_size=args.voxel_size,
+        bounds_offset=0.15 if depth > 0 else None, voxel_feature_size=3,
+        image_crop_size=64, exploration_strategy='gaussian',
+        num_rotation_classes=72, rotation_resolution=5,
+        include_low_dim_state=True, image_resolution=[args.resolution] * 2)
+    agent.build(training=False, device=torch.device('cpu'))
+    return agent
+
+
+def _observation(args):
+    r = args.resolution
+    lo, hi = torch.tensor(BOUNDS[:3]), torch.tensor(BOUNDS[3:])
+    observation = {
+        'low_dim_state': torch.randn(1, 1, LOW_DIM_SIZE),
+        'attention_coordinate': lo + torch.rand(1, 3) * (hi - lo)}
+    for n in CAMERAS:
+        observation['%s_rgb' % n] = torch.rand(1, 1, 3, r, r) * 2 - 1
+        observation['%s_point_cloud' % n] = (
+            lo + torch.rand(1, 1, r, r, 3) * (hi - lo)).permute(0, 1, 4, 2, 3)
+        observation['%s_pixel_coord' % n] = torch.randint(
+            0, r, (1, 1, 2)).float()
+    return observation
+
+
+def _time(fn, iterations):
+    for _ in range(3):
+        fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--depths', type=int, default=2)
+    parser.add_argument('--voxel_size', type=int, default=16)
+    parser.add_argument('--resolution', type=int, default=128)
+    parser.add_argument('--iterations', type=int, default=50)
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+
+    observation = _observation(args)
+    print('batch 1 on cpu with %d threads (ms per act)' % args.threads)
+    for depth in range(args.depths):
+        agent = _agent(args, depth, args.depths)
+        eager = agent.act(0, observation, deterministic=True)
+        eager_ms = _time(lambda: agent.act(0, observation, True),
+                         args.iterations)
+        with tempfile.TemporaryDirectory() as savedir:
+            agent.export_act_module(savedir)
+            agent.load_act_module(savedir)
+        traced = agent.act(0, observation, deterministic=True)
+        traced_ms = _time(lambda: agent.act(0, observation, True),
+                          args.iterations)
+        same = all(
+            a is None and b is None or torch.equal(a, b)
+            for a, b in zip(eager.action, traced.action))
+        print('depth %d  eager %8.3f  traced %8.3f  same action: %s' % (
+            depth, eager_ms, traced_ms, same))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""Stand-ins for CustomRLBenchEnv and MultiTaskRLBenchEnv that need no
+simulator, for load-testing the env runners, replays and learner.
+
+They make the same observation_elements and return random observations
+(or cycle through a pool of them, or through observations a replay recorded
+with replay.use_disk) from step and reset, optionally after a simulated
+step latency. Episodes end after episode_length steps, or earlier
+with success_rate (rewarded as a task success) or failure_rate (penalised
+as an invalid action). crash_rate makes step raise, which kills the worker
+process as a simulator crash would, so restarts can be tested. Neither
+PyRep nor RLBench is imported.
+"""
+import os
+import pickle
+import time
+from glob import glob
+from typing import List
+
+import numpy as np
+from yarr.agents.agent import ActResult
+from yarr.envs.env import Env
+from yarr.utils.observation_type import ObservationElement
+from yarr.utils.transition import Transition
+
+from extar.utils.synthetic_data import SyntheticData, observation_elements
+
+
+class SyntheticRLBenchEnv(Env):
+
+    def __init__(self,
+                 cameras: List[str],
+                 camera_resolution: List[int],
+                 episode_length: int,
+                 scene_bounds: List[float] = (-0.3, -0.5, 0.6, 0.7, 0.5, 1.6),
+                 low_dim_state_len: int = 4,
+                 reward_scale=100.0,
+                 state_includes_remaining_time: bool = True,
+                 compact_depth: bool = False,
+                 step_latency: float = 0.,
+                 step_latency_jitter: float = 0.,
+                 success_rate: float = 0.,
+                 failure_rate: float = 0.,
+                 crash_rate: float = 0.,
+                 observation_pool: int = 0,
+                 observation_dir: str = None):
+        super(SyntheticRLBenchEnv, self).__init__()
+        self._cameras = list(cameras)
+        self._camera_resolution = list(camera_resolution)
+        self._episode_length = episode_length
+        self._scene_bounds = list(scene_bounds)
+        self._reward_scale = reward_scale
+        self._state_includes_remaining_time = state_includes_remaining_time
+        self._compact_depth = compact_depth
+        self._step_latency = step_latency
+        self._step_latency_jitter = step_latency_jitter
+        self._success_rate = success_rate
+        self._failure_rate = failure_rate
+        self._crash_rate = crash_rate
+        self._observation_pool = observation_pool
+        self._observation_dir = observation_dir
+        self.low_dim_state_len = low_dim_state_len
+        self._rng = None
+        self._data = None
+        self._pool = []
+        self._i = 0
+
+    @property
+    def observation_elements(self) -> List[ObservationElement]:
+        return observation_elements(
+            self._cameras, self._camera_resolution, self.low_dim_state_len,
+            self._compact_depth)
+
+    @property
+    def action_shape(self):
+        return (8,)
+
+    @property
+    def env(self):
+        return self
+
+    def launch(self):
+        # Seeded from the OS, so that every worker process differs.
+        self._rng = np.random.RandomState()
+        self._data = SyntheticData(
+            self._scene_bounds, self._camera_resolution,
+            seed=self._rng.randint(2 ** 31))
+        if self._observation_dir:
+            self._pool = self._load_obs()
+        else:
+            self._pool = [
+                self._new_obs() for _ in range(self._observation_pool)]
+
+    def _new_obs(self) -> dict:
+        return {e.name: self._data.element(e.name, e.shape, e.type)
+                for e in self.observation_elements}
+
+    def _load_obs(self) -> List[dict]:
+        # YARR's replays pickle every transition they add to save_dir, as
+        # <index>.replay, keyed by the replay elements' names.
+        files = sorted(
+            glob(os.path.join(self._observation_dir, '*.replay')),
+            key=lambda f: int(os.path.basename(f).split('.')[0]))
+        if self._observation_pool > 0:
+            files = files[:self._observation_pool]
+        if len(files) == 0:
+            raise ValueError(
+                'No recorded observations (*.replay) in %s.' %
+                self._observation_dir)
+        names = [e.name for e in self.observation_elements]
+        pool = []
+        for f in files:
+            with open(f, 'rb') as fp:
+                transition = pickle.load(fp)
+            missing = [n for n in names if n not in transition]
+            if len(missing) > 0:
+                raise ValueError('%s has no %s observations.' % (
+                    f, ', '.join(missing)))
+            pool.append({n: transition[n] for n in names})
+        return pool
+
+    def _obs(self) -> dict:
+        if len(self._pool) > 0:
+            obs = dict(self._pool[self._i % len(self._pool)])
+        else:
+            obs = self._new_obs()
+        if self._state_includes_remaining_time:
+            # As RLBenchEnv.extract_obs appends it.
+            low_dim_state = np.array(obs['low_dim_state'])
+            low_dim_state[-1] = 1. - self._i / float(self._episode_length - 1)
+            obs['low_dim_state'] = low_dim_state
+        return obs
+
+    def reset(self) -> dict:
+        self._i = 0
+        return self._obs()
+
+    def step(self, act_result: ActResult) -> Transition:
+        if self._step_latency > 0 or self._step_latency_jitter > 0:
+            time.sleep(max(0., self._step_latency + self._rng.uniform(
+                -self._step_latency_jitter, self._step_latency_jitter)))
+        outcome = self._rng.uniform()
+        if outcome < self._crash_rate:
+            raise RuntimeError('Injected simulator crash.')
+        outcome -= self._crash_rate
+        self._i += 1
+        reward, terminal = 0.0, False
+        if outcome < self._success_rate:
+            reward, terminal = self._reward_scale, True
+        elif outcome < self._success_rate + self._failure_rate:
+            # As CustomRLBenchEnv handles IK and path planning errors.
+            reward, terminal = -1.0, True
+        return Transition(self._obs(), reward, terminal, summaries=[])
+
+
+class MultiTaskSyntheticRLBenchEnv(SyntheticRLBenchEnv):
+    """Samples one of the train (or eval) tasks every episode and names it
+    in the transitions' info, as MultiTaskRLBenchEnv does. The tasks only
+    differ by name."""
+
+    def __init__(self,
+                 train_tasks: List[str],
+                 eval_tasks: List[str],
+                 *args, **kwargs):
+        super(MultiTaskSyntheticRLBenchEnv, self).__init__(*args, **kwargs)
+        self.train_tasks = list(train_tasks)
+        self.eval_tasks = list(eval_tasks)
+        self.train_task_classes = {name: name for name in self.train_tasks}
+        self.unique_tasks = {
+            name: name for name in set(self.train_tasks + self.eval_tasks)}
+        self.n_train_tasks, self.n_eval_tasks = (
+            len(train_tasks), len(eval_tasks))
+        self.n_unique_tasks = len(self.unique_tasks)
+        self._task_name = None
+
+    def reset_task(self):
+        task_names = self.eval_tasks if self.eval else self.train_tasks
+        self._task_name = task_names[self._rng.randint(len(task_names))]
+
+    def reset(self) -> dict:
+        self.reset_task()
+        return super(MultiTaskSyntheticRLBenchEnv, self).reset()
+
+    def step(self, act_result: ActResult) -> Transition:
+        transition = super(MultiTaskSyntheticRLBenchEnv, self).step(act_result)
+        transition.info['task_name'] = self._task_name
+        return transition
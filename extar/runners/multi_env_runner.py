@@ -5,6 +5,8 @@ handles EnvRunner, ReplayBuffer, and the Agent Update with a slightly more
 flattened logic.
 Big credit to Stephen's MultiTaskQAttention for great reference 
 """
+from __future__ import annotations
+
 import os
 import time
 import copy
@@ -14,7 +16,7 @@ import logging
 from copy import deepcopy 
 from collections import OrderedDict, defaultdict
 from multiprocessing import Process, Manager, Value
-from typing import Any, List, Union
+from typing import Any, List, Union, TYPE_CHECKING
 
 import collections
 import logging
@@ -37,7 +39,6 @@ from yarr.envs.env import Env
 from yarr.replay_buffer.replay_buffer import ReplayBuffer
 from yarr.runners.env_runner import EnvRunner
 
-from arm.custom_rlbench_env import CustomRLBenchEnv, MultiTaskRLBenchEnv
 from yarr.utils.stat_accumulator import StatAccumulator
 from yarr.agents.agent import Summary, ScalarSummary, HistogramSummary, ImageSummary, \
     VideoSummary
@@ -46,6 +47,10 @@ from extar.utils.logger import MultiTaskAccumulator, MultiTaskAccumulator
 from extar.utils.rollouts import RolloutGenerator
 from extar.runners._env_runner import _EnvRunner # New(0724)
 
+if TYPE_CHECKING:
+    # Type hints only; PyRep needs CoppeliaSim to import.
+    from arm.custom_rlbench_env import MultiTaskRLBenchEnv
+
 NUM_WEIGHTS_TO_KEEP = 10
 
 class MultiTaskEnvRunner(object):
@@ -27,13 +27,14 @@ from yarr.envs.env import Env
 # from yarr.utils.rollout_generator import RolloutGenerator
 from yarr.runners.env_runner import EnvRunner
 from yarr.runners._env_runner import _EnvRunner
-from arm.custom_rlbench_env import CustomRLBenchEnv, MultiTaskRLBenchEnv
 from yarr.utils.stat_accumulator import StatAccumulator
 
 from yarr.runners.train_runner import TrainRunner
 
 from extar.runners.multi_env_runner import MultiTaskEnvRunner
 from extar.utils.logger import WandbLogWriter, MultiTaskAccumulator
+from extar.utils.replay_sampler import MultiTaskReplaySampler, \
+    DeferredPriorityUpdate
 from extar.utils.rollouts import RolloutGenerator
 from yarr.agents.agent import Summary, ScalarSummary, HistogramSummary, ImageSummary, \
     VideoSummary
@@ -130,16 +131,24 @@ class MultiTaskPyTorchTrainer(TrainRunner):
             if os.path.exists(prev_dir):
                 shutil.rmtree(prev_dir)
 
-    def _step(self, i, sampled_batch):
+    def _create_sampler(self):
+        """Builds the sampler and priority updates for the built agent and
+        returns its update and summary-only keys."""
+        update_keys = self._agent.update_keys()
+        summary_keys = [
+            k for k in self._agent.summary_keys() if k not in update_keys]
+        self._sampler = MultiTaskReplaySampler(
+            self._replay_list, self._replay_buffer_sample_rates,
+            keys=update_keys + summary_keys)
+        self._priority_update = DeferredPriorityUpdate(self._sampler)
+        return update_keys, summary_keys
+
+    def _step(self, i, sampled_batch, indices=None):
         update_dict = self._agent.update(i, sampled_batch)
-        acc_bs = 0
-        for wb in self._replay_list:
-            bs = wb.replay_buffer.batch_size
-            if 'priority' in update_dict:
-                wb.replay_buffer.set_priority(
-                    sampled_batch['indices'][acc_bs:acc_bs+bs].cpu().detach().numpy(),
-                    update_dict['priority'][acc_bs:acc_bs+bs])
-            acc_bs += bs
+        if 'priority' in update_dict:
+            if indices is None:
+                indices = sampled_batch['indices'].cpu().numpy()
+            self._priority_update.push(indices, update_dict['priority'])
     
     def _signal_handler(self, sig, frame):
         if threading.current_thread().name != 'MainThread':
@@ -189,11 +198,10 @@ class MultiTaskPyTorchTrainer(TrainRunner):
         logging.info('Finished adding all %d samples before training. Currently have %s.' %
                 (self._transitions_before_train, str(self._get_add_counts())))
 
-        datasets = [r.dataset() for r in self._replay_list]
-        data_iter = [iter(d) for d in datasets]
+        update_keys, summary_keys = self._create_sampler()
 
         init_replay_size = self._get_sum_add_counts().astype(float)
-        batch_size = sum([r.replay_buffer.batch_size for r in self._replay_list])
+        batch_size = self._sampler.batch_size
         process = psutil.Process(os.getpid())
         num_cpu = psutil.cpu_count()
 
@@ -235,20 +243,17 @@ class MultiTaskPyTorchTrainer(TrainRunner):
                 del replay_ratio
 
             t = time.time()
-            sampled_batch = [next(di) for di in data_iter]
-            if len(sampled_batch) > 1:
-                result = {}
-                for key in sampled_batch[0]:
-                    result[key] = torch.cat([d[key] for d in sampled_batch], 0)
-                sampled_batch = result
-            else:
-                sampled_batch = sampled_batch[0]
-
+            sampled_batch = self._sampler.sample()
             sample_time = time.time() - t
             self.accumulate_times['sample'] += sample_time
-            batch = {k: v.to(self._train_device) for k, v in sampled_batch.items()}
+            # Summary-only keys are moved to the device on log iterations.
+            batch = {k: v.to(self._train_device)
+                     for k, v in sampled_batch.items()
+                     if k in update_keys or (log_iteration and k in summary_keys)}
+            self._agent.set_summary_capture(
+                log_iteration and self._writer is not None)
             t = time.time()
-            self._step(i, batch)
+            self._step(i, batch, sampled_batch['indices'].numpy())
             step_time = time.time() - t
             self.accumulate_times['agent_step'] += step_time 
 
@@ -292,6 +297,7 @@ class MultiTaskPyTorchTrainer(TrainRunner):
             if i % self._save_freq == 0 and self._weightsdir is not None:
                 self._save_model(i)
 
+        self._priority_update.flush()
         if self._writer is not None:
             self._writer.close()
 
@@ -0,0 +1,225 @@
+"""Samples one training batch across several replay buffers as if they were
+a single store. Per-task batches are no longer drawn through separate
+DataLoader iterators and stitched together with torch.cat; each element is
+gathered once straight into its rows of the output batch."""
+import logging
+from typing import List
+
+import numpy as np
+import torch
+from yarr.replay_buffer.prioritized_replay_buffer import \
+    PrioritizedReplayBuffer
+from yarr.replay_buffer.wrappers.pytorch_replay_buffer import \
+    PyTorchReplayBuffer
+
+INDICES = 'indices'
+TERMINAL = 'terminal'
+SAMPLING_PROBABILITIES = 'sampling_probabilities'
+MAX_SAMPLE_ATTEMPTS = 1000
+
+
+def _split_batch(batch_size: int, sample_rates: List[float]) -> List[int]:
+    counts = np.floor(np.array(sample_rates) * batch_size).astype(np.int64)
+    remainder = batch_size - counts.sum()
+    if remainder > 0:
+        # Hand the leftover rows to the largest fractional parts.
+        fractions = np.array(sample_rates) * batch_size - counts
+        counts[np.argsort(-fractions, kind='stable')[:remainder]] += 1
+    return counts.tolist()
+
+
+class MultiTaskReplaySampler(object):
+
+    def __init__(self,
+                 replays: List[PyTorchReplayBuffer],
+                 sample_rates: List[float],
+                 batch_size: int = None,
+                 keys: List[str] = None):
+        if len(replays) != len(sample_rates):
+            raise ValueError(
+                'Numbers of replay buffers differs from sampling rates.')
+        self._buffers = [r.replay_buffer for r in replays]
+        if batch_size is None:
+            batch_size = sum([b.batch_size for b in self._buffers])
+        self._batch_size = batch_size
+        self._counts = _split_batch(batch_size, sample_rates)
+        self._offsets = np.cumsum([0] + self._counts)
+        self._prioritized = [isinstance(b, PrioritizedReplayBuffer)
+                             for b in self._buffers]
+        # Only gather what the agent reads; indices are always needed to
+        # route priorities back.
+        self._elements = [
+            e for e in self._buffers[0].get_transition_elements(batch_size)
+            if keys is None or e.name in keys or e.name == INDICES]
+        self._fast = [self._supports_fast_path(b) for b in self._buffers]
+        if not all(self._fast):
+            logging.info('Falling back to sample_transition_batch for %d of '
+                         '%d replay buffers.' % (
+                self._fast.count(False), len(self._fast)))
+
+    @property
+    def batch_size(self) -> int:
+        return self._batch_size
+
+    def _supports_fast_path(self, buffer) -> bool:
+        store = getattr(buffer, '_store', None)
+        if (store is None or getattr(buffer, '_disk_saving', False) or
+                buffer.timesteps != 1 or buffer._update_horizon != 1):
+            return False
+        for e in self._elements:
+            name = e.name[:-4] if e.is_observation and e.name.endswith(
+                '_tp1') else e.name
+            if name not in store and name not in [
+                    INDICES, SAMPLING_PROBABILITIES]:
+                return False
+        return True
+
+    def _sample_uniform_indices(self, buffers: List[int]) -> List[np.ndarray]:
+        # Mirrors UniformReplayBuffer.sample_index_batch and
+        # is_valid_transition for timesteps == 1 and update_horizon == 1, but
+        # draws the rows of every buffer at once.
+        lows, highs, caps, owners = [], [], [], []
+        for b in buffers:
+            buffer = self._buffers[b]
+            cursor = buffer.cursor()
+            if buffer.is_full():
+                min_id = cursor - buffer.replay_capacity
+            else:
+                min_id = 0
+            max_id = cursor - 1
+            if max_id <= min_id:
+                raise RuntimeError(
+                    'Cannot sample a batch with fewer than stack size (1) + '
+                    'update_horizon (1) transitions.')
+            n = self._counts[b]
+            lows.append(np.full(n, min_id))
+            highs.append(np.full(n, max_id))
+            caps.append(np.full(n, buffer.replay_capacity))
+            owners.append(np.full(n, b))
+        lows, highs = np.concatenate(lows), np.concatenate(highs)
+        caps, owners = np.concatenate(caps), np.concatenate(owners)
+
+        indices = np.zeros(len(lows), dtype=np.int64)
+        todo = np.arange(len(lows))
+        for _ in range(MAX_SAMPLE_ATTEMPTS):
+            draw = lows[todo] + np.floor(np.random.random(len(todo)) * (
+                highs[todo] - lows[todo])).astype(np.int64)
+            indices[todo] = draw % caps[todo]
+            valid = np.ones(len(todo), dtype=bool)
+            for b in buffers:
+                rows = owners[todo] == b
+                if not rows.any():
+                    continue
+                buffer = self._buffers[b]
+                idx = indices[todo[rows]]
+                valid[rows] = np.logical_and(
+                    ~np.isin(idx, buffer.invalid_range),
+                    buffer._store[TERMINAL][idx] != -1)
+            todo = todo[~valid]
+            if len(todo) == 0:
+                break
+        else:
+            raise RuntimeError(
+                'Max sample attempts: Tried %d times but only sampled %d '
+                'valid indices. Batch size is %d' % (
+                    MAX_SAMPLE_ATTEMPTS, len(indices) - len(todo),
+                    len(indices)))
+        split = np.cumsum([self._counts[b] for b in buffers])[:-1]
+        return np.split(indices, split)
+
+    def _sample_indices(self) -> List[np.ndarray]:
+        indices = [None] * len(self._buffers)
+        uniform = [b for b in range(len(self._buffers))
+                   if self._fast[b] and not self._prioritized[b]]
+        if len(uniform) > 0:
+            for b, idx in zip(uniform, self._sample_uniform_indices(uniform)):
+                indices[b] = idx
+        for b, buffer in enumerate(self._buffers):
+            if indices[b] is None:
+                indices[b] = np.asarray(
+                    buffer.sample_index_batch(self._counts[b]))
+        return indices
+
+    def _gather(self, out: dict, b: int, idx: np.ndarray):
+        buffer = self._buffers[b]
+        rows = slice(self._offsets[b], self._offsets[b + 1])
+        if not self._fast[b]:
+            batch = buffer.sample_transition_batch(
+                batch_size=len(idx), indices=idx, pack_in_dict=True)
+            for name, array in out.items():
+                array[rows] = batch[name]
+            return
+        next_idx = (idx + 1) % buffer.replay_capacity
+        with buffer._lock:
+            for e in self._elements:
+                dst = out[e.name][rows]
+                if e.name == INDICES:
+                    dst[:] = idx
+                    continue
+                if e.name == SAMPLING_PROBABILITIES:
+                    dst[:] = buffer.get_priority(idx)
+                    continue
+                src_idx = idx
+                name = e.name
+                if e.is_observation and name.endswith('_tp1'):
+                    name, src_idx = name[:-4], next_idx
+                src = buffer._store[name]
+                dst = dst.reshape((len(idx),) + src.shape[1:])
+                if src.dtype == dst.dtype:
+                    np.take(src, src_idx, axis=0, out=dst, mode='clip')
+                else:
+                    dst[:] = src[src_idx]
+
+    def sample(self) -> dict:
+        """Returns a batch of host tensors whose rows are grouped by buffer,
+        in the same order as the replays passed at construction."""
+        indices = self._sample_indices()
+        out = {e.name: np.empty(
+            (self._batch_size,) + tuple(e.shape[1:]), dtype=e.type)
+            for e in self._elements}
+        for b, idx in enumerate(indices):
+            self._gather(out, b, idx)
+        return {k: torch.from_numpy(v) for k, v in out.items()}
+
+    def set_priority(self, indices: np.ndarray, priorities):
+        for b, buffer in enumerate(self._buffers):
+            if not self._prioritized[b]:
+                continue
+            s, e = self._offsets[b], self._offsets[b + 1]
+            buffer.set_priority(indices[s:e], priorities[s:e])
+
+
+class DeferredPriorityUpdate(object):
+    """Moves a step's priorities to the host in one non-blocking copy and
+    only applies them to the replay buffers on the next push (or flush), so
+    the host-side tree update runs while the device works on the next
+    update."""
+
+    def __init__(self, sampler: MultiTaskReplaySampler):
+        self._sampler = sampler
+        self._pending = None
+
+    def push(self, indices: np.ndarray, priorities):
+        self.flush()
+        event = None
+        if isinstance(priorities, torch.Tensor):
+            priorities = priorities.detach()
+            if priorities.is_cuda:
+                host = torch.empty(priorities.shape, dtype=priorities.dtype,
+                                   pin_memory=True)
+                host.copy_(priorities, non_blocking=True)
+                event = torch.cuda.Event()
+                event.record()
+                priorities = host
+        self._pending = (indices, priorities, event)
+
+    def flush(self):
+        if self._pending is None:
+            return
+        indices, priorities, event = self._pending
+        self._pending = None
+        if event is not None:
+            event.synchronize()
+        if isinstance(priorities, torch.Tensor):
+            priorities = priorities.numpy()
+        self._sampler.set_priority(indices, np.asarray(priorities))
@@ -0,0 +1,140 @@
+"""Random transitions for filling replay buffers without a simulator.
+
+observation_elements lists the observations CustomRLBenchEnv makes for a
+camera setup, which is all the launch utils' create_replay functions read
+from an environment (extar.envs.synthetic_env stands in for one).
+SyntheticData fills any replay buffer built from them, element by element
+of its storage signature. Values stay in the ranges the agents expect (pixel
+coordinates inside the image, voxel indices inside the grids, coordinates
+inside the scene bounds, unit quaternions), so the updates run as they would
+on demos, only on meaningless data.
+"""
+from typing import List
+
+import numpy as np
+from yarr.replay_buffer.replay_buffer import ReplayBuffer
+from yarr.utils.observation_type import ObservationElement
+
+from arm.utils import COMPACT_DEPTH_SCALE
+
+# Stored by add() itself rather than passed as observations.
+_TRANSITION_NAMES = ['action', 'reward', 'terminal', 'timeout']
+
+
+def observation_elements(cameras: List[str], camera_resolution: List[int],
+                         low_dim_state_len: int,
+                         compact_depth: bool = False
+                         ) -> List[ObservationElement]:
+    """The observation_elements of a CustomRLBenchEnv with rgb and point
+    clouds (or int16 depth and camera matrices with compact_depth) for the
+    cameras."""
+    h, w = camera_resolution
+    elements = [ObservationElement(
+        'low_dim_state', (low_dim_state_len,), np.float32)]
+    for n in cameras:
+        elements.append(ObservationElement('%s_rgb' % n, (3, h, w), np.uint8))
+        if compact_depth:
+            elements.extend([
+                ObservationElement('%s_depth' % n, (1, h, w), np.int16),
+                ObservationElement(
+                    '%s_camera_extrinsics' % n, (4, 4), np.float32),
+                ObservationElement(
+                    '%s_camera_intrinsics' % n, (3, 3), np.float32)])
+        else:
+            elements.append(ObservationElement(
+                '%s_point_cloud' % n, (3, h, w), np.float32))
+    return elements
+
+
+class SyntheticData(object):
+
+    def __init__(self,
+                 scene_bounds: List[float],
+                 camera_resolution: List[int],
+                 voxel_sizes: List[int] = None,
+                 rotation_resolution: float = 5,
+                 seed: int = 0):
+        self._bounds = np.array(scene_bounds, dtype=np.float32)
+        self._camera_resolution = list(camera_resolution)
+        self._voxel_sizes = list(voxel_sizes or [])
+        self._num_rotation_classes = int(360. // rotation_resolution)
+        self._rng = np.random.RandomState(seed)
+
+    def _coordinates(self, shape) -> np.ndarray:
+        # Points inside the scene bounds, xyz along the first axis.
+        lo, hi = self._bounds[:3], self._bounds[3:]
+        extra = (1,) * (len(shape) - 1)
+        u = self._rng.uniform(size=shape).astype(np.float32)
+        return lo.reshape((3,) + extra) + u * (hi - lo).reshape((3,) + extra)
+
+    def action(self) -> np.ndarray:
+        """A gripper pose inside the scene bounds and an open or closed
+        gripper."""
+        quaternion = self._rng.normal(size=4)
+        quaternion /= np.linalg.norm(quaternion)
+        return np.concatenate([
+            self._coordinates((3,)), quaternion,
+            [self._rng.randint(2)]]).astype(np.float32)
+
+    def element(self, name: str, shape: tuple, dtype) -> np.ndarray:
+        """A value for the replay element called name."""
+        h, w = self._camera_resolution
+        if name.endswith('_rgb'):
+            value = self._rng.randint(0, 256, size=shape)
+        elif name.endswith('_point_cloud') or name.startswith(
+                'attention_coordinate'):
+            value = self._coordinates(shape)
+        elif name.endswith('_depth'):
+            value = self._rng.uniform(0.5, 2., size=shape) * COMPACT_DEPTH_SCALE
+        elif name.endswith('_camera_extrinsics'):
+            value = np.eye(4)
+            value[:3, 3] = self._coordinates((3,))
+        elif name.endswith('_camera_intrinsics'):
+            value = np.array([[w, 0, w / 2.], [0, h, h / 2.], [0, 0, 1]])
+        elif name.endswith('_pixel_coord'):
+            value = [self._rng.randint(h), self._rng.randint(w)]
+        elif name == 'trans_action_indicies':
+            value = np.concatenate([self._rng.randint(v, size=3)
+                                    for v in self._voxel_sizes])
+        elif name == 'rot_grip_action_indicies':
+            value = np.concatenate([
+                self._rng.randint(self._num_rotation_classes, size=3),
+                [self._rng.randint(2)]])
+        elif np.issubdtype(dtype, np.floating):
+            value = self._rng.normal(size=shape)
+        else:
+            value = np.zeros(shape)
+        return np.asarray(value).reshape(shape).astype(dtype)
+
+    def fill(self, replay: ReplayBuffer, transitions: int,
+             episode_length: int = 10, demo: bool = True,
+             extra_names: List[str] = ('demo',)):
+        """Adds transitions, in episodes of episode_length, to a replay
+        buffer, and returns their actions. extra_names are its
+        extra_replay_elements, which are stored with a transition but are not
+        observations."""
+        observations = [
+            e for e in replay.get_storage_signature()
+            if e.name not in _TRANSITION_NAMES and e.name not in extra_names]
+        actions = []
+        for t in range(transitions):
+            terminal = (t + 1) % episode_length == 0 or t == transitions - 1
+            kwargs = {e.name: self.element(e.name, e.shape, e.type)
+                      for e in observations}
+            if 'demo' in extra_names:
+                kwargs['demo'] = demo
+            actions.append(self.action())
+            replay.add(actions[-1], float(terminal), terminal, False,
+                       **kwargs)
+            if terminal:
+                replay.add_final(**{e.name: self.element(
+                    e.name, e.shape, e.type) for e in observations})
+        return np.stack(actions)
+
+
+def from_config(cfg, seed: int = 0) -> SyntheticData:
+    """SyntheticData for the scene, cameras and method of a launch config."""
+    return SyntheticData(
+        cfg.rlbench.scene_bounds, cfg.rlbench.camera_resolution,
+        cfg.method.get('voxel_sizes', None),
+        cfg.method.get('rotation_resolution', 5), seed)
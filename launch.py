@@ -5,11 +5,6 @@ os.environ["CUDA_DEVICE_ORDER"] = "PCI_BUS_ID"
 
 from typing import List
 import torch
-from pyrep.const import RenderMode
-from rlbench import CameraConfig, ObservationConfig, ArmActionMode
-from rlbench.action_modes import ActionMode, GripperActionMode
-from rlbench.backend import task
-from rlbench.backend.utils import task_file_to_task_class
 from yarr.replay_buffer.wrappers.pytorch_replay_buffer import \
     PyTorchReplayBuffer
 from yarr.runners.env_runner import EnvRunner
@@ -19,7 +14,8 @@ from yarr.utils.stat_accumulator import SimpleAccumulator
 from arm import arm
 from arm import c2farm
 from arm.baselines import bc, td3, dac, sac
-from arm.custom_rlbench_env import CustomRLBenchEnv
+from extar.envs.synthetic_env import SyntheticRLBenchEnv
+from extar.utils import synthetic_data
 import numpy as np
 
 import hydra
@@ -27,7 +23,14 @@ import logging
 from omegaconf import DictConfig, OmegaConf, ListConfig
 
 
+# PyRep and RLBench are imported where the simulator is needed, so that
+# create_replays and create_agent work without CoppeliaSim.
+
+
 def _create_obs_config(camera_names: List[str], camera_resolution: List[int]):
+    from pyrep.const import RenderMode
+    from rlbench import CameraConfig, ObservationConfig
+
     unused_cams = CameraConfig()
     unused_cams.set_all(False)
     used_cams = CameraConfig(
@@ -76,47 +79,80 @@ def _modify_action_min_max(action_min_max):
     return action_min_max
 
 
-def run_seed(cfg: DictConfig, env, cams, device, seed) -> None:
-    train_envs = cfg.framework.train_envs
-    replay_ratio = None if cfg.framework.replay_ratio == 'None' else cfg.framework.replay_ratio
-    replay_split = [1]
-    replay_path = os.path.join(cfg.replay.path, cfg.rlbench.task, cfg.method.name, 'seed%d' % seed)
-    action_min_max = None
-
+def create_replays(cfg: DictConfig, env, cams, replay_path: str = None):
+    """cfg.method's replay buffers, exploration last, and the rates to sample
+    them at. They are kept in memory when replay_path is None."""
+    args = (cfg.replay.batch_size, cfg.replay.timesteps,
+            cfg.replay.prioritisation)
+    if cfg.method.name == 'C2FARM':
+        return [c2farm.launch_utils.create_replay(
+            *args, replay_path, cams, env, cfg.method.voxel_sizes)], [1]
+    elif cfg.method.name == 'ARM':
+        if len(cams) > 1 or 'front' not in cams:
+            raise ValueError('ARM expects only front camera.')
+        return [arm.launch_utils.create_replay(
+            *args, replay_path, cams, env)], [1]
+    elif cfg.method.name in ['TD3', 'SAC', 'bc']:
+        method = {'TD3': td3, 'SAC': sac, 'bc': bc}[cfg.method.name]
+        return [method.launch_utils.create_replay(
+            *args, replay_path, env)], [1]
+    elif cfg.method.name == 'DAC':
+        args = (cfg.replay.batch_size // 2,) + args[1:]
+        replays = [dac.launch_utils.create_replay(
+            *args, None if replay_path is None else os.path.join(
+                replay_path, name), env) for name in ['demo', 'explore']]
+        return replays, [0.5, 0.5]
+    raise ValueError('Method %s does not exists.' % cfg.method.name)
+
+
+def fill_replays(cfg: DictConfig, env, cams, replays):
+    """Adds the task's demos to the replays of create_replays. Returns the
+    demo actions for the methods that bound their actions by them, else
+    None."""
+    demo_args = (cfg.rlbench.task, env, cfg.rlbench.demos,
+                 cfg.method.demo_augmentation,
+                 cfg.method.demo_augmentation_every_n)
     if cfg.method.name == 'C2FARM':
-        explore_replay = c2farm.launch_utils.create_replay(
-            cfg.replay.batch_size, cfg.replay.timesteps,
-            cfg.replay.prioritisation,
-            replay_path if cfg.replay.use_disk else None, cams, env,
-            cfg.method.voxel_sizes)
-        replays = [explore_replay]
-
         c2farm.launch_utils.fill_replay(
-            explore_replay, cfg.rlbench.task, env, cfg.rlbench.demos,
-            cfg.method.demo_augmentation, cfg.method.demo_augmentation_every_n,
+            replays[0], *demo_args,
             cams, cfg.rlbench.scene_bounds,
             cfg.method.voxel_sizes, cfg.method.bounds_offset,
             cfg.method.rotation_resolution, cfg.method.crop_augmentation)
+        return None
+    elif cfg.method.name == 'ARM':
+        return arm.launch_utils.fill_replay(replays[0], *demo_args, cams)
+    elif cfg.method.name == 'bc':
+        bc.launch_utils.fill_replay(replays[0], *demo_args)
+        return None
+    method = {'TD3': td3, 'SAC': sac, 'DAC': dac}[cfg.method.name]
+    # DAC only fills its demo replay.
+    return method.launch_utils.fill_replay(replays[0], *demo_args)
 
-        agent = c2farm.launch_utils.create_agent(cfg, env)
 
-    elif cfg.method.name == 'ARM':
-        if len(cams) > 1 or 'front' not in cams:
-            raise ValueError('ARM expects only front camera.')
-        explore_replay = arm.launch_utils.create_replay(
-            cfg.replay.batch_size, cfg.replay.timesteps,
-            cfg.replay.prioritisation,
-            replay_path if cfg.replay.use_disk else None, cams, env)
-        replays = [explore_replay]
-        all_actions = arm.launch_utils.fill_replay(
-            explore_replay, cfg.rlbench.task, env, cfg.rlbench.demos,
-            cfg.method.demo_augmentation, cfg.method.demo_augmentation_every_n,
-            cams)
+def _check_synthetic_method(cfg: DictConfig):
+    # fill_synthetic_replays only fills the first replay, and only C2FARM's
+    # replay has been checked against SyntheticData's elements.
+    if cfg.method.name != 'C2FARM':
+        raise ValueError('The synthetic environment only supports C2FARM, '
+                         'not %s.' % cfg.method.name)
 
-        action_min_max = np.min(all_actions, axis=0), np.max(all_actions,
-                                                             axis=0)
-        action_min_max = _modify_action_min_max(action_min_max)
-        agent = arm.launch_utils.create_agent(
+
+def fill_synthetic_replays(cfg: DictConfig, replays, transitions: int):
+    """fill_replays for SyntheticRLBenchEnv: random transitions instead of
+    demos. Returns their actions."""
+    _check_synthetic_method(cfg)
+    data = synthetic_data.from_config(cfg)
+    return data.fill(replays[0], transitions, cfg.rlbench.episode_length)
+
+
+def create_agent(cfg: DictConfig, env, cams, action_min_max=None):
+    """cfg.method's agent. All but C2F-ARM and BC need the action bounds
+    (_modify_action_min_max of fill_replays' actions)."""
+    if cfg.method.name == 'C2FARM':
+        return c2farm.launch_utils.create_agent(cfg, env)
+
+    elif cfg.method.name == 'ARM':
+        return arm.launch_utils.create_agent(
             cams[0], cfg.method.activation, cfg.method.q_conf,
             action_min_max, cfg.method.alpha, cfg.method.alpha_lr,
             cfg.method.alpha_auto_tune,
@@ -136,21 +172,7 @@ def run_seed(cfg: DictConfig, env, cams, device, seed) -> None:
             cfg.method.qattention_grad_clip)
 
     elif cfg.method.name == 'TD3':
-
-        explore_replay = td3.launch_utils.create_replay(
-            cfg.replay.batch_size, cfg.replay.timesteps,
-            cfg.replay.prioritisation,
-            replay_path if cfg.replay.use_disk else None, env)
-        replays = [explore_replay]
-
-        all_actions = td3.launch_utils.fill_replay(
-            explore_replay, cfg.rlbench.task, env, cfg.rlbench.demos,
-            cfg.method.demo_augmentation, cfg.method.demo_augmentation_every_n)
-
-        action_min_max = np.min(all_actions, axis=0), np.max(all_actions,
-                                                             axis=0)
-        action_min_max = _modify_action_min_max(action_min_max)
-        agent = td3.launch_utils.create_agent(
+        return td3.launch_utils.create_agent(
             cams[0], cfg.method.activation, action_min_max,
             cfg.rlbench.camera_resolution, cfg.method.critic_lr,
             cfg.method.actor_lr, cfg.method.critic_weight_decay,
@@ -159,22 +181,7 @@ def run_seed(cfg: DictConfig, env, cams, device, seed) -> None:
             env.low_dim_state_len)
 
     elif cfg.method.name == 'SAC':
-
-        explore_replay = sac.launch_utils.create_replay(
-            cfg.replay.batch_size, cfg.replay.timesteps,
-            cfg.replay.prioritisation,
-            replay_path if cfg.replay.use_disk else None, env)
-        replays = [explore_replay]
-
-        all_actions = sac.launch_utils.fill_replay(
-            explore_replay, cfg.rlbench.task, env, cfg.rlbench.demos,
-            cfg.method.demo_augmentation, cfg.method.demo_augmentation_every_n)
-
-        action_min_max = np.min(all_actions, axis=0), np.max(all_actions,
-                                                             axis=0)
-        # Make translation bounds a little bigger
-        action_min_max = _modify_action_min_max(action_min_max)
-        agent = sac.launch_utils.create_agent(
+        return sac.launch_utils.create_agent(
             cams[0], cfg.method.activation, action_min_max,
             cfg.rlbench.camera_resolution, cfg.method.critic_lr,
             cfg.method.actor_lr, cfg.method.critic_weight_decay,
@@ -186,28 +193,7 @@ def run_seed(cfg: DictConfig, env, cams, device, seed) -> None:
             cfg.method.decoder_latent_lambda, cfg.method.encoder_tau)
 
     elif cfg.method.name == 'DAC':
-
-        replay_demo_path = os.path.join(replay_path, 'demo')
-        replay_explore_path = os.path.join(replay_path, 'explore')
-        demo_replay = dac.launch_utils.create_replay(
-            cfg.replay.batch_size // 2, cfg.replay.timesteps,
-            cfg.replay.prioritisation,
-            replay_demo_path if cfg.replay.use_disk else None, env)
-        explore_replay = dac.launch_utils.create_replay(
-            cfg.replay.batch_size // 2, cfg.replay.timesteps,
-            cfg.replay.prioritisation,
-            replay_explore_path if cfg.replay.use_disk else None, env)
-        replays = [demo_replay, explore_replay]
-        replay_split = [0.5, 0.5]
-
-        all_actions = dac.launch_utils.fill_replay(
-            demo_replay, cfg.rlbench.task, env, cfg.rlbench.demos,
-            cfg.method.demo_augmentation, cfg.method.demo_augmentation_every_n)
-
-        action_min_max = np.min(all_actions, axis=0), np.max(all_actions,
-                                                             axis=0)
-        action_min_max = _modify_action_min_max(action_min_max)
-        agent = dac.launch_utils.create_agent(
+        return dac.launch_utils.create_agent(
             cams[0], cfg.method.activation, action_min_max,
             cfg.rlbench.camera_resolution, cfg.method.critic_lr,
             cfg.method.actor_lr, cfg.method.critic_weight_decay,
@@ -218,24 +204,39 @@ def run_seed(cfg: DictConfig, env, cams, device, seed) -> None:
             cfg.method.discriminator_weight_decay)
 
     elif cfg.method.name == 'bc':
+        return bc.launch_utils.create_agent(
+            cams[0], cfg.method.activation, cfg.method.lr,
+            cfg.method.weight_decay, cfg.rlbench.camera_resolution,
+            cfg.method.grad_clip, env.low_dim_state_len)
+    raise ValueError('Method %s does not exists.' % cfg.method.name)
+
+
+def run_seed(cfg: DictConfig, env, cams, device, seed) -> None:
+    train_envs = cfg.framework.train_envs
+    replay_ratio = None if cfg.framework.replay_ratio == 'None' else cfg.framework.replay_ratio
+    replay_path = os.path.join(cfg.replay.path, cfg.rlbench.task, cfg.method.name, 'seed%d' % seed)
+
+    if cfg.method.name == 'bc':
         if train_envs > 0:
             logging.warning('Training envs set to 0 for BC.')
             train_envs = 0
         replay_ratio = None  # No need for replay ratio for BC.
-        explore_replay = bc.launch_utils.create_replay(
-            cfg.replay.batch_size, cfg.replay.timesteps,
-            cfg.replay.prioritisation,
-            replay_path if cfg.replay.use_disk else None, env)
-        replays = [explore_replay]
-        bc.launch_utils.fill_replay(
-            explore_replay, cfg.rlbench.task, env, cfg.rlbench.demos,
-            cfg.method.demo_augmentation, cfg.method.demo_augmentation_every_n)
-        agent = bc.launch_utils.create_agent(
-            cams[0], cfg.method.activation, cfg.method.lr,
-            cfg.method.weight_decay, cfg.rlbench.camera_resolution,
-            cfg.method.grad_clip, env.low_dim_state_len)
+
+    replays, replay_split = create_replays(
+        cfg, env, cams, replay_path if cfg.replay.use_disk else None)
+    explore_replay = replays[-1]
+    if isinstance(env, SyntheticRLBenchEnv):
+        all_actions = fill_synthetic_replays(
+            cfg, replays, cfg.rlbench.demos * cfg.rlbench.episode_length)
     else:
-        raise ValueError('Method %s does not exists.' % cfg.method.name)
+        all_actions = fill_replays(cfg, env, cams, replays)
+    action_min_max = None
+    if all_actions is not None:
+        action_min_max = np.min(all_actions, axis=0), np.max(all_actions,
+                                                             axis=0)
+        # Make translation bounds a little bigger
+        action_min_max = _modify_action_min_max(action_min_max)
+    agent = create_agent(cfg, env, cams, action_min_max)
 
     wrapped_replays = [PyTorchReplayBuffer(r) for r in replays]
     stat_accum = SimpleAccumulator(eval_video_fps=30)
@@ -275,17 +276,20 @@ def run_seed(cfg: DictConfig, env, cams, device, seed) -> None:
     torch.cuda.empty_cache()
 
 
-@hydra.main(config_name='config', config_path='conf')
-def main(cfg: DictConfig) -> None:
-    logging.info('\n' + OmegaConf.to_yaml(cfg))
+def _create_env(cfg: DictConfig):
+    if cfg.synthetic_env.enabled:
+        _check_synthetic_method(cfg)
+        kwargs = {k: v for k, v in cfg.synthetic_env.items()
+                  if k != 'enabled'}
+        return SyntheticRLBenchEnv(
+            cfg.rlbench.cameras, cfg.rlbench.camera_resolution,
+            cfg.rlbench.episode_length, cfg.rlbench.scene_bounds, **kwargs)
 
-    if cfg.framework.gpu is not None and torch.cuda.is_available():
-        device = torch.device("cuda:%d" % cfg.framework.gpu)
-        torch.cuda.set_device(cfg.framework.gpu)
-        torch.backends.cudnn.enabled = torch.backends.cudnn.benchmark = True
-    else:
-        device = torch.device("cpu")
-    logging.info('Using device %s.' % str(device))
+    from rlbench import ArmActionMode
+    from rlbench.action_modes import ActionMode, GripperActionMode
+    from rlbench.backend import task
+    from rlbench.backend.utils import task_file_to_task_class
+    from arm.custom_rlbench_env import CustomRLBenchEnv
 
     action_mode = ActionMode(
         ArmActionMode.ABS_EE_POSE_PLAN_WORLD_FRAME,
@@ -297,16 +301,31 @@ def main(cfg: DictConfig) -> None:
         raise ValueError('Task %s not recognised!.' % cfg.rlbench.task)
     task_class = task_file_to_task_class(cfg.rlbench.task)
 
-    cfg.rlbench.cameras = cfg.rlbench.cameras if isinstance(
-        cfg.rlbench.cameras, ListConfig) else [cfg.rlbench.cameras]
     obs_config = _create_obs_config(cfg.rlbench.cameras,
                                     cfg.rlbench.camera_resolution)
 
-    env = CustomRLBenchEnv(
+    return CustomRLBenchEnv(
         task_class=task_class, observation_config=obs_config,
         action_mode=action_mode, dataset_root=cfg.rlbench.demo_path,
         episode_length=cfg.rlbench.episode_length, headless=True)
 
+
+@hydra.main(config_name='config', config_path='conf')
+def main(cfg: DictConfig) -> None:
+    logging.info('\n' + OmegaConf.to_yaml(cfg))
+
+    if cfg.framework.gpu is not None and torch.cuda.is_available():
+        device = torch.device("cuda:%d" % cfg.framework.gpu)
+        torch.cuda.set_device(cfg.framework.gpu)
+        torch.backends.cudnn.enabled = torch.backends.cudnn.benchmark = True
+    else:
+        device = torch.device("cpu")
+    logging.info('Using device %s.' % str(device))
+
+    cfg.rlbench.cameras = cfg.rlbench.cameras if isinstance(
+        cfg.rlbench.cameras, ListConfig) else [cfg.rlbench.cameras]
+    env = _create_env(cfg)
+
     cwd = os.getcwd()
     logging.info('CWD:' + os.getcwd())
     existing_seeds = len(list(filter(lambda x: 'seed' in x, os.listdir(cwd))))
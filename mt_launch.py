@@ -1,15 +1,11 @@
 import os
 import pickle
+from collections import OrderedDict
 from os.path import join 
 os.environ["CUDA_DEVICE_ORDER"] = "PCI_BUS_ID"
 
 from typing import List
 import torch
-from pyrep.const import RenderMode
-from rlbench import CameraConfig, ObservationConfig, ArmActionMode
-from rlbench.action_modes import ActionMode, GripperActionMode
-from rlbench.backend import task
-from rlbench.backend.utils import task_file_to_task_class
 from yarr.replay_buffer.wrappers.pytorch_replay_buffer import \
     PyTorchReplayBuffer
 from yarr.runners.env_runner import EnvRunner
@@ -19,7 +15,6 @@ from yarr.utils.stat_accumulator import SimpleAccumulator
 from arm import arm
 from arm import c2farm
 from arm.baselines import bc, td3, dac, sac
-from arm.custom_rlbench_env import CustomRLBenchEnv, MultiTaskRLBenchEnv
 import numpy as np
 
 import hydra
@@ -30,6 +25,8 @@ from omegaconf import DictConfig, OmegaConf, ListConfig
 from extar.runners.multi_env_runner import MultiTaskEnvRunner
 from extar.runners.multi_task_trainer import MultiTaskPyTorchTrainer
 from extar.utils.logger import MultiTaskAccumulator, WandbLogWriter 
+from extar.envs.synthetic_env import MultiTaskSyntheticRLBenchEnv
+from extar.utils import synthetic_data
 
 SHORT_NAMES = {
     'pick_up_cup':          'cup',
@@ -53,14 +50,23 @@ def _gen_short_names(cfg: DictConfig): # just for logging dirs
     names = sorted(names)
     return f"{len(names)}tasks-" + "-".join(names)
 
-def _create_obs_config(camera_names: List[str], camera_resolution: List[int]):
+# PyRep and RLBench are imported where the simulator is needed, so that
+# synthetic_env runs without CoppeliaSim.
+
+
+def _create_obs_config(camera_names: List[str], camera_resolution: List[int],
+                       compact_depth: bool = False):
+    from pyrep.const import RenderMode
+    from rlbench import CameraConfig, ObservationConfig
+
     unused_cams = CameraConfig()
     unused_cams.set_all(False)
+    # With compact_depth, point clouds are rebuilt from depth on the learner.
     used_cams = CameraConfig(
         rgb=True,
-        point_cloud=True,
+        point_cloud=not compact_depth,
         mask=False,
-        depth=False,
+        depth=compact_depth,
         image_size=camera_resolution,
         render_mode=RenderMode.OPENGL)
 
@@ -102,12 +108,33 @@ def _modify_action_min_max(action_min_max):
     return action_min_max
 
 
+def _create_synthetic_replays(cfg: DictConfig, env, cams, save_dir):
+    """One replay per training task, as create_and_fill_replays makes them,
+    filled with random transitions instead of demos."""
+    data = synthetic_data.from_config(cfg)
+    replays = OrderedDict()
+    for task_name in env.train_tasks:
+        replays[task_name] = c2farm.launch_utils.create_replay(
+            int(cfg.replay.batch_size / env.n_train_tasks),
+            cfg.replay.timesteps, cfg.replay.prioritisation, save_dir, cams,
+            env, cfg.method.voxel_sizes, cfg.replay.replay_size)
+        data.fill(replays[task_name],
+                  cfg.rlbench.demos * cfg.rlbench.episode_length,
+                  cfg.rlbench.episode_length)
+    return replays
+
+
 def run_seed(cfg: DictConfig, env, cams, device, seed): # -> None:
     replay_ratio = None if cfg.framework.replay_ratio == 'None' else cfg.framework.replay_ratio
     replay_path = os.path.join(cfg.replay.path, cfg.short_names, cfg.method.name, 'seed%d' % seed)
     action_min_max = None
 
-    if cfg.method.name == 'C2FARM': 
+    if cfg.method.name == 'C2FARM' and cfg.synthetic_env.enabled:
+        replays = _create_synthetic_replays(
+            cfg, env, cams, replay_path if cfg.replay.use_disk else None)
+        agent = c2farm.launch_utils.create_agent(cfg, env)
+
+    elif cfg.method.name == 'C2FARM': 
         
         replays = c2farm.launch_utils.create_and_fill_replays(
                 cameras=cams, env=env, 
@@ -177,27 +204,27 @@ def run_seed(cfg: DictConfig, env, cams, device, seed): # -> None:
     torch.cuda.empty_cache()
 
 
-@hydra.main(config_name='mt_confg', config_path='/home/mandi/ARM/conf')
-def main(cfg: DictConfig): #-> None:
-    torch.multiprocessing.set_start_method('spawn')
-    cwd = os.getcwd()
-    tasks_name = _gen_short_names(cfg)
-    cfg.short_names = tasks_name
-    log_path = join(cwd, tasks_name, cfg.method.name+cfg.run_name)
-    os.makedirs(log_path, exist_ok=True)
-    existing_seeds = len(list(filter(lambda x: 'seed' in x, os.listdir(log_path))))
-    logging.info('Logging to:' + log_path)
-    cfg.log_path = log_path 
-    logging.info('\n' + OmegaConf.to_yaml(cfg))
+def _create_env(cfg: DictConfig):
+    if cfg.synthetic_env.enabled:
+        if cfg.method.name != 'C2FARM':
+            # _create_synthetic_replays only makes C2FARM's replays.
+            raise ValueError(
+                'The synthetic environment only supports C2FARM in '
+                'multi-task runs, not %s.' % cfg.method.name)
+        kwargs = {k: v for k, v in cfg.synthetic_env.items()
+                  if k != 'enabled'}
+        env_cfg = cfg.rlbench.single_env_cfg
+        return MultiTaskSyntheticRLBenchEnv(
+            cfg.rlbench.tasks, cfg.rlbench.eval_tasks, cfg.rlbench.cameras,
+            cfg.rlbench.camera_resolution, env_cfg.episode_length,
+            cfg.rlbench.scene_bounds, reward_scale=env_cfg.reward_scale,
+            state_includes_remaining_time=(
+                env_cfg.state_includes_remaining_time),
+            compact_depth=env_cfg.compact_depth, **kwargs)
 
-    if cfg.framework.gpu is not None and torch.cuda.is_available():
-        device = torch.device("cuda:%d" % cfg.framework.gpu)
-        torch.cuda.set_device(cfg.framework.gpu)
-        torch.backends.cudnn.enabled = torch.backends.cudnn.benchmark = True
-    else:
-        print("Warning: Using CPU training \n")
-        device = torch.device("cpu")
-    logging.info('Using device %s.' % str(device))
+    from rlbench import ArmActionMode
+    from rlbench.action_modes import ActionMode, GripperActionMode
+    from arm.custom_rlbench_env import MultiTaskRLBenchEnv
 
     action_mode = ActionMode(
         ArmActionMode.ABS_EE_POSE_PLAN_WORLD_FRAME,
@@ -211,9 +238,9 @@ def main(cfg: DictConfig): #-> None:
     for task in cfg.rlbench.tasks:
         assert task in task_files, 'Task %s not recognised!.' % task
 
-    cfg.rlbench.cameras = cfg.rlbench.cameras if isinstance(
-        cfg.rlbench.cameras, ListConfig) else [cfg.rlbench.cameras]
-    obs_config = _create_obs_config(cfg.rlbench.cameras, cfg.rlbench.camera_resolution)
+    obs_config = _create_obs_config(
+        cfg.rlbench.cameras, cfg.rlbench.camera_resolution,
+        cfg.rlbench.compact_depth)
 
     # train_envs = MultiTaskRLBenchEnv( cfg.rlbench.tasks, obs_config, action_mode, cfg.rlbench.single_env_cfg)
     # test_envs = MultiTaskRLBenchEnv( cfg.rlbench.test_tasks, obs_config, action_mode, cfg.rlbench.single_env_cfg)
@@ -224,6 +251,34 @@ def main(cfg: DictConfig): #-> None:
         obs_config, 
         action_mode, 
         **cfg.rlbench.single_env_cfg)
+    return env
+
+
+@hydra.main(config_name='mt_confg', config_path='/home/mandi/ARM/conf')
+def main(cfg: DictConfig): #-> None:
+    torch.multiprocessing.set_start_method('spawn')
+    cwd = os.getcwd()
+    tasks_name = _gen_short_names(cfg)
+    cfg.short_names = tasks_name
+    log_path = join(cwd, tasks_name, cfg.method.name+cfg.run_name)
+    os.makedirs(log_path, exist_ok=True)
+    existing_seeds = len(list(filter(lambda x: 'seed' in x, os.listdir(log_path))))
+    logging.info('Logging to:' + log_path)
+    cfg.log_path = log_path 
+    logging.info('\n' + OmegaConf.to_yaml(cfg))
+
+    if cfg.framework.gpu is not None and torch.cuda.is_available():
+        device = torch.device("cuda:%d" % cfg.framework.gpu)
+        torch.cuda.set_device(cfg.framework.gpu)
+        torch.backends.cudnn.enabled = torch.backends.cudnn.benchmark = True
+    else:
+        print("Warning: Using CPU training \n")
+        device = torch.device("cpu")
+    logging.info('Using device %s.' % str(device))
+
+    cfg.rlbench.cameras = cfg.rlbench.cameras if isinstance(
+        cfg.rlbench.cameras, ListConfig) else [cfg.rlbench.cameras]
+    env = _create_env(cfg)
  
     for seed in range(existing_seeds, existing_seeds + cfg.framework.seeds):
         run = wandb.init(project='rlbench', job_type='mt_launch')
@@ -0,0 +1,64 @@
+"""CropEngine against the grid_sample crops it replaces."""
+import pytest
+import torch
+import torch.nn.functional as F
+
+from arm.crop_utils import CropEngine
+
+
+def _grid_sample_crop(pixel_coords, observation, crop_size, bound_size):
+    # The Q-attention agents' crops from before CropEngine.
+    grid_for_crop = torch.arange(0, crop_size).unsqueeze(0).repeat(
+        crop_size, 1).unsqueeze(-1)
+    grid_for_crop = torch.cat([grid_for_crop.transpose(1, 0),
+                               grid_for_crop], dim=2).unsqueeze(0)
+    observation = observation.reshape(
+        observation.shape[0], -1, *observation.shape[-2:])
+    h = observation.shape[-1]
+    top_left_corner = torch.clamp(
+        pixel_coords - crop_size // 2, 0, h - bound_size)
+    grid = grid_for_crop + top_left_corner.unsqueeze(1).unsqueeze(1)
+    grid = ((grid / float(h)) * 2.0) - 1.0
+    grid = torch.cat((grid[:, :, :, 1:2], grid[:, :, :, 0:1]), dim=-1)
+    return F.grid_sample(observation, grid, mode='nearest',
+                         align_corners=True)
+
+
+def _coords(b, resolution):
+    # Random pixels, plus the corners, to cover the clamped crops.
+    coords = torch.randint(0, resolution, (b, 2))
+    coords[:4] = torch.tensor([[0, 0], [0, resolution - 1],
+                               [resolution - 1, 0],
+                               [resolution - 1, resolution - 1]])
+    return coords
+
+
+@pytest.mark.parametrize('resolution,crop_size,bound_size', [
+    (32, 16, None), (33, 8, None), (64, 17, None), (32, 8, 16)])
+@pytest.mark.parametrize('frames', [None, 2])
+def test_crops_match_grid_sample(resolution, crop_size, bound_size, frames):
+    torch.manual_seed(0)
+    engine = CropEngine(crop_size, bound_size)
+    stack = (3,) if frames is None else (frames, 3)
+    coords = [_coords(8, resolution), _coords(8, resolution)]
+    images = [[torch.randn((8,) + stack + (resolution, resolution)),
+               torch.randn((8,) + stack + (resolution, resolution))]
+              for _ in coords]
+    crops = engine.crop(coords, images)
+    for c, group, crop_group in zip(coords, images, crops):
+        for x, crop in zip(group, crop_group):
+            assert torch.equal(crop, _grid_sample_crop(
+                c, x, crop_size, bound_size or crop_size))
+
+
+def test_float_coordinates_are_grid_sampled():
+    torch.manual_seed(0)
+    engine = CropEngine(16)
+    coords = _coords(8, 32).float() + 0.5
+    image = torch.randn(8, 3, 32, 32)
+    crop, = engine.crop([coords], [[image]])[0]
+    assert torch.equal(crop, _grid_sample_crop(coords, image, 16, 16))
+    # Whole numbers as floats take the same path and crop the same pixels.
+    coords = coords.floor()
+    crop, = engine.crop([coords], [[image]])[0]
+    assert torch.equal(crop, engine.crop([coords.long()], [[image]])[0][0])
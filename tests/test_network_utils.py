@@ -0,0 +1,161 @@
+"""Equivalences the network_utils rewrites rely on."""
+import pytest
+import torch
+import torch.nn as nn
+
+from arm.network_utils import CNNAndFcsNet, Conv2DBlock, Conv3DBlock, \
+    Conv3DInceptionBlock, EnsembleForward, SiameseNet, _tile_low_dim
+
+LOW_DIM = 4
+
+
+def _tiled(x, low_dim):
+    return torch.cat([x, _tile_low_dim(low_dim, x)], dim=1)
+
+
+@pytest.mark.parametrize('padding_mode', ['replicate', 'zeros'])
+@pytest.mark.parametrize('kernel_size', [1, 3])
+def test_conv2d_low_dim_bias_matches_tiling(padding_mode, kernel_size):
+    torch.manual_seed(0)
+    block = Conv2DBlock(3 + LOW_DIM, 8, kernel_size, 1, activation='lrelu',
+                        padding_mode=padding_mode)
+    x, low_dim = torch.randn(2, 3, 6, 5), torch.randn(2, LOW_DIM)
+    torch.testing.assert_close(block(x, low_dim), block(_tiled(x, low_dim)),
+                               rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize('padding_mode', ['replicate', 'zeros'])
+@pytest.mark.parametrize('kernel_size,padding', [(1, None), (3, None),
+                                                 (3, 0)])
+def test_conv3d_low_dim_bias_matches_tiling(padding_mode, kernel_size,
+                                            padding):
+    torch.manual_seed(0)
+    block = Conv3DBlock(3 + LOW_DIM, 8, kernel_size, 1, activation='lrelu',
+                        padding_mode=padding_mode, padding=padding)
+    x, low_dim = torch.randn(2, 3, 5, 4, 6), torch.randn(2, LOW_DIM)
+    torch.testing.assert_close(block(x, low_dim), block(_tiled(x, low_dim)),
+                               rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize('residual', [False, True])
+def test_inception_low_dim_bias_matches_tiling(residual):
+    torch.manual_seed(0)
+    block = Conv3DInceptionBlock(3 + LOW_DIM, 16, activation='lrelu',
+                                 residual=residual)
+    x, low_dim = torch.randn(2, 3, 4, 4, 4), torch.randn(2, LOW_DIM)
+    torch.testing.assert_close(block(x, low_dim), block(_tiled(x, low_dim)),
+                               rtol=1e-5, atol=1e-5)
+
+
+class _UnfusedInceptionBlock(nn.Module):
+    """Conv3DInceptionBlock as it was before its 1x1 branches were fused,
+    for making old checkpoints."""
+
+    def __init__(self, in_channels, out_channels, norm=None, activation=None,
+                 residual=False):
+        super(_UnfusedInceptionBlock, self).__init__()
+        self._residual = residual
+        cs, latent = out_channels // 4, 32
+        self._1x1conv = Conv3DBlock(in_channels, cs * 2, 1, 1, norm,
+                                    activation)
+        self._1x1conv_a = Conv3DBlock(in_channels, latent, 1, 1, norm,
+                                      activation)
+        self._3x3conv = Conv3DBlock(latent, cs, 3, 1, norm, activation)
+        self._1x1conv_b = Conv3DBlock(in_channels, latent, 1, 1, norm,
+                                      activation)
+        self._5x5_via_3x3conv_a = Conv3DBlock(latent, latent, 3, 1, norm,
+                                              activation)
+        self._5x5_via_3x3conv_b = Conv3DBlock(latent, cs, 3, 1, norm,
+                                              activation)
+
+    def forward(self, x, low_dim=None):
+        yy = []
+        if self._residual:
+            yy = [x] if low_dim is None else [x, _tile_low_dim(low_dim, x)]
+        return torch.cat(yy + [
+            self._1x1conv(x, low_dim),
+            self._3x3conv(self._1x1conv_a(x, low_dim)),
+            self._5x5_via_3x3conv_b(self._5x5_via_3x3conv_a(
+                self._1x1conv_b(x, low_dim)))], 1)
+
+
+def _randomise(module):
+    # Away from the zero biases and unit norms they are initialised with.
+    for p in module.parameters():
+        p.data.normal_()
+    for n, b in module.named_buffers():
+        if n.endswith('running_mean'):
+            b.data.normal_()
+        elif n.endswith('running_var'):
+            b.data.uniform_(0.5, 1.5)
+
+
+@pytest.mark.parametrize('norm', [None, 'batch', 'group'])
+@pytest.mark.parametrize('residual', [False, True])
+def test_fused_inception_loads_unfused_checkpoints(norm, residual):
+    torch.manual_seed(0)
+    unfused = nn.Sequential(_UnfusedInceptionBlock(
+        3 + LOW_DIM, 16, norm, 'lrelu', residual)).eval()
+    _randomise(unfused)
+    fused = nn.Sequential(Conv3DInceptionBlock(
+        3 + LOW_DIM, 16, norm, 'lrelu', residual)).eval()
+    fused.load_state_dict(unfused.state_dict(), strict=True)
+
+    # In double, as the random weights grow the activations to ~1e3.
+    unfused.double()
+    fused.double()
+    x = torch.randn(2, 3, 4, 4, 4, dtype=torch.float64)
+    low_dim = torch.randn(2, LOW_DIM, dtype=torch.float64)
+    torch.testing.assert_close(fused[0](x, low_dim), unfused[0](x, low_dim))
+    x = torch.randn(2, 3 + LOW_DIM, 4, 4, 4, dtype=torch.float64)
+    torch.testing.assert_close(fused(x), unfused(x))
+
+
+def _critic(norm):
+    siamese = SiameseNet([3, 3], [8], [3], [1], norm=norm,
+                         activation='lrelu')
+    critic = CNNAndFcsNet(
+        siamese, LOW_DIM, [16, 16], [8, 8], [3, 3], [2, 2], norm=norm,
+        fc_layers=[16, 1], activation='lrelu')
+    critic.build()
+    _randomise(critic)
+    return critic.double()
+
+
+def _critic_inputs():
+    return ([torch.randn(4, 3, 16, 16, dtype=torch.float64),
+             torch.randn(4, 3, 16, 16, dtype=torch.float64)],
+            torch.randn(4, LOW_DIM, dtype=torch.float64))
+
+
+@pytest.mark.parametrize('members', [2, 3])
+@pytest.mark.parametrize('norm', [None, 'group', 'instance', 'layer'])
+def test_ensemble_forward_matches_separate_critics(members, norm):
+    torch.manual_seed(0)
+    critics = [_critic(norm) for _ in range(members)]
+    fused = EnsembleForward(critics, cpu=True)
+    assert fused.fused
+    obs, low_dim = _critic_inputs()
+
+    separate = [c(obs, low_dim) for c in critics]
+    sum(q.sum() for q in separate).backward()
+    grads = [[p.grad.clone() for p in c.parameters()] for c in critics]
+    for critic in critics:
+        critic.zero_grad()
+    together = fused(obs, low_dim)
+    sum(q.sum() for q in together).backward()
+    for a, b in zip(together, separate):
+        torch.testing.assert_close(a, b)
+    for critic, expected in zip(critics, grads):
+        for p, g in zip(critic.parameters(), expected):
+            torch.testing.assert_close(p.grad, g)
+
+
+def test_ensemble_forward_calls_unfusable_critics_in_turn():
+    torch.manual_seed(0)
+    critics = [_critic('batch') for _ in range(2)]
+    fused = EnsembleForward(critics, cpu=True)
+    assert not fused.fused
+    obs, low_dim = _critic_inputs()
+    for a, c in zip(fused(obs, low_dim), critics):
+        torch.testing.assert_close(a, c(obs, low_dim))
@@ -0,0 +1,87 @@
+"""The array-backed sum tree and the prioritized replay built on it."""
+import numpy as np
+import pytest
+import torch
+
+pytest.importorskip('yarr.replay_buffer.prioritized_replay_buffer')
+from yarr.utils.observation_type import ObservationElement  # noqa: E402
+
+from arm.prioritized_replay_buffer import PrioritizedReplayBuffer, \
+    SumTree  # noqa: E402
+
+PRIORITIES = np.array([1., 2., 0., 3., 4., 0., 0.5])
+
+
+def _tree():
+    tree = SumTree(len(PRIORITIES))
+    tree.update(np.arange(len(PRIORITIES)), PRIORITIES)
+    return tree
+
+
+def _frequencies(indices):
+    return np.bincount(indices, minlength=len(PRIORITIES)) / float(
+        len(indices))
+
+
+def test_sample_follows_the_priorities():
+    np.random.seed(0)
+    frequencies = _frequencies(_tree().sample(200000))
+    np.testing.assert_allclose(
+        frequencies, PRIORITIES / PRIORITIES.sum(), atol=5e-3)
+    assert frequencies[PRIORITIES == 0].sum() == 0
+
+
+def test_stratified_sample_follows_the_priorities():
+    np.random.seed(0)
+    tree = _tree()
+    frequencies = _frequencies(np.concatenate(
+        [tree.stratified_sample(32) for _ in range(5000)]))
+    np.testing.assert_allclose(
+        frequencies, PRIORITIES / PRIORITIES.sum(), atol=5e-3)
+    assert frequencies[PRIORITIES == 0].sum() == 0
+
+
+def test_update_keeps_the_sums():
+    tree = _tree()
+    tree.update([1, 1, 4], [5., 6., 0.])
+    expected = PRIORITIES.copy()
+    expected[[1, 4]] = [6., 0.]
+    np.testing.assert_array_equal(tree.get(np.arange(len(expected))),
+                                  expected)
+    assert tree._total_priority() == pytest.approx(expected.sum())
+    assert tree.max_recorded_priority == 6.
+    with pytest.raises(ValueError):
+        tree.update([0], [-1.])
+
+
+def _replay(timesteps: int, transitions: int):
+    replay = PrioritizedReplayBuffer(
+        batch_size=8, timesteps=timesteps, replay_capacity=40,
+        action_shape=(2,), observation_elements=[
+            ObservationElement('low_dim_state', (3,), np.float32)])
+    for t in range(transitions):
+        terminal = (t + 1) % 7 == 0
+        replay.add(np.zeros(2, np.float32), 0., terminal, False,
+                   low_dim_state=np.full(3, t, np.float32))
+        if terminal:
+            replay.add_final(low_dim_state=np.zeros(3, np.float32))
+    return replay
+
+
+def test_set_priority():
+    replay = _replay(1, 30)
+    replay.set_priority(np.array([3, 5]), torch.tensor([2.5, 0.]))
+    np.testing.assert_array_equal(replay.get_priority(np.array([3, 5])),
+                                  [2.5, 0.])
+    np.random.seed(0)
+    assert 5 not in replay.sample_index_batch(256)
+
+
+@pytest.mark.parametrize('timesteps', [1, 2, 3])
+@pytest.mark.parametrize('transitions', [20, 100])
+def test_valid_transitions_match_is_valid_transition(timesteps, transitions):
+    replay = _replay(timesteps, transitions)
+    indices = np.arange(replay.replay_capacity)
+    np.testing.assert_array_equal(
+        replay._valid_transitions(indices),
+        [replay.is_valid_transition(i) for i in indices])
@@ -0,0 +1,78 @@
+"""MultiTaskReplaySampler's fast path against YARR's own sampling."""
+import numpy as np
+import pytest
+
+pytest.importorskip('yarr.replay_buffer.uniform_replay_buffer')
+from yarr.replay_buffer.prioritized_replay_buffer import \
+    PrioritizedReplayBuffer  # noqa: E402
+from yarr.replay_buffer.replay_buffer import ReplayElement  # noqa: E402
+from yarr.replay_buffer.uniform_replay_buffer import \
+    UniformReplayBuffer  # noqa: E402
+from yarr.replay_buffer.wrappers.pytorch_replay_buffer import \
+    PyTorchReplayBuffer  # noqa: E402
+from yarr.utils.observation_type import ObservationElement  # noqa: E402
+
+from extar.utils.replay_sampler import MultiTaskReplaySampler  # noqa: E402
+
+CAPACITY = 40
+EPISODE_LENGTH = 7
+# Fills that leave the buffers part empty, and that wrap around them.
+TRANSITIONS = [20, 100]
+
+
+def _replay(replay_class, transitions: int, seed: int):
+    rng = np.random.RandomState(seed)
+    replay = replay_class(
+        batch_size=8, timesteps=1, replay_capacity=CAPACITY,
+        action_shape=(2,), observation_elements=[
+            ObservationElement('low_dim_state', (3,), np.float32),
+            ObservationElement('front_rgb', (3, 2, 2), np.uint8)],
+        extra_replay_elements=[ReplayElement('demo', (), np.bool_)])
+
+    def obs():
+        return {'low_dim_state': rng.normal(size=3).astype(np.float32),
+                'front_rgb': rng.randint(256, size=(3, 2, 2)).astype(
+                    np.uint8)}
+
+    for t in range(transitions):
+        terminal = (t + 1) % EPISODE_LENGTH == 0
+        replay.add(rng.normal(size=2).astype(np.float32), float(t), terminal,
+                   False, demo=bool(t % 2), **obs())
+        if terminal:
+            replay.add_final(**obs())
+    return replay
+
+
+@pytest.mark.parametrize('transitions', TRANSITIONS)
+def test_batches_match_sample_transition_batch(transitions):
+    replays = [_replay(UniformReplayBuffer, transitions, 0),
+               _replay(PrioritizedReplayBuffer, transitions, 1)]
+    sampler = MultiTaskReplaySampler(
+        [PyTorchReplayBuffer(r) for r in replays], [0.5, 0.5], batch_size=16)
+    assert sampler._fast == [True, True]
+    np.random.seed(0)
+    for _ in range(20):
+        batch = {k: v.numpy() for k, v in sampler.sample().items()}
+        for b, replay in enumerate(replays):
+            rows = slice(sampler._offsets[b], sampler._offsets[b + 1])
+            indices = batch['indices'][rows]
+            assert all(replay.is_valid_transition(i) for i in indices)
+            stock = replay.sample_transition_batch(
+                batch_size=len(indices), indices=indices, pack_in_dict=True)
+            for name, array in batch.items():
+                np.testing.assert_array_equal(
+                    array[rows],
+                    np.asarray(stock[name]).reshape(array[rows].shape),
+                    err_msg=name)
+
+
+@pytest.mark.parametrize('transitions', TRANSITIONS)
+def test_uniform_indices_are_the_valid_transitions(transitions):
+    replay = _replay(UniformReplayBuffer, transitions, 0)
+    sampler = MultiTaskReplaySampler(
+        [PyTorchReplayBuffer(replay)], [1.0], batch_size=64)
+    np.random.seed(0)
+    drawn = np.concatenate(
+        [sampler._sample_indices()[0] for _ in range(50)])
+    valid = [i for i in range(CAPACITY) if replay.is_valid_transition(i)]
+    assert set(drawn.tolist()) == set(valid)
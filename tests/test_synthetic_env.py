@@ -0,0 +1,84 @@
+"""Smoke tests of the simulator-free stand-in environment and replay fill."""
+import numpy as np
+import pytest
+
+pytest.importorskip('yarr.replay_buffer.uniform_replay_buffer')
+from yarr.agents.agent import ActResult  # noqa: E402
+
+from arm.c2farm.launch_utils import create_replay  # noqa: E402
+from extar.envs.synthetic_env import SyntheticRLBenchEnv  # noqa: E402
+from extar.utils.synthetic_data import SyntheticData  # noqa: E402
+
+CAMERAS = ['front', 'wrist']
+RESOLUTION = [16, 16]
+SCENE_BOUNDS = [-0.3, -0.5, 0.6, 0.7, 0.5, 1.6]
+VOXEL_SIZES = [16, 16]
+EPISODE_LENGTH = 5
+
+
+def _env(**kwargs):
+    env = SyntheticRLBenchEnv(CAMERAS, RESOLUTION, EPISODE_LENGTH,
+                              SCENE_BOUNDS, **kwargs)
+    env.launch()
+    return env
+
+
+def _replay(env, prioritisation=True, save_dir=None):
+    return create_replay(4, 1, prioritisation, save_dir, CAMERAS, env,
+                         VOXEL_SIZES, replay_size=100)
+
+
+def _check_obs(env, obs):
+    assert sorted(obs) == sorted(e.name for e in env.observation_elements)
+    for e in env.observation_elements:
+        assert obs[e.name].shape == e.shape, e.name
+        assert obs[e.name].dtype == e.type, e.name
+
+
+def test_reset_and_step():
+    env = _env(success_rate=0.5)
+    _check_obs(env, env.reset())
+    terminal = False
+    for _ in range(100):
+        transition = env.step(ActResult(np.zeros(8, np.float32)))
+        _check_obs(env, transition.observation)
+        terminal |= transition.terminal
+        if transition.terminal:
+            assert transition.reward == env._reward_scale
+            env.reset()
+    assert terminal
+
+
+def test_fill_c2farm_replay():
+    env = _env()
+    replay = _replay(env)
+    actions = SyntheticData(SCENE_BOUNDS, RESOLUTION, VOXEL_SIZES).fill(
+        replay, 30, EPISODE_LENGTH)
+    assert actions.shape == (30, 8)
+    np.testing.assert_allclose(np.linalg.norm(actions[:, 3:7], axis=1), 1.,
+                               rtol=1e-5)
+    batch = replay.sample_transition_batch(pack_in_dict=True)
+    assert np.all(batch['trans_action_indicies'] < VOXEL_SIZES[0])
+    for n in CAMERAS:
+        assert np.all(batch['%s_pixel_coord' % n] < RESOLUTION[0])
+
+
+def test_observations_load_from_a_disk_replay(tmp_path):
+    replay = _replay(_env(), prioritisation=False, save_dir=str(tmp_path))
+    SyntheticData(SCENE_BOUNDS, RESOLUTION, VOXEL_SIZES).fill(
+        replay, 12, EPISODE_LENGTH)
+    recorded = len(list(tmp_path.glob('*.replay')))
+    assert recorded == replay.add_count
+
+    env = _env(observation_dir=str(tmp_path))
+    assert len(env._pool) == recorded
+    for obs in env._pool:
+        _check_obs(env, obs)
+    stored = replay.sample_transition_batch(
+        batch_size=1, indices=np.array([0]), pack_in_dict=True)
+    for name, value in env._pool[0].items():
+        np.testing.assert_array_equal(
+            value, np.asarray(stored[name]).reshape(value.shape))
+
+    env = _env(observation_dir=str(tmp_path), observation_pool=3)
+    assert len(env._pool) == 3